@@ -0,0 +1,40 @@
+"""
+Times the post-processing in scenera.node.postprocess against the same steps
+written as plain Python loops, as nodes used to. Run from the repository root:
+
+    python -m benchmarks.postprocess_benchmark
+"""
+
+import random
+import timeit
+from scenera.node.postprocess import iou_matrix, nms, np, to_relative
+from tests.node.postprocess_tests import generate_boxes, naive_iou_matrix, naive_nms
+
+def naive_to_relative(boxes, width, height):
+    return [[x1 / width, y1 / height, x2 / width, y2 / height] for x1, y1, x2, y2 in boxes]
+
+def report(name, loop, vectorized, number = 10):
+    loop_time = min(timeit.repeat(loop, number = number, repeat = 3)) / number
+    vectorized_time = min(timeit.repeat(vectorized, number = number, repeat = 3)) / number
+    print(f"{name:<36} loop {loop_time * 1e3:9.3f} ms   numpy {vectorized_time * 1e3:8.3f} ms"
+        f"   {loop_time / vectorized_time:6.1f}x")
+
+def main():
+    rng = random.Random(0)
+    for size in (100, 500, 2000):
+        boxes = generate_boxes(rng, size)
+        scores = [rng.random() for _ in boxes]
+        class_ids = [rng.randrange(5) for _ in boxes]
+        array = np.array(boxes)
+        report(f"to_relative, {size} boxes",
+            lambda: naive_to_relative(boxes, 1920, 1080),
+            lambda: to_relative(array, 1920, 1080))
+        report(f"iou_matrix, {size} x {size} boxes",
+            lambda: naive_iou_matrix(boxes, boxes),
+            lambda: iou_matrix(array, array), number = 1)
+        report(f"class-aware nms, {size} boxes",
+            lambda: naive_nms(boxes, scores, 0.5, class_ids),
+            lambda: nms(array, scores, 0.5, class_ids), number = 1)
+
+if __name__ == '__main__':
+    main()
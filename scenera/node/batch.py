@@ -0,0 +1,185 @@
+"""
+DetectedObjects in bulk, straight from the arrays a model outputs. Needs numpy,
+which is installed with pip install scenera.node[numpy].
+"""
+
+import logging
+from .logger import configure_logger
+from .records import BoundingBox, DetectedObject
+from .spec import NICEItemType
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+class DetectionBatch:
+    """
+    The DetectedObjects of one AnalysisList item, kept as columns. Pass it to
+    add_analysis_list_item as detected_objects. The NICEItemTypes are checked
+    once per distinct class, and the columns are only turned into DetectedObjects
+    when the SceneMark is validated or returned. The arrays are referenced, not
+    copied, so don't change them until the SceneMark is returned.
+
+    :Example:
+
+    batch = DetectionBatch(boxes, scores, class_ids, {0: "Human", 2: "Vehicle"},
+        related_scenedata = scenedata_id)
+    scenemark.add_analysis_list_item("Detected", "ItemPresence", detected_objects = batch)
+
+    :param boxes: N x 4 array of (x, y, width, height), x and y being the top-left corner
+    :type boxes: array_like
+    :param scores: N Probabilities
+    :type scores: array_like
+    :param class_ids: N class IDs of the model
+    :type class_ids: array_like
+    :param class_map: class ID -> NICEItemType, for every class ID in the batch
+    :type class_map: dict
+    :param related_scenedata: SceneDataID the detections were made on, one for all,
+        or one per detection, defaults to "None"
+    :type related_scenedata: string or list
+    :param frame: Frame of the detections, defaults to 0
+    :type frame: int
+    :param timestamp: TimeStamp of the detections, defaults to ""
+    :type timestamp: string
+    :param item_ids: N ItemIDs, e.g. track IDs, defaults to ""
+    :type item_ids: list
+
+    :raises ImportError: When numpy is not installed.
+    :raises AssertionError: When the arrays don't have the same number of detections.
+    :raises AssertionError: When a class ID maps to no NICEItemType of the Spec.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(
+        self,
+        boxes,
+        scores,
+        class_ids,
+        class_map : dict,
+        related_scenedata = "None",
+        frame : int = 0,
+        timestamp : str = "",
+        item_ids = None,
+        ):
+        # pylint: disable=too-many-arguments
+        if np is None:
+            raise ImportError("DetectionBatch needs numpy, pip install scenera.node[numpy]")
+        self.boxes = np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype = np.float64).reshape(-1)
+        class_ids = np.asarray(class_ids).reshape(-1)
+        size = len(self.boxes)
+        assert len(self.scores) == size and len(class_ids) == size, \
+            logger.exception("boxes, scores and class_ids differ in length")
+
+        # Each distinct class is looked up once, and spread over the batch
+        classes, positions = np.unique(class_ids, return_inverse = True)
+        item_types = []
+        for class_id in classes.tolist():
+            item_type = class_map.get(class_id)
+            assert item_type in NICEItemType, \
+                logger.exception(f"Class ID {class_id} maps to no NICEItemType of the Spec")
+            item_types.append(item_type)
+        self.item_types = np.array(item_types, dtype = object)[positions.reshape(-1)]
+
+        if not isinstance(related_scenedata, str):
+            related_scenedata = list(related_scenedata)
+            assert len(related_scenedata) == size, \
+                logger.exception("related_scenedata differs in length from the boxes")
+        self.related_scenedata = related_scenedata
+        if item_ids is not None:
+            item_ids = [str(item_id) for item_id in item_ids]
+            assert len(item_ids) == size, \
+                logger.exception("item_ids differs in length from the boxes")
+        self.item_ids = item_ids
+        self.frame = int(frame)
+        self.timestamp = timestamp
+        self._records = None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def select(self, indices):
+        """
+        A batch of some of the detections, e.g. those inside a region of interest.
+        The NICEItemTypes are not checked again.
+
+        :param indices: indices of the detections to keep, or a boolean mask
+        :type indices: array_like
+        :rtype: DetectionBatch
+        """
+        indices = np.flatnonzero(indices) if np.asarray(indices).dtype == bool \
+            else np.asarray(indices, dtype = np.intp).reshape(-1)
+        selected = object.__new__(DetectionBatch)
+        selected.boxes = self.boxes[indices]
+        selected.scores = self.scores[indices]
+        selected.item_types = self.item_types[indices]
+        selected.related_scenedata = self.related_scenedata \
+            if isinstance(self.related_scenedata, str) \
+            else [self.related_scenedata[index] for index in indices.tolist()]
+        selected.item_ids = None if self.item_ids is None \
+            else [self.item_ids[index] for index in indices.tolist()]
+        selected.frame = self.frame
+        selected.timestamp = self.timestamp
+        selected._records = None
+        return selected
+
+    def __repr__(self):
+        return f"DetectionBatch({len(self)} detections)"
+
+    def _columns(self):
+        size = len(self)
+        related_scenedata = self.related_scenedata
+        if isinstance(related_scenedata, str):
+            related_scenedata = [related_scenedata] * size
+        item_ids = self.item_ids if self.item_ids is not None else [""] * size
+        # tolist converts a whole column to Python objects at once
+        return zip(self.item_types.tolist(), related_scenedata, item_ids,
+            self.scores.tolist(), self.boxes.tolist())
+
+    def to_list(self):
+        """
+        The DetectedObjects as they are written in the SceneMark,
+        see SceneMark.generate_detected_object_item.
+
+        :rtype: list
+        """
+        frame = self.frame
+        timestamp = self.timestamp
+        return [{
+            'NICEItemType': item_type,
+            'RelatedSceneData': scenedata_id,
+            'CustomItemType': "",
+            'ItemID': item_id,
+            'ItemTypeCount': 1,
+            'Probability': score,
+            'Frame': frame,
+            'TimeStamp': timestamp,
+            'DirectionalMovement': None,
+            'Attributes': [],
+            'BoundingBox': {
+                'XCoordinate': x,
+                'YCoordinate': y,
+                'Height': height,
+                'Width': width,
+                },
+            } for item_type, scenedata_id, item_id, score, (x, y, width, height)
+                in self._columns()]
+
+    def __iter__(self):
+        """
+        The detections as DetectedObject records, made on first use, so lookups
+        on the SceneMark return the same objects each time. Changing the
+        records doesn't change the batch.
+        """
+        if self._records is None:
+            self._records = [
+                DetectedObject(
+                    item_type, scenedata_id, item_id = item_id, probability = score,
+                    frame = self.frame, timestamp = self.timestamp,
+                    bounding_box = BoundingBox(x, y, height, width))
+                for item_type, scenedata_id, item_id, score, (x, y, width, height)
+                    in self._columns()]
+        return iter(self._records)
@@ -0,0 +1,188 @@
+"""
+Embedded SceneData as buffers: decoding the base64 payload of a SceneData
+item, embedding a buffer without encoding it up front, and keeping large
+payloads in memory mapped temporary files.
+"""
+
+import binascii
+import logging
+import mmap
+import os
+import tempfile
+from .logger import configure_logger
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+def decode_embedded_scenedata(encoded):
+    """
+    Decodes a base64 EmbeddedSceneData value.
+
+    :param encoded: the base64 encoded payload
+    :type encoded: string or bytes
+    :return: the payload, read-only
+    :rtype: memoryview
+    :raises binascii.Error: The value is not valid base64.
+    """
+    return memoryview(binascii.a2b_base64(encoded))
+
+def encode_embedded_scenedata(buffer):
+    """
+    Base64 encodes a payload for EmbeddedSceneData.
+
+    :param buffer: the payload
+    :type buffer: bytes-like object
+    :return: the base64 encoded payload
+    :rtype: string
+    """
+    return binascii.b2a_base64(buffer, newline = False).decode("ascii")
+
+class EmbeddedSceneData:
+    """
+    A payload to embed in a SceneData item, given as any object supporting the
+    buffer protocol (bytes, bytearray, memoryview, a numpy array, ...). The buffer
+    is referenced, not copied, and only base64 encoded when the SceneMark is
+    serialized, so the encoded copy never outlives the serialization.
+    Don't change the buffer until the SceneMark is returned.
+
+    :param buffer: the payload
+    :type buffer: bytes-like object
+    :raises TypeError: The object doesn't support the buffer protocol,
+        or is not contiguous.
+    """
+    __slots__ = ("buffer",)
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer).cast("B")
+
+    def __len__(self):
+        return self.buffer.nbytes
+
+    def __repr__(self):
+        return f"EmbeddedSceneData({self.buffer.nbytes} bytes)"
+
+    def to_base64(self):
+        """
+        The payload as it is written in the SceneMark.
+
+        :return: the base64 encoded payload
+        :rtype: string
+        """
+        return encode_embedded_scenedata(self.buffer)
+
+def _base64_length(nbytes : int):
+    return (nbytes + 2) // 3 * 4
+
+class SpilledSceneData(EmbeddedSceneData):
+    """
+    Embedded SceneData kept in an anonymous temporary file instead of on the
+    heap, and served as a read-only view of the memory mapped file. The file
+    is removed once the object and all views of it are gone.
+
+    :param file: an open temporary file holding the decoded payload
+    :type file: file object
+    """
+    __slots__ = ()
+    # Multiple of 3 bytes, so the base64 chunks can simply be concatenated
+    CHUNK_SIZE = 3 * 2**16
+
+    def __init__(self, file):
+        file.flush()
+        if os.fstat(file.fileno()).st_size == 0:
+            # An empty file can't be mapped
+            super().__init__(b"")
+        else:
+            # The mapping stays valid after the file is closed
+            super().__init__(mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ))
+        file.close()
+
+    @classmethod
+    def from_buffer(cls, buffer, directory : str = None):
+        """
+        Spills a payload to a temporary file.
+
+        :param buffer: the payload
+        :type buffer: bytes-like object
+        :param directory: where to create the file, defaults to the system's
+            temporary directory
+        :type directory: string
+        :rtype: SpilledSceneData
+        """
+        file = tempfile.TemporaryFile(dir = directory)
+        file.write(buffer)
+        return cls(file)
+
+    @classmethod
+    def from_base64(cls, encoded, directory : str = None):
+        """
+        Decodes a base64 payload into a temporary file, a chunk at a time.
+
+        :param encoded: the base64 encoded payload
+        :type encoded: string or bytes
+        :param directory: where to create the file, defaults to the system's
+            temporary directory
+        :type directory: string
+        :rtype: SpilledSceneData
+        :raises binascii.Error: The value is not valid base64.
+        """
+        file = tempfile.TemporaryFile(dir = directory)
+        try:
+            try:
+                chunk_size = _base64_length(cls.CHUNK_SIZE)
+                for start in range(0, len(encoded), chunk_size):
+                    file.write(binascii.a2b_base64(encoded[start:start + chunk_size]))
+            except binascii.Error:
+                # The chunks don't end on 4 characters, e.g. due to line breaks
+                file.seek(0)
+                file.truncate()
+                file.write(binascii.a2b_base64(encoded))
+        except Exception:
+            file.close()
+            raise
+        return cls(file)
+
+    def __repr__(self):
+        return f"SpilledSceneData({self.buffer.nbytes} bytes)"
+
+    def base64_length(self):
+        """
+        Length of the payload once base64 encoded.
+
+        :rtype: int
+        """
+        return _base64_length(self.buffer.nbytes)
+
+    def iter_base64(self):
+        """
+        Encodes the payload a chunk at a time, so it's never encoded as a whole.
+
+        :return: the base64 encoded payload, in chunks
+        :rtype: generator of bytes
+        """
+        for start in range(0, self.buffer.nbytes, self.CHUNK_SIZE):
+            yield binascii.b2a_base64(
+                self.buffer[start:start + self.CHUNK_SIZE], newline = False)
+
+class StreamedBody:
+    """
+    A serialized SceneMark with spilled payloads in it, which are encoded
+    while the body is sent. Passed as data to requests, which uses the length
+    for the Content-Length header and sends the chunks as they are iterated.
+
+    :param parts: the JSON around the payloads, and the payloads
+    :type parts: list of bytes and SpilledSceneData
+    """
+    def __init__(self, parts : list):
+        self.parts = parts
+
+    def __len__(self):
+        return sum(
+            part.base64_length() if isinstance(part, SpilledSceneData) else len(part)
+            for part in self.parts)
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, SpilledSceneData):
+                yield from part.iter_base64()
+            else:
+                yield part
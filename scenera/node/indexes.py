@@ -0,0 +1,468 @@
+"""
+Indexes over the lists of a SceneMark, so lookups don't scan the lists.
+The SceneMark keeps them up to date as items are added through its methods.
+"""
+
+import bisect
+import logging
+from .logger import configure_logger
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+class SceneDataIndex:
+    """
+    SceneDataID -> items and SceneDataURI -> items of a SceneDataList, in list
+    order. The index is rebuilt when the list is replaced or its length changes
+    other than through added, e.g. when items are appended or removed directly.
+    Call invalidate after changing the SceneDataID or SceneDataURI of an item.
+
+    :Example:
+
+    index = SceneDataIndex()
+    index.items_with_id(scenemark['SceneDataList'], scenedata_id)
+    """
+    def __init__(self):
+        self._list = None
+        self._length = 0
+        self._by_id = {}
+        self._by_uri = {}
+
+    def _index(self, item):
+        self._by_id.setdefault(item.get('SceneDataID'), []).append(item)
+        self._by_uri.setdefault(item.get('SceneDataURI'), []).append(item)
+
+    def update(self, scenedata_list : list):
+        """
+        Brings the index up to date with the list, if it isn't.
+
+        :param scenedata_list: the SceneDataList
+        :type scenedata_list: list
+        """
+        if scenedata_list is self._list and len(scenedata_list) == self._length:
+            return
+        self._by_id = {}
+        self._by_uri = {}
+        for item in scenedata_list:
+            self._index(item)
+        self._list = scenedata_list
+        self._length = len(scenedata_list)
+
+    def invalidate(self):
+        """
+        Makes the next lookup rebuild the index.
+        """
+        self._list = None
+
+    def added(self, scenedata_list : list, item : dict):
+        """
+        Adds an item that was just appended to the list.
+
+        :param scenedata_list: the SceneDataList
+        :type scenedata_list: list
+        :param item: the appended SceneData item
+        :type item: dict
+        """
+        if scenedata_list is self._list and len(scenedata_list) == self._length + 1:
+            self._index(item)
+            self._length += 1
+
+    def items_with_id(self, scenedata_list : list, scenedata_id : str):
+        """
+        The SceneData items with a SceneDataID.
+
+        :param scenedata_list: the SceneDataList
+        :type scenedata_list: list
+        :param scenedata_id: SceneDataID
+        :type scenedata_id: string
+        :return: the items in list order, empty if there are none
+        :rtype: list
+        """
+        self.update(scenedata_list)
+        return self._by_id.get(scenedata_id, [])
+
+    def items_with_uri(self, scenedata_list : list, scenedata_uri : str):
+        """
+        The SceneData items with a SceneDataURI.
+
+        :param scenedata_list: the SceneDataList
+        :type scenedata_list: list
+        :param scenedata_uri: SceneDataURI
+        :type scenedata_uri: string
+        :return: the items in list order, empty if there are none
+        :rtype: list
+        """
+        self.update(scenedata_list)
+        return self._by_uri.get(scenedata_uri, [])
+
+def _detected_objects(analysis_item):
+    return analysis_item.get('DetectedObjects') or ()
+
+def _append_position(index : dict, key, position : int):
+    positions = index.setdefault(key, [])
+    # An attribute given twice on one DetectedObject is indexed once
+    if not positions or positions[-1] != position:
+        positions.append(position)
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _has_attribute(detected_object, attribute):
+    for item in detected_object.get('Attributes') or ():
+        if isinstance(attribute, str):
+            if item.get('Attribute') == attribute:
+                return True
+        elif (item.get('Attribute'), item.get('Value')) == attribute:
+            return True
+    return False
+
+class DetectionIndex:
+    """
+    Indexes the DetectedObjects of an AnalysisList by RelatedSceneData,
+    NICEItemType, Probability, Attributes, and the VersionNumber and EventType of
+    their AnalysisList item. Lookups return DetectedObjects in the order they
+    appear in the list. Built on the first lookup, so SceneMarks that are never
+    queried don't pay for it. The index is rebuilt when the list is replaced, or
+    when the number of AnalysisList items changes other than through added.
+    Changes inside the items are not noticed, so call invalidate after changing
+    DetectedObjects in place, e.g. appending to the DetectedObjects of an item.
+
+    :Example:
+
+    index = DetectionIndex()
+    index.related_to(scenemark['AnalysisList'], scenedata_id)
+    index.find(scenemark['AnalysisList'], item_type = "Human", min_probability = 0.5)
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self):
+        self._list = None
+        self._length = 0
+        self._clear()
+
+    def _clear(self):
+        # pylint: disable=attribute-defined-outside-init
+        self._detected_objects = []
+        self._analysis_items = []
+        self._by_related_scenedata = {}
+        self._by_item_type = {}
+        self._by_version = {}
+        self._by_event_type = {}
+        # Attribute -> positions, and (Attribute, Value) -> positions
+        self._by_attribute = {}
+        # (Probability, position), sorted when queried
+        self._by_probability = []
+        self._probability_sorted = True
+
+    @property
+    def built(self):
+        """
+        Whether the index was built, i.e. looked up since it was last invalidated.
+
+        :rtype: bool
+        """
+        return self._list is not None
+
+    def _index(self, analysis_item):
+        version = analysis_item.get('VersionNumber')
+        event_type = analysis_item.get('EventType')
+        for detected_object in _detected_objects(analysis_item):
+            position = len(self._detected_objects)
+            self._detected_objects.append(detected_object)
+            self._analysis_items.append(analysis_item)
+            self._by_related_scenedata.setdefault(
+                detected_object.get('RelatedSceneData'), []).append(detected_object)
+            _append_position(self._by_item_type, detected_object.get('NICEItemType'), position)
+            _append_position(self._by_version, version, position)
+            _append_position(self._by_event_type, event_type, position)
+            for attribute in detected_object.get('Attributes') or ():
+                name = attribute.get('Attribute')
+                _append_position(self._by_attribute, name, position)
+                _append_position(self._by_attribute, (name, attribute.get('Value')), position)
+            probability = detected_object.get('Probability')
+            if _is_number(probability):
+                if self._by_probability and self._by_probability[-1][0] > probability:
+                    self._probability_sorted = False
+                self._by_probability.append((probability, position))
+
+    def update(self, analysis_list : list):
+        """
+        Brings the index up to date with the list, if it isn't.
+
+        :param analysis_list: the AnalysisList
+        :type analysis_list: list
+        """
+        if analysis_list is self._list and len(analysis_list) == self._length:
+            return
+        self._clear()
+        for analysis_item in analysis_list:
+            self._index(analysis_item)
+        self._list = analysis_list
+        self._length = len(analysis_list)
+
+    def invalidate(self):
+        """
+        Makes the next lookup rebuild the index.
+        """
+        self._list = None
+
+    def added(self, analysis_list : list, analysis_item : dict):
+        """
+        Adds an item that was just appended to the list. Does nothing while
+        the index isn't built.
+
+        :param analysis_list: the AnalysisList
+        :type analysis_list: list
+        :param analysis_item: the appended AnalysisList item
+        :type analysis_item: dict
+        """
+        if analysis_list is self._list and len(analysis_list) == self._length + 1:
+            self._index(analysis_item)
+            self._length += 1
+
+    def related_to(self, analysis_list : list, scenedata_id : str):
+        """
+        The DetectedObjects with a RelatedSceneData.
+
+        :param analysis_list: the AnalysisList
+        :type analysis_list: list
+        :param scenedata_id: SceneDataID
+        :type scenedata_id: string
+        :return: the DetectedObjects in list order, empty if there are none
+        :rtype: list
+        """
+        self.update(analysis_list)
+        return self._by_related_scenedata.get(scenedata_id, [])
+
+    def find(
+        self,
+        analysis_list : list,
+        item_type : str = None,
+        min_probability : float = None,
+        version : float = None,
+        event_type : str = None,
+        attribute = None,
+        ):
+        """
+        The DetectedObjects matching all of the given conditions. The candidates
+        come from the most selective index, and are checked against the others.
+
+        :param analysis_list: the AnalysisList
+        :type analysis_list: list
+        :param item_type: NICEItemType
+        :type item_type: string
+        :param min_probability: lowest Probability
+        :type min_probability: float
+        :param version: VersionNumber of the AnalysisList item
+        :type version: float
+        :param event_type: EventType of the AnalysisList item
+        :type event_type: string
+        :param attribute: an Attribute name, or an (Attribute, Value) pair
+        :type attribute: string or tuple
+        :return: the DetectedObjects in list order
+        :rtype: list
+        """
+        # pylint: disable=too-many-arguments
+        self.update(analysis_list)
+        if attribute is not None and not isinstance(attribute, str):
+            attribute = tuple(attribute)
+        candidates = range(len(self._detected_objects))
+        for index, key in (
+                (self._by_item_type, item_type),
+                (self._by_version, version),
+                (self._by_event_type, event_type),
+                (self._by_attribute, attribute)):
+            if key is not None:
+                positions = index.get(key, [])
+                if len(positions) < len(candidates):
+                    candidates = positions
+        if min_probability is not None:
+            if not self._probability_sorted:
+                self._by_probability.sort()
+                self._probability_sorted = True
+            start = bisect.bisect_left(self._by_probability, (min_probability,))
+            if len(self._by_probability) - start < len(candidates):
+                candidates = sorted(position for _, position in self._by_probability[start:])
+
+        detected_objects = []
+        for position in candidates:
+            detected_object = self._detected_objects[position]
+            analysis_item = self._analysis_items[position]
+            if item_type is not None and detected_object.get('NICEItemType') != item_type:
+                continue
+            if version is not None and analysis_item.get('VersionNumber') != version:
+                continue
+            if event_type is not None and analysis_item.get('EventType') != event_type:
+                continue
+            if min_probability is not None:
+                probability = detected_object.get('Probability')
+                if not _is_number(probability) or probability < min_probability:
+                    continue
+            if attribute is not None and not _has_attribute(detected_object, attribute):
+                continue
+            detected_objects.append(detected_object)
+        return detected_objects
+
+class TargetView:
+    """
+    The SceneData items a Node works on: those of its DataType in the latest
+    SceneData version, with their URIs and SceneDataID <-> SceneDataURI maps,
+    computed in one pass. The view is a snapshot; check is_current before use.
+
+    :param scenedata_list: the SceneDataList
+    :type scenedata_list: list
+    :param datatype: the DataType the Node works on
+    :type datatype: string
+    :param version: the latest SceneData VersionNumber
+    :type version: float
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ("scenedata_list", "length", "items", "uris", "id_to_uri", "uri_to_id")
+
+    def __init__(self, scenedata_list : list, datatype : str, version : float):
+        self.scenedata_list = scenedata_list
+        self.length = len(scenedata_list)
+        self.items = [
+            scenedata_item for scenedata_item in scenedata_list
+            if scenedata_item['DataType'] == datatype and
+                scenedata_item['VersionNumber'] == version]
+        self.uris = [scenedata_item['SceneDataURI'] for scenedata_item in self.items]
+        self.id_to_uri = {
+            scenedata_item['SceneDataID']: scenedata_item['SceneDataURI']
+            for scenedata_item in self.items}
+        self.uri_to_id = {
+            scenedata_item['SceneDataURI']: scenedata_item['SceneDataID']
+            for scenedata_item in self.items}
+
+    def is_current(self, scenedata_list : list):
+        """
+        Whether the view was made from this list, and no items were added or
+        removed since. Changes to the items themselves aren't seen.
+
+        :param scenedata_list: the SceneDataList
+        :type scenedata_list: list
+        :rtype: bool
+        """
+        return scenedata_list is self.scenedata_list and len(scenedata_list) == self.length
+
+# The lists of a SceneMark that hold versioned items
+VERSIONED_SECTIONS = ("VersionList", "SceneDataList", "AnalysisList", "ThumbnailList")
+
+class _VersionPartition:
+    # pylint: disable=too-few-public-methods
+    __slots__ = ("items", "length", "by_version", "by_node", "latest")
+
+    def __init__(self, items : list):
+        self.items = items
+        self.length = 0
+        self.by_version = {}
+        self.by_node = {}
+        self.latest = None
+        for item in items:
+            self.add(item)
+
+    def add(self, item : dict):
+        version = item.get('VersionNumber')
+        self.by_version.setdefault(version, []).append(item)
+        if 'NodeID' in item:
+            versions = self.by_node.setdefault(item['NodeID'], [])
+            if version not in versions:
+                versions.append(version)
+        if _is_number(version) and (self.latest is None or version > self.latest):
+            self.latest = version
+        self.length += 1
+
+class VersionIndex:
+    """
+    The items of the VersionList, SceneDataList, AnalysisList and ThumbnailList
+    grouped by VersionNumber, with the highest VersionNumber of each list kept
+    as items are added. Each list is partitioned in one pass the first time it
+    is needed. A list that was replaced, or whose length changed other than
+    through added, is partitioned again.
+
+    :Example:
+
+    index = VersionIndex()
+    index.latest("SceneDataList", scenemark['SceneDataList'])
+    """
+    def __init__(self):
+        self._partitions = {}
+
+    def _partition(self, section : str, items : list):
+        partition = self._partitions.get(section)
+        if partition is None or partition.items is not items or partition.length != len(items):
+            partition = _VersionPartition(items)
+            self._partitions[section] = partition
+        return partition
+
+    def is_built(self, section : str):
+        """
+        Whether a list was partitioned, so added has to be called for its new items.
+
+        :param section: one of VERSIONED_SECTIONS
+        :type section: string
+        :rtype: bool
+        """
+        return section in self._partitions
+
+    def invalidate(self):
+        """
+        Makes the next lookups partition the lists again.
+        """
+        self._partitions = {}
+
+    def added(self, section : str, items : list, item : dict):
+        """
+        Adds an item that was just appended to a list.
+
+        :param section: one of VERSIONED_SECTIONS
+        :type section: string
+        :param items: the list
+        :type items: list
+        :param item: the appended item
+        :type item: dict
+        """
+        partition = self._partitions.get(section)
+        if partition is not None and partition.items is items and \
+                partition.length == len(items) - 1:
+            partition.add(item)
+
+    def latest(self, section : str, items : list):
+        """
+        The highest VersionNumber in a list.
+
+        :param section: one of VERSIONED_SECTIONS
+        :type section: string
+        :param items: the list
+        :type items: list
+        :return: the VersionNumber, None if the list is empty
+        :rtype: float
+        """
+        return self._partition(section, items).latest
+
+    def added_by(self, version : float, lists : dict):
+        """
+        The items with a VersionNumber, from each list.
+
+        :param version: VersionNumber
+        :type version: float
+        :param lists: {section -> list} for the VERSIONED_SECTIONS
+        :type lists: dict
+        :return: {section -> items}, in list order
+        :rtype: dict
+        """
+        return {
+            section: list(self._partition(section, items).by_version.get(version, []))
+            for section, items in lists.items()}
+
+    def versions_of_node(self, version_list : list, node_id : str):
+        """
+        The VersionNumbers a Node has in the VersionList.
+
+        :param version_list: the VersionList
+        :type version_list: list
+        :param node_id: NodeID
+        :type node_id: string
+        :return: the VersionNumbers, in list order
+        :rtype: list
+        """
+        return list(self._partition("VersionList", version_list).by_node.get(node_id, []))
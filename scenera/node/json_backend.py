@@ -0,0 +1,154 @@
+"""
+Pluggable JSON parsing and serializing. Uses orjson or ujson when installed,
+and falls back to the standard library json module.
+"""
+
+# pylint: disable=import-outside-toplevel
+import json
+import logging
+from .logger import configure_logger
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def _load_backends():
+    backends = {}
+    try:
+        import orjson
+        backends["orjson"] = orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        backends["ujson"] = ujson.loads
+    except ImportError:
+        pass
+    backends["json"] = json.loads
+    return backends
+
+# In order of preference
+_backends = _load_backends()
+_backend = next(iter(_backends))
+
+def available_backends():
+    """
+    The JSON backends that can be used, fastest first.
+
+    :rtype: list
+    """
+    return list(_backends)
+
+def get_json_backend():
+    """
+    The name of the JSON backend in use.
+
+    :rtype: string
+    """
+    return _backend
+
+def set_json_backend(name : str):
+    """
+    Selects the JSON backend, e.g. to force the standard library.
+
+    :param name: 'orjson', 'ujson' or 'json'
+    :type name: string
+    :raises ValueError: The backend is not installed.
+    """
+    global _backend # pylint: disable=global-statement
+    if name not in _backends:
+        raise ValueError(f"JSON backend '{name}' is not available, use one of {available_backends()}")
+    _backend = name
+
+def loads(data):
+    """
+    Parses a JSON document with the selected backend.
+
+    :param data: the JSON document
+    :type data: bytes or string
+    :return: the parsed document
+    """
+    return _backends[_backend](data)
+
+def _load_serializers():
+    serializers = {}
+    try:
+        import orjson
+        # Arrays and scalars of numpy are written natively, keys are
+        # converted to strings as the standard library does
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+        def orjson_dumps(value, default):
+            return orjson.dumps(value, default = default, option = options)
+        serializers["orjson"] = orjson_dumps
+    except ImportError:
+        pass
+
+    def json_dumps(value, default):
+        return json.dumps(value, default = default).encode("utf-8")
+    serializers["json"] = json_dumps
+    return serializers
+
+# ujson has no hook for the objects of the SDK, so it only parses
+_serializers = _load_serializers()
+_serializer = next(iter(_serializers))
+
+def available_serializers():
+    """
+    The JSON serializers that can be used, fastest first.
+
+    :rtype: list
+    """
+    return list(_serializers)
+
+def get_serializer():
+    """
+    The name of the JSON serializer in use.
+
+    :rtype: string
+    """
+    return _serializer
+
+def set_serializer(name : str):
+    """
+    Selects the JSON serializer. The standard library writes the same bytes
+    as json.dumps, orjson writes them without spaces between the items.
+
+    :param name: 'orjson' or 'json'
+    :type name: string
+    :raises ValueError: The serializer is not installed.
+    """
+    global _serializer # pylint: disable=global-statement
+    if name not in _serializers:
+        raise ValueError(f"JSON serializer '{name}' is not available, use one of {available_serializers()}")
+    _serializer = name
+
+def _with_numpy(default):
+    def serialize(value):
+        if np is not None:
+            if isinstance(value, np.ndarray):
+                return value.tolist()
+            if isinstance(value, np.generic):
+                return value.item()
+        if default is None:
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+        return default(value)
+    return serialize
+
+def dumps(value, default = None):
+    """
+    Serializes to JSON with the selected serializer. Numpy arrays and scalars
+    are written as the lists and numbers they hold.
+
+    :param value: the document
+    :param default: called with the objects that are not JSON, returns
+        something that is, or raises TypeError, defaults to None
+    :type default: function
+    :return: the JSON document, UTF-8 encoded
+    :rtype: bytes
+    """
+    return _serializers[_serializer](value, _with_numpy(default))
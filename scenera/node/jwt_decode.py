@@ -3,20 +3,188 @@
 Validates the token in the NodeSequencer header
 """
 
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 import jwt
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from .keyset import KeySetProvider
 
 NODESEQUENCER_PUBLIC_KEY = "-----BEGIN RSA PUBLIC KEY-----\nMIIBCgKCAQEAwQJ0bZfrWHxmEaYA/sG6FLx64+yxpH4quK36/wVm4+xhlvF4V7bdvvb4jg5teUZkaGdF96EnW/wQhtLZoYU/YSkT9mCXdm5k/gB0LE22peWuNZ3xFDVm4/O0XD/+20X/h9pux2pbBN+X21zwnil97H8u5VLOcvzy+yiivBOSWicol2xS376xwzX/VZjouxqzMfqRofRGa60y+e4vMzeEdAsu+fSADUj3Zh27ua8d1K2fCEqfClHPFBMB/HbLT9AtJFWBTThJqIaHn6cHtx1/6hk5elenmzoOQA4DdoEIxCjdZ0kkOH/W3aa0GCSKdnuUPFSeg9QRVsV9aC1Kn4Xx4wIDAQAB\n-----END RSA PUBLIC KEY-----"
 
-def validate_jwt_token(token):
+@functools.lru_cache(maxsize=16)
+def load_public_key(pem : str):
+    """
+    Parses a PEM encoded public key once into a key object, so RS256
+    verification does not have to parse the PEM string on every request.
+
+    :param pem: public key, in PEM format
+    :type pem: string
+    :return: the public key
+    :rtype: cryptography RSAPublicKey
+    """
+    return load_pem_public_key(pem.encode("ascii"))
+
+class VerifiedTokenCache:
     """
-    Used to validate the security token in the NodeSequencer Header
+    LRU of tokens that passed verification, keyed by a digest of the token.
+    The NodeSequencer reuses its token across many SceneMarks, so most requests
+    can skip the RSA verification. An entry is only used while the token is
+    within its 'nbf'/'exp' window, and for at most max_age seconds.
+
+    :param maxsize: Number of tokens to remember, defaults to 1024
+    :type maxsize: int
+    :param max_age: Seconds after which a token is verified again, even if it
+        has not expired, defaults to 300
+    :type max_age: float
+    """
+    def __init__(self, maxsize : int = 1024, max_age : float = 300.0):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token):
+        # PyJWT takes the token as a string or as bytes
+        return hashlib.sha256(token if isinstance(token, bytes) else token.encode("utf-8")).digest()
+
+    def is_verified(self, token : str):
+        """
+        Tells whether the token was verified before and is still valid.
+
+        :param token: token, in jwt format
+        :type token: string or bytes
+        :rtype: bool
+        """
+        digest = self._digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                not_before, not_after = entry
+                if not_before <= now < not_after:
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return True
+                del self._entries[digest]
+            self.misses += 1
+            return False
+
+    def add(self, token : str, claims : dict):
+        """
+        Remembers a token that passed verification.
+
+        :param token: token, in jwt format
+        :type token: string or bytes
+        :param claims: the decoded claims of the token
+        :type claims: dict
+        """
+        now = time.time()
+        not_before = claims.get("nbf", now)
+        not_after = min(claims.get("exp", float("inf")), now + self.max_age)
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (not_before, not_after)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+
+    def clear(self):
+        """
+        Forgets all verified tokens, e.g. after the public key changed.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """
+        Hit and miss counts and the current size of the cache.
+
+        :Example:
+
+        {"hits": 990, "misses": 10, "size": 1}
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+token_cache = VerifiedTokenCache()
+
+# Set through set_key_provider, or the NODESEQUENCER_KEYSET_PATH environment variable
+_key_provider = None
+_key_provider_generation = None
+_key_provider_lock = threading.Lock()
+
+def set_key_provider(provider : KeySetProvider):
+    """
+    Verifies tokens with the keys of a KeySetProvider, selected by the kid in
+    the token header, instead of the built-in NodeSequencer public key.
+
+    :param provider: the key set to use, or None to go back to the built-in key
+    :type provider: KeySetProvider
+    """
+    global _key_provider # pylint: disable=global-statement
+    with _key_provider_lock:
+        _key_provider = provider
+    token_cache.clear()
+
+def get_key_provider():
+    """
+    The KeySetProvider in use. Created on first use from the
+    NODESEQUENCER_KEYSET_PATH environment variable if that is set.
+
+    :return: the key set, or None when the built-in key is used
+    :rtype: KeySetProvider
+    """
+    global _key_provider # pylint: disable=global-statement
+    if _key_provider is None and os.environ.get("NODESEQUENCER_KEYSET_PATH"):
+        with _key_provider_lock:
+            if _key_provider is None:
+                _key_provider = KeySetProvider(os.environ["NODESEQUENCER_KEYSET_PATH"])
+    return _key_provider
+
+def get_verification_key(token : str):
+    """
+    Selects the public key for a token: from the key set by the kid in the
+    token header if a KeySetProvider is in use, else the built-in key.
 
     :param token: token, in jwt format
     :type token: string
+    :return: the public key
+    """
+    global _key_provider_generation # pylint: disable=global-statement
+    provider = get_key_provider()
+    if provider is None:
+        return load_public_key(NODESEQUENCER_PUBLIC_KEY)
+    key = provider.get_key(jwt.get_unverified_header(token).get("kid"))
+    # Tokens verified with keys that have since been rotated out are forgotten
+    if provider.generation != _key_provider_generation:
+        _key_provider_generation = provider.generation
+        token_cache.clear()
+    return key
+
+def validate_jwt_token(token):
+    """
+    Used to validate the security token in the NodeSequencer Header.
+    Tokens that were verified before are looked up in token_cache.
+
+    :param token: token, in jwt format
+    :type token: string or bytes
     """
-    jwt.decode(
+    key = get_verification_key(token)
+    if token_cache.is_verified(token):
+        return
+    claims = jwt.decode(
         token,
-        NODESEQUENCER_PUBLIC_KEY,
+        key,
         algorithms = ['RS256'],
         audience = "Scenera-Node"
         )
+    token_cache.add(token, claims)
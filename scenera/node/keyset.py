@@ -0,0 +1,143 @@
+"""
+Local key-set store for verifying the NodeSequencer token, so the public key
+can be rotated without redeploying the node.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+import json
+import logging
+import os
+import threading
+import time
+import jwt
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from .logger import configure_logger
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+KEY_FILE_EXTENSIONS = (".json", ".jwks", ".pem")
+
+def load_key_file(path : str):
+    """
+    Parses a key file into a {kid -> public key} dictionary.
+    A JWKS (or single JWK) file uses the 'kid' of every key, a PEM file
+    uses its file name without extension as kid.
+
+    :param path: path of a .json/.jwks or .pem file
+    :type path: string
+    :return: dictionary of {kid -> public key}
+    :rtype: dict
+    """
+    with open(path, 'rb') as key_file:
+        content = key_file.read()
+    if path.endswith(".pem"):
+        kid = os.path.splitext(os.path.basename(path))[0]
+        return {kid: load_pem_public_key(content)}
+    document = json.loads(content)
+    jwks = document if "keys" in document else {"keys": [document]}
+    return {jwk.key_id: jwk.key for jwk in jwt.PyJWKSet.from_dict(jwks).keys}
+
+class KeySetProvider:
+    """
+    Serves public keys by kid from a JWKS/PEM file or from a directory of such
+    files. The files are checked for changes at most every poll_interval
+    seconds; a changed key set is parsed in full and then swapped in at once,
+    so lookups never wait on parsing or see a half-loaded set.
+
+    :Example:
+
+    provider = KeySetProvider("/etc/scenera/keys")
+    provider.get_key("2024-01")
+
+    :param path: JWKS/PEM file, or a directory of them
+    :type path: string
+    :param poll_interval: Seconds between checks for changed files, defaults to 5
+    :type poll_interval: float
+    :raises OSError: The path can't be read when the provider is created.
+    """
+    def __init__(self, path : str, poll_interval : float = 5.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.generation = 0
+        self._keys = {}
+        self._signature = None
+        self._last_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.reload()
+
+    def _key_files(self):
+        if os.path.isdir(self.path):
+            return sorted(
+                os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.endswith(KEY_FILE_EXTENSIONS))
+        return [self.path]
+
+    def _current_signature(self):
+        signature = []
+        for path in self._key_files():
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self, force : bool = True):
+        """
+        Loads the key set again if the files changed, or always when forced.
+        If loading fails the current key set stays in use.
+
+        :param force: Reload even if the files look unchanged, defaults to True
+        :type force: bool
+        :return: True if a new key set was swapped in
+        :rtype: bool
+        """
+        with self._reload_lock:
+            self._last_check = time.monotonic()
+            signature = self._current_signature()
+            if not force and signature == self._signature:
+                return False
+            keys = {}
+            for path, _, _ in signature:
+                keys.update(load_key_file(path))
+            self._keys = keys
+            self._signature = signature
+            self.generation += 1
+        logger.info(f"Loaded {len(keys)} public key(s) from {self.path}")
+        return True
+
+    def _refresh(self):
+        if time.monotonic() - self._last_check < self.poll_interval:
+            return
+        # Only one thread checks; the others carry on with the current keys
+        if self._reload_lock.locked():
+            return
+        try:
+            self.reload(force = False)
+        except Exception as _e: # pylint: disable=broad-except
+            logger.warning(f"Could not reload the keys from {self.path}, keeping the current ones. ({_e})")
+
+    def get_key(self, kid : str = None):
+        """
+        Gets the public key for a kid. Without a kid, the only key is returned
+        if the set holds exactly one.
+
+        :param kid: Key ID, from the token header
+        :type kid: string
+        :return: the public key
+        :raises InvalidTokenError: No key is known for the kid.
+        """
+        self._refresh()
+        keys = self._keys
+        if kid is None and len(keys) == 1:
+            return next(iter(keys.values()))
+        try:
+            return keys[kid]
+        except KeyError as _e:
+            raise jwt.InvalidTokenError(f"No public key found for kid '{kid}'") from _e
+
+    def kids(self):
+        """
+        The kids of the keys currently loaded.
+
+        :rtype: list
+        """
+        return list(self._keys)
@@ -0,0 +1,287 @@
+"""
+Lazy SceneMark, for nodes that only read a few sections of a large SceneMark.
+The top-level sections are parsed on first access; sections that are never
+touched stay raw bytes and are written back verbatim.
+"""
+
+import json
+import logging
+import re
+from collections.abc import MutableMapping
+from . import json_backend
+from .logger import configure_logger
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_SCALAR = re.compile(rb'[^,:}\] \t\n\r]+')
+_EMPTY_ARRAY = re.compile(rb'\[[ \t\n\r]*\]')
+# Runs up to the next bracket, or to the next quote of a long or escaped string.
+# Short plain strings are consumed by the regex itself, long strings (e.g.
+# EmbeddedSceneData) are skipped with bytes.find, which is much faster.
+_CONTAINER_TOKEN = re.compile(
+    rb'[^"\[\]{}]*(?:"[^"\\\[\]{}]{0,256}"[^"\[\]{}]*)*(["\[\]{}])')
+
+def _error(data : bytes, pos : int, expected : str):
+    return ValueError(f"Invalid JSON: expected {expected} at byte {pos}")
+
+def _string_end(data : bytes, start : int):
+    """
+    Returns the position after the string whose opening quote is at start.
+    """
+    end = data.find(b'"', start + 1)
+    while end != -1:
+        backslash = end - 1
+        while data[backslash] == 0x5c:
+            backslash -= 1
+        # An even number of backslashes means the quote itself isn't escaped
+        if (end - 1 - backslash) % 2 == 0:
+            return end + 1
+        end = data.find(b'"', end + 1)
+    raise _error(data, start, "the end of the string")
+
+def _value_end(data : bytes, start : int):
+    """
+    Returns the position after the JSON value starting at start, without parsing it.
+    """
+    if start >= len(data):
+        raise _error(data, start, "a value")
+    first = data[start]
+    if first == 0x22:
+        return _string_end(data, start)
+    if first not in (0x5b, 0x7b):
+        scalar = _SCALAR.match(data, start)
+        if scalar is None:
+            raise _error(data, start, "a value")
+        return scalar.end()
+    depth = 0
+    pos = start
+    match = _CONTAINER_TOKEN.match
+    while True:
+        token = match(data, pos)
+        if token is None:
+            raise _error(data, start, "the end of the value")
+        pos = token.end()
+        char = data[pos - 1]
+        if char == 0x22:
+            pos = _string_end(data, pos - 1)
+        elif char in (0x5b, 0x7b):
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+def scan_object(data : bytes, start : int = 0, nested = ()):
+    """
+    Finds where the values of a JSON object's members start and end, without
+    parsing the values. Strings are skipped with bytes.find, so large embedded
+    payloads cost next to nothing; nested objects and arrays are walked bracket
+    by bracket, which for many small objects is slower than a full parse by orjson.
+
+    :Example:
+
+    spans, _ = scan_object(body, nested = ('SceneMark',))
+    start, end, members = spans['SceneMark']
+
+    :param data: the JSON document
+    :type data: bytes
+    :param start: where the object starts, defaults to 0
+    :type start: int
+    :param nested: keys whose values are objects to scan in the same pass,
+        rather than only skipping over them. Optional.
+    :type nested: iterable of strings
+    :return: dictionary of {key -> (start, end)} in document order, with
+        {key -> (start, end, members)} for the nested keys, where members is
+        what scan_object returns for the value, and the position after the object
+    :rtype: tuple
+    :raises ValueError: The document is not a valid JSON object, or the
+        value of a nested key is not an object.
+    """
+    pos = _WHITESPACE.match(data, start).end()
+    if data[pos:pos + 1] != b'{':
+        raise _error(data, pos, "'{'")
+    pos = _WHITESPACE.match(data, pos + 1).end()
+    spans = {}
+    if data[pos:pos + 1] == b'}':
+        return spans, pos + 1
+    while True:
+        if data[pos:pos + 1] != b'"':
+            raise _error(data, pos, "a key")
+        key_end = _string_end(data, pos)
+        key = json.loads(data[pos:key_end])
+        pos = _WHITESPACE.match(data, key_end).end()
+        if data[pos:pos + 1] != b':':
+            raise _error(data, pos, "':'")
+        value_start = _WHITESPACE.match(data, pos + 1).end()
+        if key in nested:
+            members, value_end = scan_object(data, value_start)
+            spans[key] = (value_start, value_end, members)
+        else:
+            value_end = _value_end(data, value_start)
+            spans[key] = (value_start, value_end)
+        pos = _WHITESPACE.match(data, value_end).end()
+        separator = data[pos:pos + 1]
+        if separator == b'}':
+            return spans, pos + 1
+        if separator != b',':
+            raise _error(data, pos, "',' or '}'")
+        pos = _WHITESPACE.match(data, pos + 1).end()
+
+def _dumps(value):
+    return json.dumps(value).encode("utf-8")
+
+class LazySceneMark(MutableMapping):
+    """
+    A SceneMark that behaves like the dictionary, but only parses a top-level
+    section when it is first read. Items appended to a list section that was
+    not read yet (see append) are kept aside, so e.g. adding an AnalysisList
+    item doesn't parse the upstream AnalysisList.
+
+    Note that only the top-level structure is checked when loading, the
+    sections themselves are only checked when parsed.
+
+    :Example:
+
+    scenemark = LazySceneMark(body)
+    scenemark['SceneMarkID']    # parses just this section
+    scenemark.dumps()           # other sections are copied as received
+
+    :param data: the JSON document holding the SceneMark
+    :type data: bytes
+    :param start: where the SceneMark object starts in data, defaults to 0
+    :type start: int
+    :param spans: the spans of the SceneMark's members, when the SceneMark was
+        already scanned (see scan_object's nested), so it isn't scanned again.
+        Optional.
+    :type spans: dict
+    :raises ValueError: The SceneMark is not a valid JSON object.
+    """
+    def __init__(self, data : bytes, start : int = 0, spans : dict = None):
+        self._data = data
+        self._raw = dict(spans) if spans is not None else scan_object(data, start)[0]
+        self._values = {}
+        self._appended = {}
+        # Keys in document order, with the keys set later at the end
+        self._order = dict.fromkeys(self._raw)
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        start, end = self._raw[key]
+        value = json_backend.loads(self._data[start:end])
+        if key in self._appended:
+            value.extend(self._appended.pop(key))
+        self._values[key] = value
+        del self._raw[key]
+        return value
+
+    def __setitem__(self, key, value):
+        self._raw.pop(key, None)
+        self._appended.pop(key, None)
+        self._values[key] = value
+        self._order[key] = None
+
+    def __delitem__(self, key):
+        del self._order[key]
+        self._raw.pop(key, None)
+        self._appended.pop(key, None)
+        self._values.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, key):
+        return key in self._order
+
+    def is_parsed(self, key):
+        """
+        Whether a section has been parsed, or was set after loading.
+
+        :param key: top-level key of the SceneMark
+        :type key: string
+        :rtype: bool
+        """
+        return key in self._values
+
+    def copy(self):
+        """
+        A shallow copy, sharing the received document and the parsed sections.
+        Sections that were not parsed yet are parsed separately by each copy.
+
+        :rtype: LazySceneMark
+        """
+        copied = LazySceneMark.__new__(LazySceneMark)
+        copied._data = self._data
+        copied._raw = dict(self._raw)
+        copied._values = dict(self._values)
+        copied._appended = {key: list(items) for key, items in self._appended.items()}
+        copied._order = dict(self._order)
+        return copied
+
+    def append(self, key, item):
+        """
+        Appends an item to a list section. If the section was not parsed yet,
+        the item is kept aside and written after the raw section by dumps.
+
+        :param key: top-level key of a list section, e.g. 'AnalysisList'
+        :type key: string
+        :param item: the item to append
+        :type item: dict
+        """
+        if key in self._raw and self._data[self._raw[key][0]] == 0x5b:
+            self._appended.setdefault(key, []).append(item)
+        else:
+            self[key].append(item)
+
+    def to_dict(self, keys = None):
+        """
+        Parses the sections and returns them as a plain dictionary,
+        e.g. for schema validation.
+
+        :param keys: Only include these top-level keys, defaults to all
+        :type keys: iterable of strings
+        :rtype: dict
+        """
+        if keys is None:
+            return {key: self[key] for key in self._order}
+        return {key: self[key] for key in self._order if key in keys}
+
+    def dumps(self, dumps = _dumps):
+        """
+        Serializes the SceneMark. Sections that were not parsed are copied
+        from the received document as they are.
+
+        :param dumps: serializes a parsed section to bytes,
+            defaults to the standard library json
+        :type dumps: function
+        :return: the SceneMark as JSON
+        :rtype: bytes
+        """
+        data = memoryview(self._data)
+        parts = [b'{']
+        for key in self._order:
+            if len(parts) > 1:
+                parts.append(b', ')
+            parts.append(_dumps(key))
+            parts.append(b': ')
+            if key in self._values:
+                parts.append(dumps(self._values[key]))
+                continue
+            start, end = self._raw[key]
+            appended = self._appended.get(key)
+            if not appended:
+                parts.append(data[start:end])
+                continue
+            # Reopen the raw list to write the appended items after it
+            parts.append(data[start:end - 1])
+            if not _EMPTY_ARRAY.fullmatch(self._data, start, end):
+                parts.append(b', ')
+            parts.append(b', '.join(dumps(item) for item in appended))
+            parts.append(b']')
+        parts.append(b'}')
+        return b''.join(parts)
@@ -0,0 +1,304 @@
+"""
+Post-processing of model output with numpy: box format conversion, pixel and
+relative coordinates, clipping, score thresholds, non-maximum suppression and
+top-k, over all boxes at once. Needs numpy, which is installed with
+pip install scenera.node[numpy].
+
+Boxes are N x 4 arrays in one of the BOX_FORMATS:
+
+- 'xyxy': (x1, y1, x2, y2), the top-left and bottom-right corners
+- 'xywh': (x, y, width, height), the top-left corner and size, as the Spec has them
+- 'cxcywh': (cx, cy, width, height), the center and size, as e.g. YOLO outputs them
+
+Functions that select boxes return their indices, so the scores, class IDs
+or anything else kept alongside the boxes can be selected the same way.
+"""
+
+import logging
+from .batch import DetectionBatch
+from .logger import configure_logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+BOX_FORMATS = ("xyxy", "xywh", "cxcywh")
+
+def _as_boxes(boxes):
+    if np is None:
+        raise ImportError("scenera.node.postprocess needs numpy, pip install scenera.node[numpy]")
+    return np.asarray(boxes, dtype = np.float64).reshape(-1, 4)
+
+def convert_boxes(boxes, source : str, target : str):
+    """
+    Converts boxes from one format to another.
+
+    :param boxes: N x 4 boxes
+    :type boxes: array_like
+    :param source: format of the boxes, one of BOX_FORMATS
+    :type source: string
+    :param target: format to convert to, one of BOX_FORMATS
+    :type target: string
+    :return: N x 4 boxes, a new array
+    :rtype: numpy.ndarray
+    :raises AssertionError: When a format is not one of BOX_FORMATS.
+    """
+    assert source in BOX_FORMATS and target in BOX_FORMATS, \
+        logger.exception(f"Box formats are one of {BOX_FORMATS}")
+    boxes = _as_boxes(boxes)
+    converted = boxes.copy()
+    if source == target:
+        return converted
+    # Through the top-left corner and size, which all formats share a part of
+    if source == "xyxy":
+        converted[:, 2:] = boxes[:, 2:] - boxes[:, :2]
+    elif source == "cxcywh":
+        converted[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+    if target == "xyxy":
+        converted[:, 2:] += converted[:, :2]
+    elif target == "cxcywh":
+        converted[:, :2] += converted[:, 2:] / 2
+    return converted
+
+def to_relative(boxes, width : float, height : float):
+    """
+    Converts boxes in pixels to coordinates relative to the frame, in any format.
+
+    :param boxes: N x 4 boxes in pixels
+    :type boxes: array_like
+    :param width: Width of the frame in pixels
+    :type width: float
+    :param height: Height of the frame in pixels
+    :type height: float
+    :return: N x 4 boxes, a new array
+    :rtype: numpy.ndarray
+    """
+    return _as_boxes(boxes) / np.array([width, height, width, height], dtype = np.float64)
+
+def to_pixels(boxes, width : float, height : float):
+    """
+    Converts boxes relative to the frame to pixels, in any format.
+
+    :param boxes: N x 4 relative boxes
+    :type boxes: array_like
+    :param width: Width of the frame in pixels
+    :type width: float
+    :param height: Height of the frame in pixels
+    :type height: float
+    :return: N x 4 boxes, a new array
+    :rtype: numpy.ndarray
+    """
+    return _as_boxes(boxes) * np.array([width, height, width, height], dtype = np.float64)
+
+def clip_boxes(boxes, width : float = 1.0, height : float = 1.0, box_format : str = "xyxy"):
+    """
+    Clips boxes to the frame, e.g. boxes a model predicted partly outside of it.
+
+    :param boxes: N x 4 boxes
+    :type boxes: array_like
+    :param width: Width of the frame, defaults to 1.0 for relative coordinates
+    :type width: float
+    :param height: Height of the frame, defaults to 1.0 for relative coordinates
+    :type height: float
+    :param box_format: format of the boxes, one of BOX_FORMATS, defaults to 'xyxy'
+    :type box_format: string
+    :return: N x 4 boxes in the same format, a new array
+    :rtype: numpy.ndarray
+    """
+    corners = convert_boxes(boxes, box_format, "xyxy")
+    np.clip(corners[:, 0::2], 0, width, out = corners[:, 0::2])
+    np.clip(corners[:, 1::2], 0, height, out = corners[:, 1::2])
+    return convert_boxes(corners, "xyxy", box_format)
+
+def above_threshold(scores, min_score : float):
+    """
+    The detections scoring at least min_score.
+
+    :param scores: N scores
+    :type scores: array_like
+    :param min_score: lowest score to keep
+    :type min_score: float
+    :return: indices of the detections, in their original order
+    :rtype: numpy.ndarray
+    """
+    return np.flatnonzero(np.asarray(scores) >= min_score)
+
+def top_k(scores, k : int):
+    """
+    The k highest scoring detections.
+
+    :param scores: N scores
+    :type scores: array_like
+    :param k: number of detections to keep
+    :type k: int
+    :return: indices of the detections, highest score first
+    :rtype: numpy.ndarray
+    """
+    scores = np.asarray(scores).reshape(-1)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind = "stable")]
+
+def iou_matrix(boxes_a, boxes_b, box_format : str = "xyxy"):
+    """
+    Intersection over union of every pair of boxes.
+
+    :param boxes_a: N x 4 boxes
+    :type boxes_a: array_like
+    :param boxes_b: M x 4 boxes
+    :type boxes_b: array_like
+    :param box_format: format of the boxes, one of BOX_FORMATS, defaults to 'xyxy'
+    :type box_format: string
+    :return: N x M IoUs, 0 for boxes without area
+    :rtype: numpy.ndarray
+    """
+    boxes_a = convert_boxes(boxes_a, box_format, "xyxy")
+    boxes_b = convert_boxes(boxes_b, box_format, "xyxy")
+    return _iou(boxes_a, boxes_b)
+
+def _area(corners):
+    return np.maximum(corners[..., 2] - corners[..., 0], 0) * \
+        np.maximum(corners[..., 3] - corners[..., 1], 0)
+
+def _iou(corners_a, corners_b):
+    width = np.minimum(corners_a[:, None, 2], corners_b[None, :, 2]) - \
+        np.maximum(corners_a[:, None, 0], corners_b[None, :, 0])
+    height = np.minimum(corners_a[:, None, 3], corners_b[None, :, 3]) - \
+        np.maximum(corners_a[:, None, 1], corners_b[None, :, 1])
+    np.clip(width, 0, None, out = width)
+    np.clip(height, 0, None, out = height)
+    intersection = np.multiply(width, height, out = width)
+    union = _area(corners_a)[:, None] + _area(corners_b)[None, :] - intersection
+    return np.divide(intersection, union, out = np.zeros_like(intersection), where = union > 0)
+
+# Rows of the IoU matrix computed at a time by nms, to bound its memory
+_NMS_BLOCK = 256
+
+def nms(
+    boxes,
+    scores,
+    iou_threshold : float = 0.5,
+    class_ids = None,
+    box_format : str = "xyxy",
+    max_detections : int = None,
+    ):
+    """
+    Non-maximum suppression: of boxes overlapping more than iou_threshold, only
+    the highest scoring one is kept. With class_ids, only boxes of the same
+    class suppress each other. Takes N x N bytes of memory, so threshold the
+    scores first when there are many candidates.
+
+    :param boxes: N x 4 boxes
+    :type boxes: array_like
+    :param scores: N scores
+    :type scores: array_like
+    :param iou_threshold: IoU above which boxes suppress each other, defaults to 0.5
+    :type iou_threshold: float
+    :param class_ids: N class IDs, defaults to None for class-agnostic suppression
+    :type class_ids: array_like
+    :param box_format: format of the boxes, one of BOX_FORMATS, defaults to 'xyxy'
+    :type box_format: string
+    :param max_detections: most boxes to keep, defaults to None for all
+    :type max_detections: int
+    :return: indices of the kept boxes, highest score first
+    :rtype: numpy.ndarray
+    """
+    # pylint: disable=too-many-arguments
+    scores = np.asarray(scores, dtype = np.float64).reshape(-1)
+    order = np.argsort(-scores, kind = "stable")
+    corners = convert_boxes(boxes, box_format, "xyxy")[order]
+    if class_ids is not None:
+        classes = np.asarray(class_ids).reshape(-1)[order]
+
+    # Which boxes each box suppresses, in order of score, computed in blocks
+    size = len(order)
+    suppresses = np.empty((size, size), dtype = bool)
+    for start in range(0, size, _NMS_BLOCK):
+        block = suppresses[start:start + _NMS_BLOCK]
+        np.greater(_iou(corners[start:start + _NMS_BLOCK], corners), iou_threshold, out = block)
+        if class_ids is not None:
+            block &= classes[start:start + _NMS_BLOCK, None] == classes[None, :]
+    np.fill_diagonal(suppresses, False)
+    suppresses_any = suppresses.any(axis = 1).tolist()
+
+    # Greedily keep the highest scoring box that is not suppressed yet
+    suppressed = np.zeros(size, dtype = bool)
+    keep = []
+    for position in range(size):
+        if max_detections is not None and len(keep) >= max_detections:
+            break
+        if suppressed[position]:
+            continue
+        keep.append(position)
+        if suppresses_any[position]:
+            suppressed |= suppresses[position]
+    return order[np.array(keep, dtype = np.intp)]
+
+def postprocess(
+    boxes,
+    scores,
+    class_ids,
+    class_map : dict,
+    box_format : str = "xyxy",
+    frame_size : tuple = None,
+    min_score : float = 0.0,
+    iou_threshold : float = 0.5,
+    max_detections : int = None,
+    **kwargs
+    ):
+    """
+    Turns the raw output of a detector into a DetectionBatch: boxes are made
+    relative and clipped to the frame, detections scoring under min_score are
+    dropped, overlapping detections of the same class are suppressed, and the
+    max_detections highest scoring ones are kept.
+
+    :Example:
+
+    batch = postprocess(boxes, scores, class_ids, {0: "Human"}, box_format = "cxcywh",
+        frame_size = (1920, 1080), min_score = 0.25, related_scenedata = scenedata_id)
+    scenemark.add_analysis_list_item("Detected", "ItemPresence", detected_objects = batch)
+
+    :param boxes: N x 4 boxes
+    :type boxes: array_like
+    :param scores: N scores
+    :type scores: array_like
+    :param class_ids: N class IDs
+    :type class_ids: array_like
+    :param class_map: class ID -> NICEItemType, see DetectionBatch
+    :type class_map: dict
+    :param box_format: format of the boxes, one of BOX_FORMATS, defaults to 'xyxy'
+    :type box_format: string
+    :param frame_size: (width, height) of the frame when the boxes are in pixels,
+        defaults to None for relative boxes
+    :type frame_size: tuple
+    :param min_score: lowest score to keep, defaults to 0.0
+    :type min_score: float
+    :param iou_threshold: IoU above which boxes suppress each other, defaults to 0.5
+    :type iou_threshold: float
+    :param max_detections: most detections to keep, defaults to None for all
+    :type max_detections: int
+    :param kwargs: passed on to DetectionBatch, e.g. related_scenedata, with
+        one value for the whole batch
+    :return: the detections, highest score first
+    :rtype: DetectionBatch
+    """
+    # pylint: disable=too-many-arguments
+    corners = convert_boxes(boxes, box_format, "xyxy")
+    if frame_size is not None:
+        corners = to_relative(corners, *frame_size)
+    corners = clip_boxes(corners)
+    scores = np.asarray(scores, dtype = np.float64).reshape(-1)
+    class_ids = np.asarray(class_ids).reshape(-1)
+
+    selected = above_threshold(scores, min_score)
+    keep = selected[nms(corners[selected], scores[selected], iou_threshold,
+        class_ids[selected], max_detections = max_detections)]
+    return DetectionBatch(
+        convert_boxes(corners[keep], "xyxy", "xywh"), scores[keep], class_ids[keep],
+        class_map, **kwargs)
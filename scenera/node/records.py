@@ -0,0 +1,251 @@
+"""
+Compact records for the items a Node adds in bulk: DetectedObjects and their
+BoundingBox, Attributes and DirectionalMovement. They take the place of the
+dictionaries made by the SceneMark's generate_* methods, use __slots__ instead
+of a dictionary per object, and are only turned into the Spec's JSON when the
+SceneMark is serialized or validated.
+"""
+
+import logging
+from .logger import configure_logger
+from .spec import NICEItemType
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+def _to_json(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    return value
+
+class Record:
+    """
+    Base class of the records. Besides attribute access, the fields can be read
+    and set with their key in the Spec, like the dictionaries they replace.
+
+    :Example:
+
+    box = BoundingBox(0.1, 0.2, 0.3, 0.4)
+    box.height == box['Height']
+    """
+    __slots__ = ()
+    # (attribute, key in the Spec) of every field, in the order they are written
+    FIELDS = ()
+    # Keys left out of the JSON when their value is None
+    OMITTED_WHEN_NONE = ()
+    _ATTRIBUTES = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._ATTRIBUTES = {key: attribute for attribute, key in cls.FIELDS}
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._ATTRIBUTES[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, self._ATTRIBUTES[key], value)
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self._ATTRIBUTES
+
+    def get(self, key, default = None):
+        """
+        The value of a field by its key in the Spec, like dict.get.
+        """
+        attribute = self._ATTRIBUTES.get(key)
+        return default if attribute is None else getattr(self, attribute)
+
+    def keys(self):
+        """
+        The keys in the Spec of the fields.
+        """
+        return self._ATTRIBUTES.keys()
+
+    def to_dict(self):
+        """
+        The record as it is written in the SceneMark, with any nested records
+        converted as well.
+
+        :rtype: dict
+        """
+        result = {}
+        for attribute, key in self.FIELDS:
+            value = getattr(self, attribute)
+            if value is None and key in self.OMITTED_WHEN_NONE:
+                continue
+            result[key] = _to_json(value)
+        return result
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{attribute}={getattr(self, attribute)!r}" for attribute, _ in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+class BoundingBox(Record):
+    """
+    A BoundingBox, see SceneMark.generate_bounding_box.
+
+    :param x_coordinate: Top-left x coordinate
+    :type x_coordinate: float
+    :param y_coordinate: Top-left y coordinate
+    :type y_coordinate: float
+    :param height: Height of the bounding box
+    :type height: float
+    :param width: Width of the bounding box
+    :type width: float
+    """
+    __slots__ = ("x_coordinate", "y_coordinate", "height", "width")
+    FIELDS = (
+        ("x_coordinate", "XCoordinate"),
+        ("y_coordinate", "YCoordinate"),
+        ("height", "Height"),
+        ("width", "Width"),
+        )
+
+    def __init__(self, x_coordinate : float, y_coordinate : float, height : float, width : float):
+        # float() also turns e.g. numpy.float32 into something JSON can write
+        self.x_coordinate = float(x_coordinate)
+        self.y_coordinate = float(y_coordinate)
+        self.height = float(height)
+        self.width = float(width)
+
+class Attribute(Record):
+    """
+    An Attribute of a DetectedObject, see SceneMark.generate_attribute_item.
+
+    :param attribute: Name of the attribute
+    :type attribute: string
+    :param value: Value of the attribute
+    :type value: string
+    :param probability_of_attribute: Confidence of the attribute, defaults to 1.0
+    :type probability_of_attribute: float
+    :param version_number: VersionNumber of the Node, left out of the JSON if None,
+        defaults to None
+    :type version_number: float
+    """
+    __slots__ = ("version_number", "attribute", "value", "probability_of_attribute")
+    FIELDS = (
+        ("version_number", "VersionNumber"),
+        ("attribute", "Attribute"),
+        ("value", "Value"),
+        ("probability_of_attribute", "ProbabilityOfAttribute"),
+        )
+    OMITTED_WHEN_NONE = ("VersionNumber",)
+
+    def __init__(
+        self,
+        attribute : str,
+        value : str,
+        probability_of_attribute : float = 1.0,
+        version_number : float = None,
+        ):
+        self.version_number = version_number
+        self.attribute = attribute
+        self.value = value
+        self.probability_of_attribute = probability_of_attribute
+
+class DirectionalMovement(Record):
+    """
+    A DirectionalMovement, see SceneMark.generate_directional_movement_item.
+
+    :param id: ID of the track
+    :type id: string
+    :param uri: URI of the track, defaults to None
+    :type uri: string
+    """
+    __slots__ = ("id", "uri")
+    FIELDS = (
+        ("id", "ID"),
+        ("uri", "URI"),
+        )
+
+    def __init__(self, id : str, uri : str = None):
+        # pylint: disable=redefined-builtin
+        self.id = id
+        self.uri = uri
+
+class DetectedObject(Record):
+    """
+    A DetectedObject, see SceneMark.generate_detected_object_item for the fields.
+    Can be passed to add_analysis_list_item in detected_objects.
+
+    :Example:
+
+    DetectedObject("Human", scenedata_id, probability = 0.93,
+        bounding_box = BoundingBox(0.1, 0.2, 0.3, 0.4))
+
+    :raises AssertionError: When the NICEItemType is not part of the Spec.
+    """
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        "nice_item_type",
+        "related_scenedata",
+        "custom_item_type",
+        "item_id",
+        "item_type_count",
+        "probability",
+        "frame",
+        "timestamp",
+        "directional_movement",
+        "attributes",
+        "bounding_box",
+        )
+    FIELDS = (
+        ("nice_item_type", "NICEItemType"),
+        ("related_scenedata", "RelatedSceneData"),
+        ("custom_item_type", "CustomItemType"),
+        ("item_id", "ItemID"),
+        ("item_type_count", "ItemTypeCount"),
+        ("probability", "Probability"),
+        ("frame", "Frame"),
+        ("timestamp", "TimeStamp"),
+        ("directional_movement", "DirectionalMovement"),
+        ("attributes", "Attributes"),
+        ("bounding_box", "BoundingBox"),
+        )
+
+    def __init__(
+        self,
+        nice_item_type : str,
+        related_scenedata : str = "None",
+        custom_item_type : str = "",
+        item_id : str = "",
+        item_type_count : int = 1,
+        probability : float = 1.0,
+        frame : int = 0,
+        timestamp : str = "",
+        directional_movement : DirectionalMovement = None,
+        attributes = (),
+        bounding_box : BoundingBox = None,
+        ):
+        # pylint: disable=too-many-arguments
+        assert nice_item_type in NICEItemType, \
+            logger.exception("This Item Type is not part of the Spec.")
+        self.nice_item_type = nice_item_type
+        self.related_scenedata = related_scenedata
+        self.custom_item_type = custom_item_type
+        self.item_id = item_id
+        self.item_type_count = item_type_count
+        self.probability = probability
+        self.frame = frame
+        self.timestamp = timestamp
+        self.directional_movement = directional_movement
+        self.attributes = attributes
+        self.bounding_box = bounding_box
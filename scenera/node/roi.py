@@ -0,0 +1,397 @@
+"""
+Regions of interest compiled for testing many points and boxes at once, and
+rasterized into masks of the frame. Needs numpy, which is installed with
+pip install scenera.node[numpy].
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from .logger import configure_logger
+from .postprocess import convert_boxes
+from .utils import get_regions_of_interest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+class _Polygon:
+    # pylint: disable=too-few-public-methods
+    __slots__ = ("x_start", "y_start", "y_end", "x_per_y", "bounds")
+
+    def __init__(self, region : list):
+        vertices = np.asarray(region, dtype = np.float64).reshape(-1, 2)
+        ends = np.roll(vertices, -1, axis = 0)
+        self.x_start = vertices[:, 0]
+        self.y_start = vertices[:, 1]
+        self.y_end = ends[:, 1]
+        # Horizontal edges are never crossed, so their slope is never used
+        rise = self.y_end - self.y_start
+        self.x_per_y = np.divide(ends[:, 0] - self.x_start, rise,
+            out = np.zeros_like(rise), where = rise != 0)
+        self.bounds = np.concatenate([vertices.min(axis = 0), vertices.max(axis = 0)])
+
+    def contains(self, points):
+        """
+        Even-odd rule: a point is inside when a ray from it crosses an odd number
+        of edges. Points is a P x 2 array, edges are taken all at once.
+        """
+        x = points[:, 0:1]
+        y = points[:, 1:2]
+        spans = (self.y_start > y) != (self.y_end > y)
+        crosses = spans & (x < self.x_start + (y - self.y_start) * self.x_per_y)
+        return np.count_nonzero(crosses, axis = 1) % 2 == 1
+
+class RegionsOfInterest:
+    """
+    The RegionsOfInterest of the NodeSequencer header, compiled once into edge
+    arrays and bounding boxes, to test detections against all at once. Points
+    are only tested against the edges of a region when they are inside its
+    bounding box. The regions use the coordinates of the boxes tested against
+    them, relative to the frame in the Spec. Without regions, the whole frame
+    is of interest.
+
+    :Example:
+
+    regions = RegionsOfInterest.from_header(scenemark.nodesequencer_header)
+    batch = regions.filter(batch, mode = "overlap", min_overlap = 0.5)
+
+    :param regions: polygons as returned by utils.get_regions_of_interest
+    :type regions: list of lists of (x, y) tuples
+    :raises ImportError: When numpy is not installed.
+    """
+    def __init__(self, regions : list):
+        if np is None:
+            raise ImportError("RegionsOfInterest needs numpy, pip install scenera.node[numpy]")
+        self.regions = [list(region) for region in regions]
+        self._polygons = [_Polygon(region) for region in self.regions]
+
+    @classmethod
+    def from_header(cls, nodesequencer_header : dict):
+        """
+        Compiles the RegionsOfInterest of the NodeInput.
+
+        :param nodesequencer_header: NodeSequencer header structure
+        :type nodesequencer_header: dict
+        :rtype: RegionsOfInterest
+        """
+        return cls(get_regions_of_interest(nodesequencer_header))
+
+    def __len__(self):
+        return len(self._polygons)
+
+    def __repr__(self):
+        return f"RegionsOfInterest({len(self)} regions)"
+
+    def mask(self, width : int, height : int):
+        """
+        The regions as a mask of a frame, see get_region_mask.
+
+        :param width: Width of the frame in pixels
+        :type width: int
+        :param height: Height of the frame in pixels
+        :type height: int
+        :rtype: RegionMask
+        """
+        return get_region_mask(self.regions, width, height)
+
+    def region_mask(self, points):
+        """
+        Which regions each point is in.
+
+        :param points: N x 2 points
+        :type points: array_like
+        :return: N x R booleans, R being the number of regions
+        :rtype: numpy.ndarray
+        """
+        points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+        mask = np.zeros((len(points), len(self._polygons)), dtype = bool)
+        for position, polygon in enumerate(self._polygons):
+            bounds = polygon.bounds
+            candidates = np.flatnonzero(
+                (points[:, 0] >= bounds[0]) & (points[:, 1] >= bounds[1]) &
+                (points[:, 0] <= bounds[2]) & (points[:, 1] <= bounds[3]))
+            if len(candidates):
+                mask[candidates, position] = polygon.contains(points[candidates])
+        return mask
+
+    def contains_points(self, points):
+        """
+        Whether each point is in any of the regions.
+
+        :param points: N x 2 points
+        :type points: array_like
+        :return: N booleans
+        :rtype: numpy.ndarray
+        """
+        points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+        if not self._polygons:
+            return np.ones(len(points), dtype = bool)
+        return self.region_mask(points).any(axis = 1)
+
+    def contains_centers(self, boxes, box_format : str = "xywh"):
+        """
+        Whether the center of each box is in any of the regions.
+
+        :param boxes: N x 4 boxes
+        :type boxes: array_like
+        :param box_format: format of the boxes, see postprocess.BOX_FORMATS,
+            defaults to 'xywh' as in the Spec
+        :type box_format: string
+        :return: N booleans
+        :rtype: numpy.ndarray
+        """
+        return self.contains_points(convert_boxes(boxes, box_format, "cxcywh")[:, :2])
+
+    def contains_boxes(self, boxes, box_format : str = "xywh"):
+        """
+        Whether all four corners of each box are in one and the same region.
+        For convex regions that means the whole box is inside.
+
+        :param boxes: N x 4 boxes
+        :type boxes: array_like
+        :param box_format: format of the boxes, see postprocess.BOX_FORMATS,
+            defaults to 'xywh' as in the Spec
+        :type box_format: string
+        :return: N booleans
+        :rtype: numpy.ndarray
+        """
+        corners = convert_boxes(boxes, box_format, "xyxy")
+        if not self._polygons:
+            return np.ones(len(corners), dtype = bool)
+        points = corners[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 2)
+        mask = self.region_mask(points).reshape(len(corners), 4, len(self._polygons))
+        return mask.all(axis = 1).any(axis = 1)
+
+    def overlap_fraction(self, boxes, box_format : str = "xywh", samples : int = 8):
+        """
+        The part of each box that is in any of the regions, estimated on a grid
+        of samples x samples points spread over the box.
+
+        :param boxes: N x 4 boxes
+        :type boxes: array_like
+        :param box_format: format of the boxes, see postprocess.BOX_FORMATS,
+            defaults to 'xywh' as in the Spec
+        :type box_format: string
+        :param samples: points per side of the grid, defaults to 8
+        :type samples: int
+        :return: N fractions between 0 and 1
+        :rtype: numpy.ndarray
+        """
+        boxes = convert_boxes(boxes, box_format, "xywh")
+        if not self._polygons:
+            return np.ones(len(boxes))
+        # The centers of the cells of the grid, relative to the box
+        steps = (np.arange(samples) + 0.5) / samples
+        x = boxes[:, 0:1, None] + boxes[:, 2:3, None] * steps[None, None, :]
+        y = boxes[:, 1:2, None] + boxes[:, 3:4, None] * steps[None, :, None]
+        points = np.stack(np.broadcast_arrays(x, y), axis = -1).reshape(-1, 2)
+        inside = self.contains_points(points).reshape(len(boxes), samples * samples)
+        return inside.mean(axis = 1)
+
+    def filter(self, batch, mode : str = "center", min_overlap : float = 0.5, samples : int = 8):
+        """
+        The detections of a batch that are in the regions.
+
+        :param batch: the detections, with boxes as in the Spec
+        :type batch: DetectionBatch
+        :param mode: 'center' for boxes with their center in a region, 'corners' for
+            boxes with all corners in a region, 'overlap' for boxes with at least
+            min_overlap of their area in the regions, defaults to 'center'
+        :type mode: string
+        :param min_overlap: for 'overlap', the lowest part of a box in the regions,
+            defaults to 0.5
+        :type min_overlap: float
+        :param samples: for 'overlap', see overlap_fraction, defaults to 8
+        :type samples: int
+        :return: the detections in the regions
+        :rtype: DetectionBatch
+        :raises AssertionError: When the mode is not recognized.
+        """
+        assert mode in ("center", "corners", "overlap"), \
+            logger.exception("mode is one of 'center', 'corners' or 'overlap'")
+        if mode == "center":
+            inside = self.contains_centers(batch.boxes)
+        elif mode == "corners":
+            inside = self.contains_boxes(batch.boxes)
+        else:
+            inside = self.overlap_fraction(batch.boxes, samples = samples) >= min_overlap
+        return batch.select(inside)
+
+def _rasterize(region : list, width : int, height : int):
+    """
+    Fills a polygon with relative coordinates into a height x width mask,
+    a row of pixel centers at a time. Each edge crossing a row toggles the
+    pixels from the crossing on, so the even-odd rule falls out of an xor.
+    """
+    vertices = np.asarray(region, dtype = np.float64).reshape(-1, 2) * (width, height)
+    ends = np.roll(vertices, -1, axis = 0)
+    mask = np.zeros((height, width), dtype = bool)
+    top = max(int(np.floor(vertices[:, 1].min())), 0)
+    bottom = min(int(np.ceil(vertices[:, 1].max())), height)
+    if top >= bottom:
+        return mask
+    y = np.arange(top, bottom, dtype = np.float64)[:, None] + 0.5
+    rows, edges = np.nonzero((vertices[:, 1] > y) != (ends[:, 1] > y))
+    x_start, y_start = vertices[edges, 0], vertices[edges, 1]
+    x_end, y_end = ends[edges, 0], ends[edges, 1]
+    crossings = x_start + (y[rows, 0] - y_start) * (x_end - x_start) / (y_end - y_start)
+    columns = np.clip(np.ceil(crossings - 0.5), 0, width).astype(np.intp)
+    toggles = np.zeros((bottom - top, width + 1), dtype = np.uint8)
+    np.bitwise_xor.at(toggles, (rows, columns), 1)
+    mask[top:bottom] = np.bitwise_xor.accumulate(toggles, axis = 1)[:, :width]
+    return mask
+
+def _window(mask):
+    rows = np.flatnonzero(mask.any(axis = 1))
+    if not len(rows):
+        return (slice(0, 0), slice(0, 0))
+    columns = np.flatnonzero(mask.any(axis = 0))
+    return (slice(int(rows[0]), int(rows[-1]) + 1), slice(int(columns[0]), int(columns[-1]) + 1))
+
+class RegionMask:
+    """
+    The regions of interest rasterized at a resolution: a pixel is in the mask
+    when its center is in any of the regions. Without regions, the whole frame
+    is. The arrays are shared through the cache and read-only.
+
+    :Example:
+
+    region_mask = get_region_mask(scenemark.regions_of_interest, 1920, 1080)
+    detections = model(region_mask.crop(frame))
+    frame[~region_mask.mask] = 0
+
+    :param regions: polygons as returned by utils.get_regions_of_interest
+    :type regions: list of lists of (x, y) tuples
+    :param width: Width of the frame in pixels
+    :type width: int
+    :param height: Height of the frame in pixels
+    :type height: int
+    """
+    __slots__ = ("mask", "window", "windows")
+
+    def __init__(self, regions : list, width : int, height : int):
+        if np is None:
+            raise ImportError("RegionMask needs numpy, pip install scenera.node[numpy]")
+        masks = [_rasterize(region, width, height) for region in regions]
+        if masks:
+            mask = np.logical_or.reduce(masks)
+        else:
+            mask = np.ones((height, width), dtype = bool)
+        mask.flags.writeable = False
+        self.mask = mask
+        # (rows, columns) slices around the mask, and around each region
+        self.window = _window(mask)
+        self.windows = [_window(region_mask) for region_mask in masks]
+
+    def __repr__(self):
+        height, width = self.mask.shape
+        return f"RegionMask({width}x{height}, window {self.window})"
+
+    def crop(self, frame):
+        """
+        The part of a frame around the regions, as a view of the frame.
+
+        :param frame: height x width (x channels) image
+        :type frame: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        return frame[self.window]
+
+    @property
+    def cropped_mask(self):
+        """
+        The mask of the part of the frame crop returns.
+
+        :rtype: numpy.ndarray
+        """
+        return self.mask[self.window]
+
+class RegionMaskCache:
+    """
+    LRU of RegionMasks, keyed by the polygons and the resolution. Cameras keep
+    their regions of interest for days, so after the first SceneMark of a
+    camera its mask is a lookup.
+
+    :param maxsize: Number of masks to keep, defaults to 32
+    :type maxsize: int
+    """
+    def __init__(self, maxsize : int = 32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, regions : list, width : int, height : int):
+        """
+        The mask of the regions at a resolution, rasterized if it is not cached.
+
+        :param regions: polygons as returned by utils.get_regions_of_interest
+        :type regions: list of lists of (x, y) tuples
+        :param width: Width of the frame in pixels
+        :type width: int
+        :param height: Height of the frame in pixels
+        :type height: int
+        :rtype: RegionMask
+        """
+        key = (
+            tuple(tuple((float(x), float(y)) for x, y in region) for region in regions),
+            int(width),
+            int(height))
+        with self._lock:
+            region_mask = self._entries.get(key)
+            if region_mask is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return region_mask
+            self.misses += 1
+        # Rasterized outside of the lock, so lookups of other masks don't wait
+        region_mask = RegionMask(regions, int(width), int(height))
+        with self._lock:
+            self._entries[key] = region_mask
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+        return region_mask
+
+    def clear(self):
+        """
+        Forgets all masks.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """
+        Hit and miss counts and the current size of the cache.
+
+        :Example:
+
+        {"hits": 990, "misses": 10, "size": 1}
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+region_mask_cache = RegionMaskCache()
+
+def get_region_mask(regions : list, width : int, height : int):
+    """
+    The regions of interest as a mask of a frame, from region_mask_cache.
+
+    :param regions: polygons as returned by utils.get_regions_of_interest,
+        with coordinates relative to the frame
+    :type regions: list of lists of (x, y) tuples
+    :param width: Width of the frame in pixels
+    :type width: int
+    :param height: Height of the frame in pixels
+    :type height: int
+    :rtype: RegionMask
+    """
+    return region_mask_cache.get(regions, width, height)
@@ -0,0 +1,127 @@
+"""
+Sampling policy for schema validation, for nodes that can't afford to
+validate every request but still want to catch schema drift.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from .logger import configure_logger
+
+logger = logging.getLogger(__name__)
+logger = configure_logger(logger, debug=True)
+
+class ValidationSampler:
+    """
+    Decides which requests get validated and counts the outcome. Create one per
+    process (one for input and one for output validation) and pass it to every
+    SceneMark, so the counts carry over between requests. Thread-safe.
+
+    :Example:
+
+    # Validate the first 10 SceneMarks of every device, then 1 in 100
+    input_sampler = ValidationSampler(every_n = 100, first_n_per_device = 10)
+
+    :param every_n: Validate 1 in every_n requests (per device), defaults to 1,
+        which validates every request.
+    :type every_n: int
+    :param first_n_per_device: Always validate the first n requests of a device
+        before sampling starts, defaults to 0.
+    :type first_n_per_device: int
+    :param max_devices: How many devices to keep a count for. The least
+        recently seen device is forgotten first. Defaults to 10000.
+    :type max_devices: int
+    """
+    def __init__(
+        self,
+        every_n : int = 1,
+        first_n_per_device : int = 0,
+        max_devices : int = 10000,
+        ):
+        assert every_n >= 1, logger.exception("every_n should be at least 1")
+        self.every_n = every_n
+        self.first_n_per_device = first_n_per_device
+        self.max_devices = max_devices
+        self.validated = 0
+        self.skipped = 0
+        self.failed = 0
+        self._device_counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def should_validate(self, device_id : str = None):
+        """
+        Counts a request of the device and tells whether it should be validated.
+        A skipped request is counted as such straight away.
+
+        :param device_id: The device the SceneMark comes from, optional
+        :type device_id: string
+        :return: True if the request should be validated
+        :rtype: bool
+        """
+        with self._lock:
+            count = self._device_counts.pop(device_id, 0)
+            self._device_counts[device_id] = count + 1
+            if len(self._device_counts) > self.max_devices:
+                self._device_counts.popitem(last = False)
+            if count < self.first_n_per_device or \
+                    (count - self.first_n_per_device) % self.every_n == 0:
+                return True
+            self.skipped += 1
+            return False
+
+    def run(self, validation, device_id : str = None, accepted = None):
+        """
+        Runs the validation if the request is sampled, and counts the outcome.
+        Errors raised by the validation are counted as failed and re-raised.
+
+        :param validation: Function doing the validation, raising when it fails
+        :type validation: function
+        :param device_id: The device the SceneMark comes from, optional
+        :type device_id: string
+        :param accepted: Called once the validation finished. The outcome is
+            only counted if it returns True, e.g. not for a request that was
+            rejected for another reason in the meantime. Optional.
+        :type accepted: function
+        :return: True if the validation ran, False if it was skipped
+        :rtype: bool
+        """
+        if not self.should_validate(device_id):
+            return False
+        try:
+            validation()
+        except Exception:
+            if accepted is None or accepted():
+                with self._lock:
+                    self.failed += 1
+            raise
+        if accepted is None or accepted():
+            with self._lock:
+                self.validated += 1
+        return True
+
+    def metrics(self):
+        """
+        Counts of validated (and passed), failed and skipped requests.
+
+        :Example:
+
+        {"validated": 9, "failed": 1, "skipped": 990}
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "validated": self.validated,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                }
+
+    def reset(self):
+        """
+        Sets the counters back to zero and forgets the devices seen.
+        """
+        with self._lock:
+            self.validated = 0
+            self.skipped = 0
+            self.failed = 0
+            self._device_counts.clear()
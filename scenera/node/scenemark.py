@@ -7,15 +7,40 @@ This file contains the main SceneMark class and its methods for the Scenera Node
 __author__ = 'Dirk Meulenbelt'
 __date__ = '10.05.22'
 
+import binascii
+import copy
 import datetime
 import json
 import logging
 import random
+import threading
+import uuid
+import weakref
+from collections.abc import Mapping
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 import requests
 import urllib3
+from . import json_backend
+from .batch import DetectionBatch
+from .embedded import (
+    EmbeddedSceneData,
+    SpilledSceneData,
+    StreamedBody,
+    decode_embedded_scenedata
+    )
+from .indexes import (
+    VERSIONED_SECTIONS,
+    DetectionIndex,
+    SceneDataIndex,
+    TargetView,
+    VersionIndex
+    )
 from .jwt_decode import validate_jwt_token
+from .lazy import LazySceneMark, scan_object
 from .logger import configure_logger
 from .nodesequencer_header_schema import nodesequencer_header_schema
+from .records import Record
+from .sampling import ValidationSampler
 from .scenemark_schema import scenemark_schema
 from .spec import (
     EventType,
@@ -32,6 +57,9 @@ from .utils import (
     )
 from .validators import (
     ValidationError,
+    check_validation_engine,
+    get_projected_schema,
+    get_sub_schema,
     request_json_validator
     )
 
@@ -41,6 +69,132 @@ logger = configure_logger(logger, debug=True)
 # Disable warning for local development
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Where the items added by the Node live in the scenemark_schema,
+# used when only the Node's own additions are validated on the way out.
+ITEM_SCHEMA_PATHS = {
+    "AnalysisList": ("properties", "AnalysisList", "items"),
+    "SceneDataList": ("properties", "SceneDataList", "items"),
+    "ThumbnailList": ("properties", "ThumbnailList", "items"),
+    "VersionList": ("properties", "VersionControl", "properties", "VersionList", "items"),
+}
+
+# The parts of the SceneMark the SDK itself reads and writes. Pass this as
+# validation_projection to only validate what the SDK methods work with.
+SDK_FIELDS = (
+    "SceneMarkID",
+    "VersionControl",
+    "SceneDataList",
+    "AnalysisList",
+    "ThumbnailList",
+    )
+
+# Read when the SceneMark is loaded, so always part of a projection.
+_LOAD_FIELDS = ("SceneMarkID", "VersionControl", "SceneDataList")
+
+# Shared by all SceneMarks constructed with concurrent_validation
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_shared_executor(max_workers : int = None):
+    """
+    The thread pool that verifies tokens and validates schemas for SceneMarks
+    constructed with concurrent_validation, created on first use.
+
+    :param max_workers: Size of the pool when it is created, defaults to
+        the ThreadPoolExecutor default
+    :type max_workers: int
+    :return: the shared executor
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executor # pylint: disable=global-statement
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers = max_workers,
+                    thread_name_prefix = "scenemark-validation")
+    return _executor
+
+def _json_default(value):
+    """
+    Serializes the objects the SDK allows in a SceneMark besides plain JSON.
+    """
+    if isinstance(value, EmbeddedSceneData):
+        return value.to_base64()
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, DetectionBatch):
+        return value.to_list()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _dumps(value):
+    return json_backend.dumps(value, _json_default)
+
+def _for_validation(value):
+    """
+    A part of the SceneMark as the schema sees it: records and detection batches
+    are checked as the dictionaries they are written as, and embedded SceneData that is not encoded
+    yet as the string it will be written as. Only the dictionaries and lists
+    holding them are copied; anything else is returned as is.
+    """
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, DetectionBatch):
+        return value.to_list()
+    if isinstance(value, EmbeddedSceneData):
+        return ""
+    if isinstance(value, dict):
+        converted = None
+        for key, item in value.items():
+            checked = _for_validation(item)
+            if checked is not item:
+                if converted is None:
+                    converted = dict(value)
+                converted[key] = checked
+        return value if converted is None else converted
+    if isinstance(value, list):
+        converted = None
+        for position, item in enumerate(value):
+            checked = _for_validation(item)
+            if checked is not item:
+                if converted is None:
+                    converted = list(value)
+                converted[position] = checked
+        return value if converted is None else converted
+    return value
+
+def _holds_records(value):
+    """
+    Whether records or detection batches appear anywhere in value, e.g. a
+    BoundingBox record inside a DetectedObject dictionary.
+    """
+    if isinstance(value, (Record, DetectionBatch)):
+        return True
+    if isinstance(value, dict):
+        return any(_holds_records(item) for item in value.values())
+    if isinstance(value, list):
+        return any(_holds_records(item) for item in value)
+    return False
+
+def _merge_key(section : str, item : dict):
+    """
+    What makes an item the same as another when merging SceneMarks.
+    """
+    if section in ("SceneDataList", "ThumbnailList"):
+        return item.get('SceneDataID')
+    if section == "VersionList":
+        return (item.get('VersionNumber'), item.get('NodeID'))
+    analysis_id = item.get('AnalysisID')
+    return ("AnalysisID", analysis_id) if analysis_id else ("item", id(item))
+
+class _ParsedRequest:
+    # pylint: disable=too-few-public-methods
+    """
+    Stands in for a web framework request when the body is already parsed.
+    """
+    def __init__(self, payload):
+        self.json = payload
+
 class SceneMark:
     # pylint: disable=too-many-public-methods
     # pylint: disable=too-many-instance-attributes
@@ -56,36 +210,126 @@ class SceneMark:
     :type node_id: string
     :param disable_token_verification: Allows you to turn off the token validation.
     :type disable_token_verification: bool
+    :param disable_linter: Turns off all schema validation.
+    :type disable_linter: bool
+    :param output_validation: 'full' validates the whole SceneMark in
+        return_scenemark_to_ns. 'delta' only validates the items added or updated
+        through the add_* and update_* methods, as the rest was already validated
+        on the way in. Note that 'delta' does not see changes made to the SceneMark
+        directly, nor check uniqueness across the AnalysisList. Defaults to 'full'.
+    :type output_validation: string
+    :param validation_engine: 'jsonschema' or 'compiled', the latter runs validation
+        code generated from the schemas. Defaults to the engine set with
+        validators.set_validation_engine.
+    :type validation_engine: string
+    :param validation_projection: Only validate these top-level fields of the
+        SceneMark (SceneMarkID, VersionControl and SceneDataList are always added),
+        the rest is passed through unchecked. See SDK_FIELDS for the fields the SDK
+        methods use. Defaults to None, validating the whole SceneMark.
+    :type validation_projection: iterable of strings
+    :param input_sampler: Decides which incoming requests are validated and counts
+        the outcome. Share one across requests. Defaults to validating every request.
+    :type input_sampler: ValidationSampler
+    :param output_sampler: Same as input_sampler, for return_scenemark_to_ns.
+    :type output_sampler: ValidationSampler
+    :param concurrent_validation: Verifies the token and validates the schemas
+        side by side on the shared executor. An invalid token is raised as soon
+        as it is found and takes precedence over a schema error as before;
+        otherwise both finish before processing starts. Defaults to False.
+    :type concurrent_validation: bool
+    :param spill_threshold: EmbeddedSceneData larger than this many bytes is moved
+        to a memory mapped temporary file, both when received and when added, and
+        streamed when the SceneMark is returned. Received payloads are measured
+        base64 encoded. Defaults to None, keeping all payloads in memory.
+    :type spill_threshold: int
+    :param spill_directory: Where the temporary files are created, defaults to
+        the system's temporary directory.
+    :type spill_directory: string
     """
     def __init__ (
         self,
         request,
         node_id : str,
         disable_token_verification: bool = False,
-        disable_linter: bool = False
+        disable_linter: bool = False,
+        output_validation: str = "full",
+        validation_engine: str = None,
+        validation_projection = None,
+        input_sampler: ValidationSampler = None,
+        output_sampler: ValidationSampler = None,
+        concurrent_validation: bool = False,
+        spill_threshold: int = None,
+        spill_directory: str = None,
         ):
 
         # --- Validation
-        self.nodesequencer_header = request.json['NodeSequencerHeader']
+        payload = request.json
+        self.nodesequencer_header = payload['NodeSequencerHeader']
+        token_verification = None
         if not disable_token_verification:
-            validate_jwt_token(self.nodesequencer_header['NodeToken'])
-
-        self.scenemark = request.json['SceneMark']
-
-        self.disable_linter = disable_linter
-        if not self.disable_linter:
-            request_json_validator(
-                self.nodesequencer_header,
-                nodesequencer_header_schema,
-                "NodeSequencer Header"
-                )
+            if concurrent_validation and not disable_linter:
+                token_verification = get_shared_executor().submit(
+                    validate_jwt_token, self.nodesequencer_header['NodeToken'])
+            else:
+                validate_jwt_token(self.nodesequencer_header['NodeToken'])
 
-            # Verify SceneMark input to match the Spec
-            request_json_validator(
-                self.scenemark,
-                scenemark_schema,
-                "SceneMark"
-                )
+        try:
+            self.scenemark = payload['SceneMark']
+
+            self.disable_linter = disable_linter
+            assert output_validation in ("full", "delta"), \
+                logger.exception("output_validation should be either 'full' or 'delta'")
+            self.output_validation = output_validation
+            if validation_engine is not None:
+                check_validation_engine(validation_engine)
+            self.validation_engine = validation_engine
+            self.scenemark_schema = scenemark_schema
+            if validation_projection is not None:
+                self.scenemark_schema = get_projected_schema(
+                    scenemark_schema, set(validation_projection).union(_LOAD_FIELDS))
+            self.output_sampler = output_sampler
+            # Items added or updated by this Node, by id, for 'delta' output validation
+            self._changed_items = {}
+            # Decoded EmbeddedSceneData, by (SceneDataID, encoded payload), for as
+            # long as the caller holds on to it
+            self._decoded_scenedata = weakref.WeakValueDictionary()
+            # SceneDataID/SceneDataURI -> SceneData items
+            self._scenedata_index = SceneDataIndex()
+            # RelatedSceneData -> DetectedObjects, built on first use
+            self._detection_index = DetectionIndex()
+            # The targets, computed when first asked for
+            self._target_view = None
+            # Items by VersionNumber, per list
+            self._version_index = VersionIndex()
+            # Sections the Node added records to, which validation has to convert
+            self._sections_with_records = set()
+            # After a fork, the lists this SceneMark copied and may change in place,
+            # and the items it owns by id. None as long as nothing is shared.
+            self._owned_sections = None
+            self._owned_items = {}
+            self.spill_threshold = spill_threshold
+            self.spill_directory = spill_directory
+            if not self.disable_linter:
+                if token_verification is None:
+                    self._validate_input_sampled(input_sampler)
+                else:
+                    schema_validation = get_shared_executor().submit(
+                        self._validate_input_sampled, input_sampler, token_verification)
+                    done, _ = wait(
+                        (token_verification, schema_validation), return_when = FIRST_EXCEPTION)
+                    # An invalid token is raised below as soon as it is known,
+                    # without waiting for the schemas
+                    if token_verification not in done or token_verification.exception() is None:
+                        schema_validation.result()
+                    else:
+                        schema_validation.cancel()
+        finally:
+            # An invalid token is reported first, as when run one after the other
+            if token_verification is not None:
+                token_verification.result()
+
+        if self.spill_threshold is not None:
+            self._spill_embedded_scenedata()
 
         logger.info(f"Processing SceneMark: {self.scenemark['SceneMarkID']}")
 
@@ -96,7 +340,10 @@ class SceneMark:
         # --- Version Control
 
         # Get the number of the current node in the NodeSequence
-        self.my_version_number = get_my_version_number(self.scenemark)
+        latest_version = self._version_index.latest(
+            "VersionList", self.scenemark['VersionControl']['VersionList'])
+        self.my_version_number = latest_version + 1.0 if latest_version is not None \
+            else get_my_version_number(self.scenemark)
 
         # Update the version control with the NodeID & TimeStamp
         self.my_timestamp = self.get_current_utc_timestamp()
@@ -113,13 +360,361 @@ class SceneMark:
         self.regions_of_interest = get_regions_of_interest(self.nodesequencer_header)
 
         # Find the latest scenedata additions
-        self.latest_sd_version = get_latest_scenedata_version_number(self.scenemark)
+        latest_version = self._version_index.latest(
+            "SceneDataList", self.scenemark['SceneDataList'])
+        self.latest_sd_version = latest_version if latest_version is not None \
+            else get_latest_scenedata_version_number(self.scenemark)
 
         # Get the targets to work on
         self.targets = self.get_scenedata_uri_list()
+        self._scenedata_index.update(self.scenemark['SceneDataList'])
 
         logger.info(f"Working on these items: {self.targets}")
 
+    @property
+    def node_datatype_mode(self):
+        """
+        The DataType the Node works on. Setting it changes the targets.
+
+        :rtype: string
+        """
+        return self._node_datatype_mode
+
+    @node_datatype_mode.setter
+    def node_datatype_mode(self, datatype : str):
+        self._node_datatype_mode = datatype
+        self._target_view = None
+
+    @property
+    def latest_sd_version(self):
+        """
+        The VersionNumber of the latest SceneData additions, which are the
+        targets. Setting it changes the targets.
+
+        :rtype: float
+        """
+        return self._latest_sd_version
+
+    @latest_sd_version.setter
+    def latest_sd_version(self, version : float):
+        self._latest_sd_version = version
+        self._target_view = None
+
+    def _targets(self):
+        """
+        The TargetView, computed again only when the targets may have changed.
+        """
+        scenedata_list = self.scenemark['SceneDataList']
+        if self._target_view is None or not self._target_view.is_current(scenedata_list):
+            self._target_view = TargetView(
+                scenedata_list, self.node_datatype_mode, self.latest_sd_version)
+        return self._target_view
+
+    @classmethod
+    def from_dict(cls, payload : dict, node_id : str, **kwargs):
+        """
+        Loads a SceneMark from an already parsed request body, without
+        needing a web framework request object.
+
+        :param payload: Request body including a SceneMark and a NodeSequencerHeader
+        :type payload: dict
+        :param node_id: The unique identifier of the Node, see SceneMark
+        :type node_id: string
+        :param kwargs: Any of the other SceneMark arguments
+        :return: the SceneMark
+        :rtype: SceneMark
+        """
+        return cls(_ParsedRequest(payload), node_id, **kwargs)
+
+    @classmethod
+    def from_bytes(cls, body, node_id : str, lazy : bool = False, **kwargs):
+        """
+        Loads a SceneMark from the raw request body, parsing it exactly once with
+        the fastest JSON backend installed (orjson, ujson, or the standard library).
+
+        :Example:
+
+        scenemark = SceneMark.from_bytes(request.get_data(), NODE_ID)
+
+        :param body: Request body including a SceneMark and a NodeSequencerHeader
+        :type body: bytes or string
+        :param node_id: The unique identifier of the Node, see SceneMark
+        :type node_id: string
+        :param lazy: Only parse the sections of the SceneMark that are read, see
+            LazySceneMark. Sections that are never read are returned to the
+            NodeSequencer exactly as received. Pays off for SceneMarks carrying
+            large embedded SceneData; for sections made of many small objects,
+            e.g. a long AnalysisList, a full parse with orjson is faster.
+            Defaults to False.
+        :type lazy: bool
+        :param kwargs: Any of the other SceneMark arguments
+        :return: the SceneMark
+        :rtype: SceneMark
+        :raises ValueError: The body is not valid JSON.
+        """
+        if not lazy:
+            return cls.from_dict(json_backend.loads(body), node_id, **kwargs)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = bytes(body)
+        # The SceneMark's sections are found in the same pass over the body
+        spans, _ = scan_object(body, nested = ('SceneMark',))
+        start, end = spans['NodeSequencerHeader']
+        scenemark_start, _, scenemark_spans = spans['SceneMark']
+        payload = {
+            'NodeSequencerHeader': json_backend.loads(body[start:end]),
+            'SceneMark': LazySceneMark(body, scenemark_start, scenemark_spans),
+            }
+        return cls.from_dict(payload, node_id, **kwargs)
+
+    def _validate_input_sampled(self, input_sampler, token_verification = None):
+        """
+        Used internally to validate the input, counted by the sampler if one is
+        given. With a concurrent token verification, a SceneMark whose token
+        turns out to be invalid is not counted, as it would not have been
+        validated when run one after the other.
+        """
+        if input_sampler is None:
+            self.validate_input()
+            return
+        accepted = None
+        if token_verification is not None:
+            if token_verification.done() and token_verification.exception() is not None:
+                return
+            def accepted():
+                # The token was submitted first, so it is never queued behind this
+                return token_verification.exception() is None
+        input_sampler.run(self.validate_input, self._sampling_key(), accepted)
+
+    def validate_input(self):
+        """
+        Validates the NodeSequencer header and the SceneMark as received.
+        Called by the __init__ method unless the linter is disabled.
+
+        :raises ValidationError: Represents a JSON Schema validation error.
+        """
+        request_json_validator(
+            self.nodesequencer_header,
+            nodesequencer_header_schema,
+            "NodeSequencer Header",
+            self.validation_engine
+            )
+
+        # Verify SceneMark input to match the Spec
+        request_json_validator(
+            self._validation_instance(),
+            self.scenemark_schema,
+            "SceneMark",
+            self.validation_engine
+            )
+
+    def validate_output(self):
+        """
+        Validates the SceneMark before it is returned, either in full or only the
+        items this Node changed, see output_validation.
+
+        :raises ValidationError: Represents a JSON Schema validation error.
+        """
+        if self.output_validation == "delta":
+            self.validate_changes()
+        else:
+            request_json_validator(
+                self._validation_instance(),
+                self.scenemark_schema,
+                "SceneMark schema",
+                self.validation_engine
+                )
+
+    def _validation_instance(self):
+        """
+        The SceneMark as the validators take it. Of a lazy SceneMark only
+        the sections the schema describes are parsed. Sections holding records
+        or unencoded embedded SceneData are checked as they will be written.
+        """
+        instance = self.scenemark
+        if isinstance(instance, LazySceneMark):
+            schema = self.scenemark_schema
+            if "additionalProperties" in schema or "patternProperties" in schema:
+                instance = instance.to_dict()
+            else:
+                instance = instance.to_dict(schema.get("properties", {}))
+        converted = {}
+        for section in self._sections_with_records.union(("SceneDataList",)):
+            if section in instance:
+                checked = _for_validation(instance[section])
+                if checked is not instance[section]:
+                    converted[section] = checked
+        if converted:
+            instance = dict(instance, **converted)
+        return instance
+
+    def _sampling_key(self):
+        """
+        The device a sampler counts the request for. Read defensively,
+        as it may be taken before the SceneMark has been validated.
+        """
+        scenemark_id = self.scenemark.get('SceneMarkID') \
+            if isinstance(self.scenemark, Mapping) else None
+        return scenemark_id[41:45] if isinstance(scenemark_id, str) else None
+
+    def fork(self):
+        """
+        A copy of the SceneMark for one branch of the work, e.g. per model or per
+        region of interest, that is changed and returned on its own. The forks
+        share the SceneMark as received. A list is only copied when a fork adds
+        an item to it, and a SceneData item only when a fork updates it, so
+        forking doesn't copy e.g. a large upstream AnalysisList. This SceneMark
+        copies lists before changing them too, from now on.
+
+        :Example:
+
+        for model in models:
+            branch = scenemark.fork()
+            branch.add_analysis_list_item("Detected", "ItemPresence",
+                detected_objects = model(frame))
+            branch.return_scenemark_to_ns()
+
+        :return: the fork
+        :rtype: SceneMark
+        """
+        forked = copy.copy(self)
+        if isinstance(self.scenemark, LazySceneMark):
+            forked.scenemark = self.scenemark.copy()
+        else:
+            forked.scenemark = dict(self.scenemark)
+        for scenemark in (self, forked):
+            scenemark._owned_sections = set()
+            scenemark._owned_items = {}
+        forked.targets = list(self.targets)
+        forked._changed_items = dict(self._changed_items)
+        forked._sections_with_records = set(self._sections_with_records)
+        forked._decoded_scenedata = weakref.WeakValueDictionary()
+        forked._scenedata_index = SceneDataIndex()
+        forked._detection_index = DetectionIndex()
+        forked._version_index = VersionIndex()
+        forked._target_view = None
+        logger.info(f"SceneMark forked: {self.scenemark['SceneMarkID']}")
+        return forked
+
+    def _own_section(self, section : str):
+        """
+        Used internally to copy a list that may be shared with a fork, before
+        changing it. A list of a lazy SceneMark that was not parsed yet is
+        parsed separately by each fork, so it is never shared.
+
+        :param section: 'VersionList', 'SceneDataList', 'AnalysisList' or 'ThumbnailList'
+        :type section: string
+        """
+        if self._owned_sections is None or section in self._owned_sections:
+            return
+        if section == "VersionList":
+            version_control = dict(self.scenemark['VersionControl'])
+            version_control['VersionList'] = list(version_control['VersionList'])
+            self.scenemark['VersionControl'] = version_control
+        elif isinstance(self.scenemark, LazySceneMark) and \
+                not self.scenemark.is_parsed(section):
+            # Appended items are kept aside per fork until the list is parsed
+            pass
+        elif isinstance(self.scenemark.get(section), list):
+            self.scenemark[section] = list(self.scenemark[section])
+        self._owned_sections.add(section)
+
+    def _own_item(self, section : str, item : dict):
+        """
+        Used internally to copy an item that may be shared with a fork, before
+        changing it. The list holding it must be owned already.
+
+        :return: the item to change
+        :rtype: dict
+        """
+        if self._owned_sections is None or id(item) in self._owned_items:
+            return item
+        owned = dict(item)
+        items = self._section_list(section)
+        for position, candidate in enumerate(items):
+            if candidate is item:
+                items[position] = owned
+                break
+        self._owned_items[id(owned)] = owned
+        self._changed_items.pop(id(item), None)
+        # The indexes still hold the shared item
+        self._scenedata_index.invalidate()
+        self._version_index.invalidate()
+        if section == "AnalysisList":
+            self._detection_index.invalidate()
+        return owned
+
+    def merge(self, *branches):
+        """
+        Adds what other SceneMarks, e.g. forks of this one that ran different
+        models, added to the same SceneMark, so the results are returned at once.
+        The items each branch added are appended in order, skipping those this
+        SceneMark already has: SceneData and thumbnails by SceneDataID, AnalysisList
+        items by AnalysisID, or when it is empty by being the same object, and
+        VersionList items by VersionNumber and NodeID. Changes the branches made to
+        the items they received are not merged. The items are shared with the
+        branches, and only copied when this SceneMark updates them.
+
+        :Example:
+
+        branches = [scenemark.fork() for _ in models]
+        ...
+        scenemark.merge(*branches)
+        scenemark.return_scenemark_to_ns()
+
+        :param branches: the SceneMarks to take the items from
+        :type branches: SceneMark
+        :raises ValueError: When a branch has another SceneMarkID. Nothing is
+            merged then.
+        """
+        scenemark_id = self.scenemark['SceneMarkID']
+        for branch in branches:
+            if branch.scenemark['SceneMarkID'] != scenemark_id:
+                raise ValueError(
+                    "Only SceneMarks with the same SceneMarkID can be merged, "
+                    f"not '{branch.scenemark['SceneMarkID']}' into '{scenemark_id}'")
+        if self._owned_sections is None:
+            # The merged items are shared, so lists and items are copied before changing
+            self._owned_sections = set()
+        # The keys of the items this SceneMark added, per list
+        seen = {section: set() for section in ITEM_SCHEMA_PATHS}
+        for section, item in self._changed_items.values():
+            seen[section].add(_merge_key(section, item))
+        merged = 0
+        for branch in branches:
+            for section, item in list(branch._changed_items.values()):
+                key = _merge_key(section, item)
+                if key in seen[section]:
+                    continue
+                seen[section].add(key)
+                if section == "SceneDataList" and self._scenedata_index.items_with_id(
+                        self.scenemark['SceneDataList'], key):
+                    continue
+                self._merge_item(section, item)
+                merged += 1
+            self._sections_with_records.update(branch._sections_with_records)
+        logger.info(f"Merged {merged} items from {len(branches)} SceneMarks")
+
+    def _merge_item(self, section : str, item : dict):
+        """
+        Used internally to append an item from another SceneMark, keeping the
+        indexes up to date.
+        """
+        if section == "VersionList":
+            self._own_section("VersionList")
+            version_list = self.scenemark['VersionControl']['VersionList']
+            version_list.append(item)
+            self._version_index.added("VersionList", version_list, item)
+        else:
+            # Still shared with the branch, so copied before it is changed
+            self._append_item(section, item, owned = False)
+            if section == "AnalysisList" and self._detection_index.built:
+                self._detection_index.added(self.scenemark['AnalysisList'], item)
+            elif section == "SceneDataList":
+                self._scenedata_index.added(self.scenemark['SceneDataList'], item)
+                self._target_view = None
+        self._track_change(section, item)
+
     def save_request(self, request_type : str, name : str):
         """
         Used for development purposes to manually check the request.
@@ -137,7 +732,7 @@ class SceneMark:
             if not name:
                 name = "scenemark"
             with open(f"{name}.json", 'w', encoding="utf-8") as json_file:
-                json.dump(self.scenemark, json_file)
+                json_file.write(self._dump_scenemark())
         elif request_type == "NSH":
             logger.info(f"Saving NodeSequener Header as '{name}.json'")
             if not name:
@@ -160,10 +755,7 @@ class SceneMark:
         :return: List of target SceneData URIs
         :rtype: list
         """
-        return [scenedata_item['SceneDataURI'] \
-            for scenedata_item in self.scenemark['SceneDataList'] \
-                if (scenedata_item['DataType'] == self.node_datatype_mode) and \
-                    (scenedata_item['VersionNumber'] == self.latest_sd_version)]
+        return list(self._targets().uris)
 
     def get_scenedata_id_uri_dict(self, targets_only = True):
         """
@@ -185,10 +777,7 @@ class SceneMark:
         :rtype: dict
         """
         if targets_only:
-            return {scenedata_item['SceneDataID']:scenedata_item['SceneDataURI'] \
-                for scenedata_item in self.scenemark['SceneDataList'] \
-                    if (scenedata_item['DataType'] == self.node_datatype_mode) and \
-                        (scenedata_item['VersionNumber'] == self.latest_sd_version)}
+            return dict(self._targets().id_to_uri)
         return {scenedata_item['SceneDataID']:scenedata_item['SceneDataURI'] \
             for scenedata_item in self.scenemark['SceneDataList']}
 
@@ -210,10 +799,7 @@ class SceneMark:
         :rtype: dict
         """
         if targets_only:
-            return {scenedata_item['SceneDataURI']:scenedata_item['SceneDataID'] \
-                for scenedata_item in self.scenemark['SceneDataList'] \
-                    if (scenedata_item['DataType'] == self.node_datatype_mode) and \
-                        (scenedata_item['VersionNumber'] == self.latest_sd_version)}
+            return dict(self._targets().uri_to_id)
         return {scenedata_item['SceneDataURI']:scenedata_item['SceneDataID'] \
             for scenedata_item in self.scenemark['SceneDataList']}
 
@@ -227,9 +813,9 @@ class SceneMark:
         :return: SceneDataID corresponding to the URI
         :rtype: string
         """
-        for scenedata in self.scenemark['SceneDataList']:
-            if scenedata['SceneDataURI'] == uri:
-                return scenedata['SceneDataID']
+        matches = self._scenedata_index.items_with_uri(self.scenemark['SceneDataList'], uri)
+        if matches:
+            return matches[0]['SceneDataID']
         logger.warning("No SceneData associated with the SceneMark")
         return "No SceneDataID found!"
 
@@ -244,13 +830,51 @@ class SceneMark:
         :rtype: string
         :raises ValidationError: "No match" if there isn't a match
         """
-        for scenedata in self.scenemark['SceneDataList']:
-            if scenedata['SceneDataID'] == scenedata_id:
-                return scenedata['SceneDataURI']
+        matches = self._scenedata_index.items_with_id(
+            self.scenemark['SceneDataList'], scenedata_id)
+        if matches:
+            return matches[0]['SceneDataURI']
         error = "No match found"
         logger.exception(error)
         raise ValidationError(error)
 
+    def get_embedded_scenedata(self, scenedata_id : str):
+        """
+        Gets the EmbeddedSceneData of a SceneData item, decoded. The payload is
+        decoded on the first call and shared by later calls for as long as a
+        caller holds on to it, after which it is released.
+
+        :Example:
+
+        image = PIL.Image.open(io.BytesIO(scenemark.get_embedded_scenedata(scenedata_id)))
+
+        :param scenedata_id: SceneDataID
+        :type scenedata_id: string
+
+        :return: the payload, empty if nothing is embedded
+        :rtype: memoryview
+        :raises ValidationError: "No match" if there isn't a match
+        :raises binascii.Error: The payload is not valid base64
+        """
+        matches = self._scenedata_index.items_with_id(
+            self.scenemark['SceneDataList'], scenedata_id)
+        if not matches:
+            error = "No match found"
+            logger.exception(error)
+            raise ValidationError(error)
+        embedded = matches[0].get('EmbeddedSceneData')
+        if isinstance(embedded, EmbeddedSceneData):
+            return embedded.buffer
+        if not embedded:
+            return memoryview(b"")
+        # Keyed by the encoded string too, so an updated payload is decoded again
+        key = (scenedata_id, embedded)
+        payload = self._decoded_scenedata.get(key)
+        if payload is None:
+            payload = decode_embedded_scenedata(embedded)
+            self._decoded_scenedata[key] = payload
+        return payload
+
     def get_detected_objects_from_sd_id(self, scenedata_id):
         """
         Creates a list of DetectedObjects that have thge pased
@@ -277,20 +901,77 @@ class SceneMark:
             }\n
         ]
 
+        Note that the lookup uses an index, built on the first call and kept up
+        to date by add_analysis_list_item, merge and fork. Unlike earlier versions,
+        which scanned the AnalysisList on every call, changes made to the
+        AnalysisList directly are only seen when the AnalysisList is replaced or
+        its length changes. Call invalidate_detections after appending to,
+        removing from or editing the DetectedObjects of existing items, e.g.
+        changing their RelatedSceneData.
+
         :return: list of DetectedObjects
         :rtype: list
         """
-        det_objects = []
-        for analysis_list_item in self.scenemark['AnalysisList']:
-            for det_object_item in analysis_list_item['DetectedObjects']:
-                if det_object_item['RelatedSceneData'] == scenedata_id:
-                    det_objects.append(det_object_item)
-        return det_objects
+        return list(self._detection_index.related_to(self.scenemark['AnalysisList'], scenedata_id))
+
+    def find_detections(
+        self,
+        item_type : str = None,
+        min_probability : float = None,
+        version : float = None,
+        event_type : str = None,
+        attribute = None,
+        ):
+        """
+        Finds the DetectedObjects in the AnalysisList matching all of the given
+        conditions, e.g. those added by earlier Nodes. Uses indexes that are built
+        on the first call and kept up to date by add_analysis_list_item. Call
+        invalidate_detections after changing DetectedObjects directly.
+
+        :Example:
+
+        scenemark.find_detections(item_type = "Human", min_probability = 0.8)\n
+        scenemark.find_detections(attribute = ("Mood", "Anger"))
+
+        :param item_type: NICEItemType of the DetectedObject
+        :type item_type: string
+        :param min_probability: Lowest Probability of the DetectedObject
+        :type min_probability: float
+        :param version: VersionNumber of the AnalysisList item, i.e. the Node that added it
+        :type version: float
+        :param event_type: EventType of the AnalysisList item
+        :type event_type: string
+        :param attribute: Name of an Attribute the DetectedObject has,
+            or an (Attribute, Value) pair
+        :type attribute: string or tuple
+
+        :return: list of DetectedObjects, in the order of the AnalysisList
+        :rtype: list
+        """
+        return self._detection_index.find(
+            self.scenemark['AnalysisList'],
+            item_type = item_type,
+            min_probability = min_probability,
+            version = version,
+            event_type = event_type,
+            attribute = attribute,
+            )
+
+    def invalidate_detections(self):
+        """
+        Makes the next DetectedObjects lookup rebuild its indexes. Only needed
+        after changing the AnalysisList items in place rather than through the
+        SceneMark's methods, e.g. appending to or editing the DetectedObjects of
+        an existing item, or setting fields of a DetectedObject record after
+        adding it.
+        """
+        self._detection_index.invalidate()
 
     def get_detected_objects_from_sd_uri(self, scenedata_uri):
         """
         Creates a list of DetectedObjects that have the pased
         SceneDataURI's associated ID listed as RelatedSceneData.
+        Uses the index of get_detected_objects_from_sd_id, see there.
 
         :return: list of DetectedObjects
         :rtype: list
@@ -298,6 +979,47 @@ class SceneMark:
         id = self.get_id_from_uri(scenedata_uri)
         return self.get_detected_objects_from_sd_id(id)
 
+    def items_added_by(self, version : float):
+        """
+        Gets what the Node with a VersionNumber added to the SceneMark,
+        e.g. to aggregate the work of earlier Nodes.
+
+        :Example:
+
+        {\n
+            "VersionList": [{"VersionNumber": 2.0, "NodeID": ..}],\n
+            "SceneDataList": [..],\n
+            "AnalysisList": [..],\n
+            "ThumbnailList": []\n
+        }
+
+        :param version: VersionNumber of the Node in the NodeSequence
+        :type version: float
+
+        :return: the items with the VersionNumber, per list, in list order
+        :rtype: dict
+        """
+        return self._version_index.added_by(
+            version, {section: self._section_list(section) for section in VERSIONED_SECTIONS})
+
+    def items_added_by_node(self, node_id : str):
+        """
+        Gets what a Node added to the SceneMark, under any of the VersionNumbers
+        it has in the VersionList.
+
+        :param node_id: NodeID of the Node
+        :type node_id: string
+
+        :return: the items added by the Node, per list, see items_added_by
+        :rtype: dict
+        """
+        added = {section: [] for section in VERSIONED_SECTIONS}
+        for version in self._version_index.versions_of_node(
+                self._section_list("VersionList"), node_id):
+            for section, items in self.items_added_by(version).items():
+                added[section].extend(items)
+        return added
+
     def generate_scenedata_id(self):
         """
         Generates a SceneDataID using the Node ID
@@ -581,8 +1303,10 @@ class SceneMark:
         :type total_item_count: int
         :param error_message: Used to propagate errors, optional, defaults to ""
         :type error_message: string
-        :param detected_objects: Holds detected objects, defaults to an empty list
-        :type detected_objects: list
+        :param detected_objects: Holds detected objects, either generated with
+            generate_detected_object_item or DetectedObject records, or a DetectionBatch,
+            defaults to an empty list
+        :type detected_objects: list or DetectionBatch
 
         :raises AssertionError: When the ProcessingStatus is not recognized as part of the Spec.
         :raises AssertionError: When the EventType is not recognized as part of the Spec.
@@ -604,8 +1328,13 @@ class SceneMark:
         analysis_list_item['ErrorMessage'] = str(error_message)
         analysis_list_item['TotalItemCount'] = total_item_count
         analysis_list_item['DetectedObjects'] = detected_objects
+        if _holds_records(detected_objects):
+            self._sections_with_records.add('AnalysisList')
 
-        self.scenemark['AnalysisList'].append(analysis_list_item)
+        self._append_item('AnalysisList', analysis_list_item)
+        if self._detection_index.built:
+            self._detection_index.added(self.scenemark['AnalysisList'], analysis_list_item)
+        self._track_change("AnalysisList", analysis_list_item)
         logger.info(f"AnalysisList item of EventType '{event_type}' added")
 
     def add_thumbnail_list_item(self, scenedata_id : str):
@@ -633,7 +1362,8 @@ class SceneMark:
         thumbnail_list_item['VersionNumber'] = self.my_version_number
         thumbnail_list_item['SceneDataID'] = scenedata_id
 
-        self.scenemark['ThumbnailList'].append(thumbnail_list_item)
+        self._append_item('ThumbnailList', thumbnail_list_item)
+        self._track_change("ThumbnailList", thumbnail_list_item)
         logger.info(f"Thumbnail set to: {scenedata_id}")
 
     def add_scenedata_item(
@@ -645,7 +1375,7 @@ class SceneMark:
         duration : str  = "",
         media_format : str = "",
         encryption : dict = {},
-        embedded_scenedata : str = "",
+        embedded_scenedata = "",
         ):
         # pylint: disable=dangerous-default-value
         """
@@ -686,8 +1416,10 @@ class SceneMark:
         :type media_format: string
         :param encryption: Encryption on or off, defaults to False
         :type encryption: bool
-        :param embedded_scenedata: Embedded scenedata, no idea what this is for to be honest
-        :type embedded_scenedata: string
+        :param embedded_scenedata: SceneData embedded in the SceneMark, base64
+            encoded, or given as a buffer (bytes, memoryview, ...) which is encoded
+            when the SceneMark is returned, see EmbeddedSceneData. Defaults to "".
+        :type embedded_scenedata: string or bytes-like object
         :raises AssertionError: "No SceneData URI is present."
         :raises AssertionError: "This DataType is not part of the Spec."
         :raises AssertionError: "This Media Format is not part of the Spec."
@@ -728,9 +1460,12 @@ class SceneMark:
         # The following parameters are all left out unless you specify them.
         scenedata_list_item['SourceNodeDescription'] = source_node_description
         scenedata_list_item['Duration'] = duration
-        scenedata_list_item['EmbeddedSceneData'] = embedded_scenedata
+        scenedata_list_item['EmbeddedSceneData'] = self._embedded_scenedata(embedded_scenedata)
 
-        self.scenemark['SceneDataList'].append(scenedata_list_item)
+        self._append_item('SceneDataList', scenedata_list_item)
+        self._scenedata_index.added(self.scenemark['SceneDataList'], scenedata_list_item)
+        self._target_view = None
+        self._track_change("SceneDataList", scenedata_list_item)
         logger.info(f"SceneData item '{scenedata_list_item['SceneDataID']}' added")
 
     def update_scenedata_item(self, scenedata_id, key, value):
@@ -742,13 +1477,23 @@ class SceneMark:
         :param value: the value that this key should take
         """
         try:
-            for sd_item in self.scenemark['SceneDataList']:
-                if sd_item['SceneDataID'] == scenedata_id:
-                    if sd_item[key]:
-                        sd_item_for_change = sd_item
-                        break
-
+            for sd_item in self._scenedata_index.items_with_id(
+                    self.scenemark['SceneDataList'], scenedata_id):
+                if sd_item[key]:
+                    sd_item_for_change = sd_item
+                    break
+
+            if key == 'EmbeddedSceneData':
+                value = self._embedded_scenedata(value)
+            self._own_section("SceneDataList")
+            sd_item_for_change = self._own_item("SceneDataList", sd_item_for_change)
             sd_item_for_change[key] = value
+            if key in ('SceneDataID', 'SceneDataURI'):
+                self._scenedata_index.invalidate()
+            if key == 'VersionNumber':
+                self._version_index.invalidate()
+            self._target_view = None
+            self._track_change("SceneDataList", sd_item_for_change)
             logger.info(f"SceneData item '{scenedata_id}' updated: '{key}' set to '{value}'")
         except KeyError as _e:
             error = "Can't update the SceneData item"
@@ -773,7 +1518,111 @@ class SceneMark:
         version_list_item['DateTimeStamp'] = self.my_timestamp
         version_list_item['NodeID'] = self.node_id
 
+        self._own_section("VersionList")
+        if self._owned_sections is not None:
+            self._owned_items[id(version_list_item)] = version_list_item
         self.scenemark['VersionControl']['VersionList'].append(version_list_item)
+        self._version_index.added(
+            "VersionList", self.scenemark['VersionControl']['VersionList'], version_list_item)
+        self._track_change("VersionList", version_list_item)
+
+    def _append_item(self, section : str, item : dict, owned : bool = True):
+        """
+        Used internally to append an item to a list of the SceneMark,
+        without parsing the list if the SceneMark is lazy. Items that are not
+        owned, e.g. merged from another SceneMark, are copied before changing them.
+        """
+        self._own_section(section)
+        if owned and self._owned_sections is not None:
+            self._owned_items[id(item)] = item
+        if isinstance(self.scenemark, LazySceneMark):
+            self.scenemark.append(section, item)
+        else:
+            self.scenemark[section].append(item)
+        if self._version_index.is_built(section):
+            self._version_index.added(section, self._section_list(section), item)
+
+    def _section_list(self, section : str):
+        """
+        Used internally to get one of the lists holding versioned items.
+
+        :param section: 'VersionList', 'SceneDataList', 'AnalysisList' or 'ThumbnailList'
+        :type section: string
+        """
+        if section == "VersionList":
+            return self.scenemark['VersionControl']['VersionList']
+        return self.scenemark.get(section, [])
+
+    def _embedded_scenedata(self, embedded_scenedata):
+        """
+        Used internally to take EmbeddedSceneData as given to add_scenedata_item
+        or update_scenedata_item: buffers are wrapped so they are base64 encoded
+        when written, and large payloads are spilled.
+        """
+        if embedded_scenedata is not None and \
+                not isinstance(embedded_scenedata, (str, EmbeddedSceneData)):
+            embedded_scenedata = EmbeddedSceneData(embedded_scenedata)
+        return self._spill(embedded_scenedata)
+
+    def _spill(self, embedded_scenedata):
+        """
+        Used internally to move EmbeddedSceneData larger than
+        the spill_threshold to a temporary file.
+
+        :raises binascii.Error: A base64 payload is not valid base64.
+        """
+        if self.spill_threshold is None or isinstance(embedded_scenedata, SpilledSceneData):
+            return embedded_scenedata
+        if isinstance(embedded_scenedata, EmbeddedSceneData):
+            if embedded_scenedata.buffer.nbytes > self.spill_threshold:
+                return SpilledSceneData.from_buffer(
+                    embedded_scenedata.buffer, self.spill_directory)
+        elif isinstance(embedded_scenedata, str) and len(embedded_scenedata) > self.spill_threshold:
+            return SpilledSceneData.from_base64(embedded_scenedata, self.spill_directory)
+        return embedded_scenedata
+
+    def _spill_embedded_scenedata(self):
+        """
+        Used internally to spill the large payloads of a received SceneMark.
+        A payload that is not valid base64 is left in place.
+        """
+        for scenedata in self.scenemark['SceneDataList']:
+            embedded_scenedata = scenedata.get('EmbeddedSceneData')
+            try:
+                spilled = self._spill(embedded_scenedata)
+            except binascii.Error:
+                logger.warning(
+                    f"EmbeddedSceneData of '{scenedata.get('SceneDataID')}' is not valid base64")
+                continue
+            if spilled is not embedded_scenedata:
+                scenedata['EmbeddedSceneData'] = spilled
+
+    def _track_change(self, section : str, item : dict):
+        """
+        Used internally to remember what the Node added or updated,
+        for 'delta' output validation.
+
+        :param section: Key of ITEM_SCHEMA_PATHS the item belongs to
+        :type section: string
+        :param item: The added or updated item
+        :type item: dict
+        """
+        self._changed_items[id(item)] = (section, item)
+
+    def validate_changes(self):
+        """
+        Validates only the items that were added or updated by this Node
+        against their part of the SceneMark schema.
+
+        :raises ValidationError: Represents a JSON Schema validation error.
+        """
+        for section, item in self._changed_items.values():
+            request_json_validator(
+                _for_validation(item),
+                get_sub_schema(scenemark_schema, *ITEM_SCHEMA_PATHS[section]),
+                f"SceneMark {section} item",
+                self.validation_engine
+                )
 
     def add_custom_notification_message(self, message : str):
         """
@@ -799,9 +1648,12 @@ class SceneMark:
 
         # Update our original request with the updated SceneMark
         if not self.disable_linter:
-            request_json_validator(self.scenemark, scenemark_schema, "SceneMark schema")
+            if self.output_sampler is None:
+                self.validate_output()
+            else:
+                self.output_sampler.run(self.validate_output, self._sampling_key())
 
-        scenemark = json.dumps(self.scenemark)
+        scenemark = self._dump_scenemark() if test else self._stream_scenemark()
         if test:
             logger.info("Sending the SceneMark back directly")
             return scenemark
@@ -830,6 +1682,48 @@ class SceneMark:
         except:
             logger.info(f"Returned SceneMark to NodeSequencer: {answer}")
 
+    def _dump_scenemark(self):
+        """
+        Serializes the SceneMark. A lazy SceneMark copies the sections
+        that were not read straight from the received body.
+        """
+        if isinstance(self.scenemark, LazySceneMark):
+            return self.scenemark.dumps(_dumps).decode("utf-8")
+        return _dumps(self.scenemark).decode("utf-8")
+
+    def _stream_scenemark(self):
+        """
+        Serializes the SceneMark to send it. Spilled payloads are left out,
+        and are encoded a chunk at a time while the body is sent.
+
+        :return: the SceneMark as JSON
+        :rtype: bytes, or StreamedBody if there are spilled payloads
+        """
+        marker = f"spilled-scenedata-{uuid.uuid4().hex}"
+        spilled = []
+
+        def default(value):
+            if isinstance(value, SpilledSceneData):
+                spilled.append(value)
+                return marker
+            return _json_default(value)
+
+        def dumps(value):
+            return json_backend.dumps(value, default)
+
+        if isinstance(self.scenemark, LazySceneMark):
+            body = self.scenemark.dumps(dumps)
+        else:
+            body = dumps(self.scenemark)
+        if not spilled:
+            return body
+        # The payloads were serialized in order, each in place of the marker
+        pieces = body.split(f'"{marker}"'.encode("ascii"))
+        parts = [pieces[0]]
+        for payload, piece in zip(spilled, pieces[1:]):
+            parts.extend((b'"', payload, b'"', piece))
+        return StreamedBody(parts)
+
     # Helper Functions
     @staticmethod
     def get_current_utc_timestamp():
@@ -0,0 +1,426 @@
+"""
+Compiles a JSON schema into a specialised Python validation function.
+
+Instead of interpreting the schema for every instance, the schema is turned
+into Python source once, doing direct dict/list/type/enum checks, and that
+source is compiled. The generated function accepts and rejects exactly what
+jsonschema does for the (draft-06) keywords it supports. Any other keyword the
+schema's draft validates makes compilation fail rather than silently being
+skipped; annotations and unknown keywords are ignored, as jsonschema does.
+"""
+
+# pylint: disable=too-few-public-methods
+import itertools
+import numbers
+import re
+from collections.abc import Mapping, Sequence
+from urllib.parse import unquote
+import jsonschema
+
+# Validation keywords the compiler implements. 'format' is only an annotation
+# here, as the validators are built without a format checker.
+COMPILED_KEYWORDS = frozenset([
+    "$ref",
+    "additionalItems",
+    "additionalProperties",
+    "allOf",
+    "anyOf",
+    "const",
+    "enum",
+    "exclusiveMaximum",
+    "exclusiveMinimum",
+    "format",
+    "items",
+    "maxItems",
+    "maxLength",
+    "maxProperties",
+    "maximum",
+    "minItems",
+    "minLength",
+    "minProperties",
+    "minimum",
+    "not",
+    "oneOf",
+    "pattern",
+    "properties",
+    "required",
+    "type",
+    "uniqueItems",
+    ])
+
+_TYPE_CHECKS = {
+    "object": "isinstance({var}, dict)",
+    "array": "isinstance({var}, list)",
+    "string": "isinstance({var}, str)",
+    "null": "{var} is None",
+    "boolean": "isinstance({var}, bool)",
+    "number": "(type({var}) in (int, float) or "
+        "(isinstance({var}, _Number) and not isinstance({var}, bool)))",
+    "integer": "(type({var}) is int or (isinstance({var}, int) and not isinstance({var}, bool)) "
+        "or (isinstance({var}, float) and {var}.is_integer()))",
+}
+
+def _is_number(instance):
+    return isinstance(instance, numbers.Number) and not isinstance(instance, bool)
+
+def _json_equal(one, two):
+    """
+    Equality as jsonschema sees it: True and 1, or False and 0, are different.
+    """
+    if one is two:
+        return True
+    if isinstance(one, str) or isinstance(two, str):
+        return one == two
+    if isinstance(one, Sequence) and isinstance(two, Sequence):
+        return len(one) == len(two) and all(_json_equal(i, j) for i, j in zip(one, two))
+    if isinstance(one, Mapping) and isinstance(two, Mapping):
+        return one.keys() == two.keys() and all(_json_equal(one[key], two[key]) for key in one)
+    if isinstance(one, bool) or isinstance(two, bool):
+        return isinstance(one, bool) and isinstance(two, bool) and one == two
+    return one == two
+
+def _scalar_key(value):
+    """
+    Hashable stand-in for a JSON value that does not look inside containers.
+    Values that are equal according to _json_equal always get the same key.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return value
+    if value_type is bool:
+        return ("b", value)
+    if value_type in (int, float) or value is None:
+        return ("v", value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, bool):
+        return ("b", bool(value))
+    if isinstance(value, Mapping):
+        return ("d", len(value))
+    if isinstance(value, Sequence):
+        return ("l", len(value))
+    return ("v", value)
+
+def _shallow_key(item):
+    if isinstance(item, Mapping):
+        return ("d", frozenset((key, _scalar_key(value)) for key, value in item.items()))
+    if isinstance(item, Sequence) and not isinstance(item, str):
+        return ("l", tuple(_scalar_key(value) for value in item))
+    return _scalar_key(item)
+
+def _unique(container):
+    """
+    Equivalent of jsonschema's uniqueItems check. Items are bucketed by a
+    shallow key first, so only items that look alike are compared in depth.
+    """
+    if len(container) < 2:
+        return True
+    try:
+        buckets = {}
+        for item in container:
+            bucket = buckets.setdefault(_shallow_key(item), [])
+            if any(_json_equal(item, other) for other in bucket):
+                return False
+            bucket.append(item)
+        return True
+    except TypeError:
+        for index, item in enumerate(container):
+            if any(_json_equal(item, other) for other in container[index + 1:]):
+                return False
+        return True
+
+class _SchemaCompiler:
+    """
+    Generates the source of the validation functions for one root schema.
+    Each generated function returns None when the instance is valid, or an
+    error message describing the first problem found.
+    """
+    def __init__(self, root):
+        self.root = root
+        # Everything jsonschema validates for this draft but the compiler can't
+        self.unsupported = frozenset(
+            jsonschema.validators.validator_for(root).VALIDATORS) - COMPILED_KEYWORDS
+        self.functions = {}
+        self.sources = []
+        self.constants = {}
+        self.counter = itertools.count()
+
+    def constant(self, value):
+        name = f"_c{next(self.counter)}"
+        self.constants[name] = value
+        return name
+
+    def variable(self):
+        return f"x{next(self.counter)}"
+
+    def resolve(self, ref):
+        if not ref.startswith("#"):
+            raise NotImplementedError(f"Only local $refs can be compiled, not '{ref}'")
+        target = self.root
+        for part in unquote(ref[1:]).split("/")[1:]:
+            part = part.replace("~1", "/").replace("~0", "~")
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        return target
+
+    def function_for(self, schema):
+        """
+        Name of the generated function for a (sub)schema, generating it on first use.
+        Registering the name before generating the body lets recursive $refs work.
+        """
+        key = id(schema)
+        if key not in self.functions:
+            name = f"_validate_{len(self.functions)}"
+            self.functions[key] = name
+            lines = []
+            self.emit(schema, "x", lines, 1)
+            self.sources.append("\n".join([f"def {name}(x):"] + lines + ["    return None"]))
+        return self.functions[key]
+
+    def emit(self, schema, var, lines, depth):
+        # pylint: disable=too-many-branches
+        """
+        Appends the checks of schema on the value held in var.
+        """
+        pad = "    " * depth
+        if schema is True:
+            return
+        if schema is False:
+            lines.append(f"{pad}return f'False schema does not allow {{{var}!r}}'")
+            return
+        unsupported = self.unsupported.intersection(schema)
+        if unsupported and "$ref" not in schema:
+            raise NotImplementedError(f"Keywords {sorted(unsupported)} can't be compiled")
+
+        # Draft-06: a $ref replaces all of its siblings
+        if "$ref" in schema:
+            self.emit_call(self.function_for(self.resolve(schema["$ref"])), var, lines, depth)
+            return
+
+        if "type" in schema:
+            types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+            check = " or ".join(_TYPE_CHECKS[each].format(var=var) for each in types)
+            reprs = ", ".join(repr(each) for each in types)
+            lines.append(f"{pad}if not ({check}):")
+            lines.append(f"{pad}    return f'{{{var}!r}} is not of type {_escape(reprs)}'")
+
+        if "enum" in schema:
+            self.emit_enum(schema["enum"], var, lines, depth)
+
+        if "const" in schema:
+            const = self.constant(schema["const"])
+            lines.append(f"{pad}if not _json_equal({var}, {const}):")
+            lines.append(f"{pad}    return f'{{{const}!r}} was expected'")
+
+        self.emit_object(schema, var, lines, depth)
+        self.emit_array(schema, var, lines, depth)
+        self.emit_string(schema, var, lines, depth)
+        self.emit_number(schema, var, lines, depth)
+        self.emit_combinators(schema, var, lines, depth)
+
+    def emit_call(self, function, var, lines, depth):
+        pad = "    " * depth
+        lines.append(f"{pad}_error = {function}({var})")
+        lines.append(f"{pad}if _error is not None:")
+        lines.append(f"{pad}    return _error")
+
+    def emit_enum(self, enum, var, lines, depth):
+        pad = "    " * depth
+        message = f"{pad}    return f'{{{var}!r}} is not one of {{{self.constant(enum)}!r}}'"
+        if all(isinstance(each, str) for each in enum):
+            allowed = self.constant(frozenset(enum))
+            lines.append(f"{pad}if not (isinstance({var}, str) and {var} in {allowed}):")
+        elif all(isinstance(each, bool) for each in enum):
+            allowed = self.constant(tuple(enum))
+            lines.append(f"{pad}if not (isinstance({var}, bool) and {var} in {allowed}):")
+        else:
+            allowed = self.constant(list(enum))
+            lines.append(f"{pad}if not any(_json_equal({var}, _each) for _each in {allowed}):")
+        lines.append(message)
+
+    def emit_object(self, schema, var, lines, depth):
+        keywords = ("properties", "required", "additionalProperties",
+            "minProperties", "maxProperties")
+        if not any(keyword in schema for keyword in keywords):
+            return
+        pad = "    " * (depth + 1)
+        start = len(lines)
+        lines.append(f"{pad[4:]}if isinstance({var}, dict):")
+        lines.append(f"{pad}pass")
+        for name in schema.get("required", []):
+            lines.append(f"{pad}if {name!r} not in {var}:")
+            lines.append(f"{pad}    return {repr(name) + ' is a required property'!r}")
+        if "minProperties" in schema:
+            lines.append(f"{pad}if len({var}) < {schema['minProperties']!r}:")
+            lines.append(f"{pad}    return f'{{{var}!r}} does not have enough properties'")
+        if "maxProperties" in schema:
+            lines.append(f"{pad}if len({var}) > {schema['maxProperties']!r}:")
+            lines.append(f"{pad}    return f'{{{var}!r}} has too many properties'")
+        properties = schema.get("properties", {})
+        for name, sub_schema in properties.items():
+            child = self.variable()
+            lines.append(f"{pad}if {name!r} in {var}:")
+            lines.append(f"{pad}    {child} = {var}[{name!r}]")
+            before = len(lines)
+            self.emit(sub_schema, child, lines, depth + 2)
+            if len(lines) == before:
+                del lines[-2:]
+        additional = schema.get("additionalProperties", True)
+        if additional is not True:
+            known = self.constant(frozenset(properties))
+            child = self.variable()
+            lines.append(f"{pad}for _key in {var}:")
+            lines.append(f"{pad}    if _key not in {known}:")
+            if additional is False:
+                lines.append(f"{pad}        return "
+                    "f'Additional properties are not allowed ({_key!r} was unexpected)'")
+            else:
+                lines.append(f"{pad}        {child} = {var}[_key]")
+                self.emit(additional, child, lines, depth + 3)
+        _close_block(lines, start)
+
+    def emit_array(self, schema, var, lines, depth):
+        keywords = ("items", "additionalItems", "uniqueItems", "minItems", "maxItems")
+        if not any(keyword in schema for keyword in keywords):
+            return
+        pad = "    " * (depth + 1)
+        start = len(lines)
+        lines.append(f"{pad[4:]}if isinstance({var}, list):")
+        lines.append(f"{pad}pass")
+        if "minItems" in schema:
+            lines.append(f"{pad}if len({var}) < {schema['minItems']!r}:")
+            lines.append(f"{pad}    return f'{{{var}!r}} is too short'")
+        if "maxItems" in schema:
+            lines.append(f"{pad}if len({var}) > {schema['maxItems']!r}:")
+            lines.append(f"{pad}    return f'{{{var}!r}} is too long'")
+        items = schema.get("items", {})
+        child = self.variable()
+        if isinstance(items, list):
+            for index, sub_schema in enumerate(items):
+                lines.append(f"{pad}if len({var}) > {index}:")
+                lines.append(f"{pad}    {child} = {var}[{index}]")
+                self.emit(sub_schema, child, lines, depth + 2)
+            additional = schema.get("additionalItems", True)
+            if additional is False:
+                lines.append(f"{pad}if len({var}) > {len(items)}:")
+                lines.append(f"{pad}    return f'Additional items are not allowed in {{{var}!r}}'")
+            elif additional is not True:
+                lines.append(f"{pad}for {child} in {var}[{len(items)}:]:")
+                self.emit(additional, child, lines, depth + 2)
+        elif items is not True and items != {}:
+            lines.append(f"{pad}for {child} in {var}:")
+            self.emit(items, child, lines, depth + 2)
+            if lines[-1] == f"{pad}for {child} in {var}:":
+                lines.pop()
+        if schema.get("uniqueItems"):
+            lines.append(f"{pad}if not _unique({var}):")
+            lines.append(f"{pad}    return f'{{{var}!r}} has non-unique elements'")
+        _close_block(lines, start)
+
+    def emit_string(self, schema, var, lines, depth):
+        keywords = ("minLength", "maxLength", "pattern")
+        if not any(keyword in schema for keyword in keywords):
+            return
+        pad = "    " * (depth + 1)
+        start = len(lines)
+        lines.append(f"{pad[4:]}if isinstance({var}, str):")
+        lines.append(f"{pad}pass")
+        if "minLength" in schema:
+            lines.append(f"{pad}if len({var}) < {schema['minLength']!r}:")
+            lines.append(f"{pad}    return f'{{{var}!r}} is too short'")
+        if "maxLength" in schema:
+            lines.append(f"{pad}if len({var}) > {schema['maxLength']!r}:")
+            lines.append(f"{pad}    return f'{{{var}!r}} is too long'")
+        if "pattern" in schema:
+            pattern = self.constant(re.compile(schema["pattern"]))
+            lines.append(f"{pad}if not {pattern}.search({var}):")
+            lines.append(f"{pad}    return f'{{{var}!r}} does not match {{{pattern}.pattern!r}}'")
+        _close_block(lines, start)
+
+    def emit_number(self, schema, var, lines, depth):
+        comparisons = {
+            "minimum": ("<", "is less than the minimum of"),
+            "maximum": (">", "is greater than the maximum of"),
+            "exclusiveMinimum": ("<=", "is less than or equal to the minimum of"),
+            "exclusiveMaximum": (">=", "is greater than or equal to the maximum of"),
+        }
+        if not any(keyword in schema for keyword in comparisons):
+            return
+        pad = "    " * (depth + 1)
+        start = len(lines)
+        lines.append(f"{pad[4:]}if _is_number({var}):")
+        lines.append(f"{pad}pass")
+        for keyword, (operator, text) in comparisons.items():
+            if keyword in schema:
+                lines.append(f"{pad}if {var} {operator} {schema[keyword]!r}:")
+                lines.append(f"{pad}    return f'{{{var}!r}} {text} {schema[keyword]!r}'")
+        _close_block(lines, start)
+
+    def emit_combinators(self, schema, var, lines, depth):
+        pad = "    " * depth
+        for sub_schema in schema.get("allOf", []):
+            self.emit_call(self.function_for(sub_schema), var, lines, depth)
+        if "anyOf" in schema:
+            calls = " or ".join(
+                f"{self.function_for(each)}({var}) is None" for each in schema["anyOf"])
+            lines.append(f"{pad}if not ({calls}):")
+            lines.append(f"{pad}    return f'{{{var}!r}} is not valid under any of the given schemas'")
+        if "oneOf" in schema:
+            calls = " + ".join(
+                f"({self.function_for(each)}({var}) is None)" for each in schema["oneOf"])
+            lines.append(f"{pad}_valid = {calls}")
+            lines.append(f"{pad}if _valid == 0:")
+            lines.append(f"{pad}    return f'{{{var}!r}} is not valid under any of the given schemas'")
+            lines.append(f"{pad}if _valid > 1:")
+            lines.append(f"{pad}    return f'{{{var}!r}} is valid under more than one of the given schemas'")
+        if "not" in schema:
+            lines.append(f"{pad}if {self.function_for(schema['not'])}({var}) is None:")
+            lines.append(f"{pad}    return f'{{{var}!r}} should not be valid under {{{self.constant(schema['not'])}!r}}'")
+
+def _close_block(lines, start):
+    """
+    Tidies up a type-guarded block opened at lines[start] with a placeholder
+    'pass': the placeholder goes if the block got a body, else the whole block goes.
+    """
+    if len(lines) == start + 2:
+        del lines[start:]
+    else:
+        del lines[start + 1]
+
+def _escape(text):
+    """
+    Escapes text to be put inside a generated f-string.
+    """
+    return text.replace("\\", "\\\\").replace("'", "\\'").replace("{", "{{").replace("}", "}}")
+
+def compile_schema(schema, name="schema"):
+    """
+    Compiles a schema into a validation function.
+
+    :Example:
+
+    validate = compile_schema(scenemark_schema)
+    validate(scenemark)  # None when valid, else an error message
+
+    :param schema: the schema found in the Spec
+    :type schema: json
+    :param name: used in tracebacks of the generated code
+    :type name: string
+    :return: function taking an instance and returning None or an error message
+    :rtype: function
+    :raises NotImplementedError: The schema uses a keyword that can't be compiled.
+    """
+    compiler = _SchemaCompiler(schema)
+    entry_point = compiler.function_for(schema)
+    source = "\n\n".join(compiler.sources)
+    namespace = {
+        "_Number": numbers.Number,
+        "_is_number": _is_number,
+        "_json_equal": _json_equal,
+        "_unique": _unique,
+        }
+    namespace.update(compiler.constants)
+    # pylint: disable=exec-used
+    exec(compile(source, f"<compiled {name} validator>", "exec"), namespace)
+    validate = namespace[entry_point]
+    validate.source = source
+    return validate
@@ -3,12 +3,47 @@ This file contains the main SceneMark class and its methods for the Scenera Node
 """
 
 import logging
+import threading
+from collections import OrderedDict
 import jsonschema
 from .logger import configure_logger
+from .schema_compiler import compile_schema
 
 logger = logging.getLogger(__name__)
 logger = configure_logger(logger, debug=True)
 
+# Validation engines request_json_validator can use:
+# 'jsonschema' interprets the schema, 'compiled' runs code generated from it.
+ENGINES = ("jsonschema", "compiled")
+_default_engine = "jsonschema"
+
+# Validators are built once per schema and reused for every request.
+# Keyed by (engine, id(schema)); the schema itself is kept alive in the value
+# so the id can't be recycled by another object while the entry exists.
+# Each registry keeps the REGISTRY_SIZE most recently used entries, so
+# per-request or copied schemas don't pile up.
+REGISTRY_SIZE = 128
+_validator_registry = OrderedDict()
+_sub_schema_registry = OrderedDict()
+_projected_schema_registry = OrderedDict()
+_validator_registry_lock = threading.Lock()
+
+def _cached(registry, key, schema, build):
+    """
+    Returns the value cached under key, calling build() to make it on a miss
+    and evicting the least recently used entry once the registry is full.
+    """
+    with _validator_registry_lock:
+        entry = registry.get(key)
+        if entry is not None:
+            registry.move_to_end(key)
+            return entry[1]
+        value = build()
+        registry[key] = (schema, value)
+        if len(registry) > REGISTRY_SIZE:
+            registry.popitem(last=False)
+    return value
+
 class ValidationError(Exception):
     """
     Self-defined error to raise when the values do not match.
@@ -17,7 +52,132 @@ class ValidationError(Exception):
         _ = super().__init__()
         self.msg = msg
 
-def request_json_validator(request, schema, schema_name):
+def check_validation_engine(engine : str):
+    """
+    Checks that engine names a validation engine.
+
+    :param engine: 'jsonschema' or 'compiled'
+    :type engine: string
+    :raises ValueError: The engine is unknown.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown validation engine '{engine}', use one of {ENGINES}")
+
+def set_validation_engine(engine : str):
+    """
+    Sets the engine used by request_json_validator when none is passed.
+
+    :param engine: 'jsonschema' or 'compiled'
+    :type engine: string
+    :raises ValueError: The engine is unknown.
+    """
+    global _default_engine # pylint: disable=global-statement
+    check_validation_engine(engine)
+    _default_engine = engine
+
+def get_validator(schema, engine : str = "jsonschema"):
+    """
+    Returns the validator for a schema, building it on first use.
+    The metaschema check and the construction of the validator (and its
+    $ref resolver), or the code generation, only happen once per schema per process.
+
+    :param schema: the schema found in the Spec
+    :type schema: json
+    :param engine: 'jsonschema' or 'compiled', defaults to 'jsonschema'
+    :type engine: string
+    :return: a jsonschema validator bound to the schema, or for the 'compiled'
+        engine a function returning None or an error message
+    :rtype: jsonschema.protocols.Validator or function
+    :raises SchemaError: The schema itself is invalid.
+    :raises ValueError: The engine is unknown.
+    """
+    check_validation_engine(engine)
+    def build():
+        validator_class = jsonschema.validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        if engine == "compiled":
+            return compile_schema(schema, schema.get("title", "schema"))
+        return validator_class(schema)
+    return _cached(_validator_registry, (engine, id(schema)), schema, build)
+
+def get_sub_schema(schema, *path):
+    """
+    Returns the part of a schema found at path as a standalone schema,
+    carrying the root's $schema and definitions along so $refs keep resolving.
+    The result is cached, so its validator is only built once as well.
+
+    :Example:
+
+    get_sub_schema(scenemark_schema, "properties", "AnalysisList", "items")
+
+    :param schema: the schema found in the Spec
+    :type schema: json
+    :param path: keys leading to the sub-schema
+    :type path: string
+    :return: the sub-schema
+    :rtype: json
+    """
+    def build():
+        sub_schema = schema
+        for step in path:
+            sub_schema = sub_schema[step]
+        sub_schema = dict(sub_schema)
+        for root_key in ("$schema", "definitions"):
+            if root_key in schema:
+                sub_schema.setdefault(root_key, schema[root_key])
+        return sub_schema
+    return _cached(_sub_schema_registry, (id(schema), path), schema, build)
+
+def get_projected_schema(schema, fields):
+    """
+    Returns a pruned copy of an object schema that only checks the given
+    top-level fields; everything else passes through unchecked. The result is
+    cached per set of fields, so its validator is only built once as well.
+
+    :Example:
+
+    get_projected_schema(scenemark_schema, ("SceneMarkID", "SceneDataList"))
+
+    :param schema: the schema found in the Spec
+    :type schema: json
+    :param fields: the top-level properties to keep
+    :type fields: iterable of strings
+    :return: the pruned schema
+    :rtype: json
+    """
+    fields = frozenset(fields)
+    def build():
+        projected_schema = dict(schema)
+        projected_schema["properties"] = {
+            name: sub_schema for name, sub_schema in schema.get("properties", {}).items()
+            if name in fields}
+        if "required" in schema:
+            projected_schema["required"] = [
+                name for name in schema["required"] if name in fields]
+        return projected_schema
+    return _cached(_projected_schema_registry, (id(schema), fields), schema, build)
+
+def warm_validators(*schemas, engine : str = None):
+    """
+    Builds the validators up front, e.g. at import or app start, so the
+    first request does not pay for it. Defaults to the SceneMark and the
+    NodeSequencer header schemas.
+
+    :param schemas: the schemas to build validators for. Optional.
+    :type schemas: json
+    :param engine: 'jsonschema' or 'compiled', defaults to the engine set
+        with set_validation_engine
+    :type engine: string
+    """
+    if not schemas:
+        # pylint: disable=import-outside-toplevel
+        from .nodesequencer_header_schema import nodesequencer_header_schema
+        from .scenemark_schema import scenemark_schema
+        schemas = (nodesequencer_header_schema, scenemark_schema)
+    for schema in schemas:
+        get_validator(schema, engine or _default_engine)
+
+def request_json_validator(request, schema, schema_name, engine : str = None):
     """
     Used internally to validate incoming and outgoing requests.
 
@@ -25,10 +185,23 @@ def request_json_validator(request, schema, schema_name):
     :type request: json
     :param schema: the schema found in the Spec
     :type schema: json
+    :param engine: 'jsonschema' or 'compiled', defaults to the engine set
+        with set_validation_engine. Both accept and reject the same requests.
+    :type engine: string
     :raises ValidationError: Represents a JSON Schema validation error.
+    :raises ValueError: The engine is unknown.
     """
+    engine = engine or _default_engine
+    check_validation_engine(engine)
     try:
-        jsonschema.validate(instance = request, schema = schema)
+        if engine == "compiled":
+            message = get_validator(schema, engine)(request)
+            if message is not None:
+                raise jsonschema.exceptions.ValidationError(message)
+        else:
+            error = jsonschema.exceptions.best_match(get_validator(schema).iter_errors(request))
+            if error is not None:
+                raise error
     except jsonschema.exceptions.ValidationError as _e:
         logger.exception(f"Schema validation failed for {schema_name}")
         raise jsonschema.exceptions.ValidationError(_e.message)
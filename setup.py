@@ -41,5 +41,8 @@ setup(
         "cryptography",
         "jsonschema",
         "requests",
-        "urllib3"]
+        "urllib3"],
+    extras_require={
+        "fast": ["orjson"],
+        "numpy": ["numpy"]}
 )
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+Unit-tests for DetectedObjects built from arrays
+"""
+
+import json
+import unittest
+import jsonschema
+from scenera.node.batch import DetectionBatch, np
+from tests.node.scenemark_validation_tests import load_scenemark
+
+CLASS_MAP = {0: "Human", 2: "Vehicle"}
+
+def make_batch(**kwargs):
+    return DetectionBatch(
+        np.array([[0.1, 0.2, 0.3, 0.4], [0.5, 0.5, 0.25, 0.125]], dtype = np.float32),
+        np.array([0.9, 0.5], dtype = np.float32),
+        np.array([2, 0]),
+        CLASS_MAP,
+        **kwargs)
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class DetectionBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark()
+
+    def test_same_json_as_generated_dictionaries(self):
+        batch = make_batch(related_scenedata = "SDT_1", frame = 3, item_ids = [7, 8])
+        expected = self.sm.generate_detected_object_item(
+            "Vehicle", "SDT_1", item_id = "7", probability = float(np.float32(0.9)), frame = 3,
+            bounding_box = self.sm.generate_bounding_box(
+                float(np.float32(0.1)), float(np.float32(0.2)),
+                float(np.float32(0.4)), float(np.float32(0.3))))
+        self.assertEqual(json.dumps(batch.to_list()[0]), json.dumps(expected))
+        self.assertEqual(batch.to_list()[1]['NICEItemType'], "Human")
+        self.assertEqual(list(batch)[0], expected)
+        self.assertIs(next(iter(batch)), next(iter(batch)))
+
+    def test_checked_once_per_batch(self):
+        with self.assertRaises(AssertionError):
+            DetectionBatch(np.zeros((2, 4)), np.zeros(2), np.array([0, 1]), CLASS_MAP)
+        with self.assertRaises(AssertionError):
+            DetectionBatch(np.zeros((2, 4)), np.zeros(3), np.array([0, 0]), CLASS_MAP)
+        self.assertEqual(len(DetectionBatch(np.zeros((0, 4)), [], [], CLASS_MAP)), 0)
+
+    def test_added_to_the_scenemark(self):
+        batch = make_batch(related_scenedata = ["SDT_1", "SDT_2"])
+        self.sm.add_analysis_list_item("Detected", "ItemPresence", detected_objects = batch)
+        self.sm.validate_output()
+        self.sm.validate_changes()
+        written = json.loads(self.sm._dump_scenemark())['AnalysisList'][-1]['DetectedObjects']
+        self.assertEqual(written, batch.to_list())
+        self.assertEqual([detected_object['NICEItemType']
+            for detected_object in self.sm.get_detected_objects_from_sd_id("SDT_2")], ["Human"])
+        self.assertEqual(len(self.sm.find_detections(
+            version = self.sm.my_version_number, min_probability = 0.6)), 1)
+
+    def test_invalid_batch_fails_validation(self):
+        batch = make_batch(timestamp = 12)
+        self.sm.add_analysis_list_item("Detected", "ItemPresence", detected_objects = batch)
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            self.sm.validate_output()
+
+if __name__ == '__main__':
+    unittest.main()
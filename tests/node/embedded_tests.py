@@ -0,0 +1,151 @@
+"""
+Unit-tests for embedded SceneData as buffers
+"""
+
+import base64
+import gc
+import json
+import unittest
+from unittest import mock
+from scenera.node import SceneMark
+from scenera.node.embedded import (
+    EmbeddedSceneData,
+    SpilledSceneData,
+    StreamedBody,
+    encode_embedded_scenedata
+    )
+from scenera.node.validators import ValidationError
+from tests.node.scenemark_validation_tests import load_scenemark
+
+PAYLOAD = bytes(range(256)) * 40
+
+def add_still(sm, embedded_scenedata):
+    sm.add_scenedata_item("https://sduri.example.com/still.jpg", "RGBStill",
+        media_format = "JPEG", encryption = {"EncryptionOn": False},
+        embedded_scenedata = embedded_scenedata)
+
+class EmbeddedSceneDataTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark()
+        self.scenedata_id = self.sm.scenemark['SceneDataList'][0]['SceneDataID']
+        self.sm.scenemark['SceneDataList'][0]['EmbeddedSceneData'] = \
+            base64.b64encode(PAYLOAD).decode()
+
+    def test_decoded_once_while_referenced(self):
+        payload = self.sm.get_embedded_scenedata(self.scenedata_id)
+        self.assertEqual(bytes(payload), PAYLOAD)
+        self.assertTrue(payload.readonly)
+        self.assertIs(self.sm.get_embedded_scenedata(self.scenedata_id), payload)
+        del payload
+        gc.collect()
+        self.assertEqual(len(self.sm._decoded_scenedata), 0)
+
+    def test_updated_payload_is_decoded_again(self):
+        payload = self.sm.get_embedded_scenedata(self.scenedata_id)
+        self.sm.update_scenedata_item(self.scenedata_id, 'EmbeddedSceneData',
+            encode_embedded_scenedata(b"new"))
+        self.assertEqual(bytes(self.sm.get_embedded_scenedata(self.scenedata_id)), b"new")
+        self.assertEqual(bytes(payload), PAYLOAD)
+
+    def test_updated_with_a_buffer(self):
+        self.sm.update_scenedata_item(self.scenedata_id, 'EmbeddedSceneData',
+            memoryview(PAYLOAD[::-1]))
+        embedded = self.sm.scenemark['SceneDataList'][0]['EmbeddedSceneData']
+        self.assertIsInstance(embedded, EmbeddedSceneData)
+        self.assertEqual(bytes(self.sm.get_embedded_scenedata(self.scenedata_id)), PAYLOAD[::-1])
+        returned = json.loads(self.sm.return_scenemark_to_ns(test = True))
+        self.assertEqual(base64.b64decode(returned['SceneDataList'][0]['EmbeddedSceneData']),
+            PAYLOAD[::-1])
+
+    def test_nothing_embedded(self):
+        self.sm.scenemark['SceneDataList'][0]['EmbeddedSceneData'] = None
+        self.assertEqual(len(self.sm.get_embedded_scenedata(self.scenedata_id)), 0)
+
+    def test_unknown_scenedata_id(self):
+        with self.assertRaises(ValidationError):
+            self.sm.get_embedded_scenedata("SDT_unknown")
+
+class EmbeddingBuffersTestCase(unittest.TestCase):
+
+    def test_buffer_is_encoded_on_return(self):
+        for output_validation in ("full", "delta"):
+            sm = load_scenemark(output_validation = output_validation)
+            buffer = bytearray(PAYLOAD)
+            add_still(sm, memoryview(buffer))
+            item = sm.scenemark['SceneDataList'][-1]
+            self.assertIsInstance(item['EmbeddedSceneData'], EmbeddedSceneData)
+            self.assertEqual(bytes(sm.get_embedded_scenedata(item['SceneDataID'])), PAYLOAD)
+            returned = json.loads(sm.return_scenemark_to_ns(test = True))
+            self.assertEqual(returned['SceneDataList'][-1]['EmbeddedSceneData'],
+                base64.b64encode(PAYLOAD).decode())
+
+    def test_not_a_buffer(self):
+        sm = load_scenemark()
+        with self.assertRaises(TypeError):
+            add_still(sm, 12)
+
+    def test_lazy_scenemark(self):
+        sm = load_scenemark()
+        body = json.dumps({"NodeSequencerHeader": sm.nodesequencer_header,
+            "SceneMark": json.loads(sm.return_scenemark_to_ns(test = True))})
+        sm = SceneMark.from_bytes(body, "unit_test_node", lazy = True,
+            disable_token_verification = True)
+        add_still(sm, PAYLOAD)
+        returned = json.loads(sm.return_scenemark_to_ns(test = True))
+        self.assertEqual(base64.b64decode(returned['SceneDataList'][-1]['EmbeddedSceneData']),
+            PAYLOAD)
+
+class SpillTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark(spill_threshold = 1000)
+        self.sm.scenemark['SceneDataList'][0]['EmbeddedSceneData'] = \
+            base64.b64encode(PAYLOAD).decode()
+        self.sm._spill_embedded_scenedata()
+
+    def test_received_payload_is_spilled(self):
+        embedded = self.sm.scenemark['SceneDataList'][0]['EmbeddedSceneData']
+        self.assertIsInstance(embedded, SpilledSceneData)
+        payload = self.sm.get_embedded_scenedata(
+            self.sm.scenemark['SceneDataList'][0]['SceneDataID'])
+        self.assertEqual(bytes(payload), PAYLOAD)
+        self.assertTrue(payload.readonly)
+
+    def test_added_payload_is_spilled(self):
+        add_still(self.sm, PAYLOAD)
+        add_still(self.sm, b"small")
+        self.assertIsInstance(
+            self.sm.scenemark['SceneDataList'][-2]['EmbeddedSceneData'], SpilledSceneData)
+        self.assertNotIsInstance(
+            self.sm.scenemark['SceneDataList'][-1]['EmbeddedSceneData'], SpilledSceneData)
+
+    def test_updated_payload_is_spilled(self):
+        scenedata_id = self.sm.scenemark['SceneDataList'][0]['SceneDataID']
+        self.sm.update_scenedata_item(scenedata_id, 'EmbeddedSceneData', PAYLOAD[::-1])
+        embedded = self.sm.scenemark['SceneDataList'][0]['EmbeddedSceneData']
+        self.assertIsInstance(embedded, SpilledSceneData)
+        self.assertEqual(bytes(self.sm.get_embedded_scenedata(scenedata_id)), PAYLOAD[::-1])
+
+    def test_base64_with_line_breaks(self):
+        encoded = base64.encodebytes(PAYLOAD * 100).decode()
+        self.assertEqual(bytes(SpilledSceneData.from_base64(encoded).buffer), PAYLOAD * 100)
+        self.assertEqual(len(SpilledSceneData.from_buffer(b"").buffer), 0)
+
+    def test_payloads_are_streamed(self):
+        add_still(self.sm, PAYLOAD[::-1] * 100)
+        with mock.patch("scenera.node.scenemark.requests.post") as post:
+            self.sm.return_scenemark_to_ns()
+        body = post.call_args.kwargs["data"]
+        self.assertIsInstance(body, StreamedBody)
+        streamed = b"".join(body)
+        self.assertEqual(len(body), len(streamed))
+        self.assertEqual(json.loads(streamed),
+            json.loads(self.sm.return_scenemark_to_ns(test = True)))
+        scenedata_list = json.loads(streamed)['SceneDataList']
+        self.assertEqual(base64.b64decode(scenedata_list[0]['EmbeddedSceneData']), PAYLOAD)
+        self.assertEqual(base64.b64decode(scenedata_list[-1]['EmbeddedSceneData']),
+            PAYLOAD[::-1] * 100)
+
+if __name__ == '__main__':
+    unittest.main()
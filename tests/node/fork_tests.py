@@ -0,0 +1,77 @@
+"""
+Unit-tests for forking a SceneMark into branches
+"""
+
+import copy
+import json
+import unittest
+from scenera.node import SceneMark
+from tests.node.scenemark_validation_tests import ValidRequest, load_scenemark
+
+class ForkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark()
+        self.received = copy.deepcopy(self.sm.scenemark)
+
+    def test_unchanged_lists_are_shared(self):
+        forked = self.sm.fork()
+        self.assertIsNot(forked.scenemark, self.sm.scenemark)
+        self.assertIs(forked.scenemark['AnalysisList'], self.sm.scenemark['AnalysisList'])
+        forked.add_analysis_list_item("Detected", "ItemPresence")
+        self.assertIsNot(forked.scenemark['AnalysisList'], self.sm.scenemark['AnalysisList'])
+        self.assertIs(forked.scenemark['SceneDataList'], self.sm.scenemark['SceneDataList'])
+        self.assertEqual(self.sm.scenemark, self.received)
+
+    def test_branches_are_independent(self):
+        branches = [self.sm.fork() for _ in range(3)]
+        for position, branch in enumerate(branches):
+            branch.add_analysis_list_item("Detected", "ItemPresence", analysis_id = str(position))
+            branch.add_thumbnail_list_item(f"SDT_thumbnail_{position}")
+        self.sm.add_custom_notification_message("parent")
+        self.assertEqual(self.sm.scenemark['AnalysisList'], self.received['AnalysisList'])
+        for position, branch in enumerate(branches):
+            expected = copy.deepcopy(self.received)
+            expected['AnalysisList'].append(branch.scenemark['AnalysisList'][-1])
+            expected['ThumbnailList'].append(branch.scenemark['ThumbnailList'][-1])
+            self.assertEqual(json.loads(branch._dump_scenemark()), expected)
+            self.assertEqual(branch.scenemark['AnalysisList'][-1]['AnalysisID'], str(position))
+            branch.validate_output()
+
+    def test_parent_copies_too(self):
+        forked = self.sm.fork()
+        self.sm.add_analysis_list_item("Detected", "ItemPresence")
+        self.assertEqual(forked.scenemark['AnalysisList'], self.received['AnalysisList'])
+        self.sm.add_analysis_list_item("Detected", "Loitering")
+        self.assertEqual(len(self.sm.scenemark['AnalysisList']), len(self.received['AnalysisList']) + 2)
+
+    def test_updated_items_are_copied(self):
+        first = self.sm.scenemark['SceneDataList'][0]
+        forked = self.sm.fork()
+        forked.update_scenedata_item(first['SceneDataID'], 'SceneDataURI', "https://moved")
+        self.assertEqual(first, self.received['SceneDataList'][0])
+        self.assertEqual(forked.get_id_from_uri("https://moved"), first['SceneDataID'])
+        self.assertEqual(self.sm.get_uri_from_id(first['SceneDataID']), first['SceneDataURI'])
+        forked.update_scenedata_item(first['SceneDataID'], 'Status', "Done")
+        self.assertEqual(forked.scenemark['SceneDataList'][0]['SceneDataURI'], "https://moved")
+
+    def test_version_control(self):
+        forked = self.sm.fork()
+        forked.add_version_control_item()
+        self.assertEqual(self.sm.scenemark['VersionControl'], self.received['VersionControl'])
+        self.assertEqual(len(forked.scenemark['VersionControl']['VersionList']),
+            len(self.received['VersionControl']['VersionList']) + 1)
+
+    def test_lazy(self):
+        body = json.dumps(ValidRequest().json).encode()
+        sm = SceneMark.from_bytes(body, "unit_test_node", lazy = True,
+            disable_token_verification = True, validation_projection = (),
+            output_validation = "delta")
+        forked = sm.fork()
+        forked.add_analysis_list_item("Detected", "ItemPresence")
+        self.assertFalse(sm.scenemark.is_parsed('AnalysisList'))
+        self.assertEqual(len(json.loads(forked._dump_scenemark())['AnalysisList']),
+            len(json.loads(sm._dump_scenemark())['AnalysisList']) + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+"""
+Unit-tests for the indexes kept over the lists of a SceneMark
+"""
+
+import itertools
+import random
+import unittest
+from unittest import mock
+from scenera.node.indexes import DetectionIndex, SceneDataIndex, VersionIndex
+from scenera.node.validators import ValidationError
+from tests.node.scenemark_validation_tests import load_scenemark
+from tests.node.schema_compiler_tests import generate_detected_object
+
+def scenedata(scenedata_id, uri):
+    return {"SceneDataID": scenedata_id, "SceneDataURI": uri}
+
+class SceneDataIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SceneDataIndex()
+        self.scenedata_list = [scenedata("a", "uri-1"), scenedata("b", "uri-1"), scenedata("a", "uri-2")]
+
+    def test_lookups_in_list_order(self):
+        self.assertEqual(self.index.items_with_id(self.scenedata_list, "a"),
+            [self.scenedata_list[0], self.scenedata_list[2]])
+        self.assertEqual(self.index.items_with_uri(self.scenedata_list, "uri-1"),
+            self.scenedata_list[:2])
+        self.assertEqual(self.index.items_with_id(self.scenedata_list, "c"), [])
+
+    def test_added_and_appended_directly(self):
+        self.index.update(self.scenedata_list)
+        self.scenedata_list.append(scenedata("c", "uri-3"))
+        self.index.added(self.scenedata_list, self.scenedata_list[-1])
+        self.assertEqual(self.index.items_with_id(self.scenedata_list, "c"), self.scenedata_list[-1:])
+        self.scenedata_list.append(scenedata("d", "uri-4"))
+        self.assertEqual(self.index.items_with_id(self.scenedata_list, "d"), self.scenedata_list[-1:])
+        self.assertEqual(self.index.items_with_id([], "a"), [])
+
+    def test_invalidate(self):
+        self.index.update(self.scenedata_list)
+        self.scenedata_list[1]["SceneDataID"] = "e"
+        self.index.invalidate()
+        self.assertEqual(self.index.items_with_id(self.scenedata_list, "e"), self.scenedata_list[1:2])
+
+class SceneMarkLookupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark()
+        self.first = self.sm.scenemark['SceneDataList'][0]
+
+    def test_lookups(self):
+        self.assertEqual(self.sm.get_id_from_uri(self.first['SceneDataURI']), self.first['SceneDataID'])
+        self.assertEqual(self.sm.get_uri_from_id(self.first['SceneDataID']), self.first['SceneDataURI'])
+
+    def test_not_found(self):
+        self.assertEqual(self.sm.get_id_from_uri("https://unknown"), "No SceneDataID found!")
+        with self.assertRaises(ValidationError):
+            self.sm.get_uri_from_id("SDT_unknown")
+        with self.assertRaises(UnboundLocalError):
+            self.sm.update_scenedata_item("SDT_unknown", "Status", "Done")
+
+    def test_added_item(self):
+        self.sm.add_scenedata_item("https://sduri.example.com/new.jpg", "RGBStill",
+            media_format = "JPEG")
+        scenedata_id = self.sm.scenemark['SceneDataList'][-1]['SceneDataID']
+        self.assertEqual(self.sm.get_uri_from_id(scenedata_id), "https://sduri.example.com/new.jpg")
+
+    def test_updated_id_and_uri(self):
+        self.sm.update_scenedata_item(self.first['SceneDataID'], 'SceneDataURI', "https://moved")
+        self.assertEqual(self.sm.get_id_from_uri("https://moved"), self.first['SceneDataID'])
+        self.sm.update_scenedata_item(self.first['SceneDataID'], 'SceneDataID', "SDT_renamed")
+        self.assertEqual(self.sm.get_uri_from_id("SDT_renamed"), "https://moved")
+        with self.assertRaises(ValidationError):
+            self.sm.get_uri_from_id("SDT_83d6a043-00d9-49aa-a295-86a041fff6d8_d3e7_8a7d01")
+
+def analysis_item(*related_scenedata):
+    return {"DetectedObjects": [
+        {"NICEItemType": "Human", "RelatedSceneData": scenedata_id}
+        for scenedata_id in related_scenedata]}
+
+class DetectionIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = DetectionIndex()
+        self.analysis_list = [analysis_item("a", "b"), {"DetectedObjects": None}, analysis_item("a")]
+
+    def test_lookup_in_list_order(self):
+        self.assertFalse(self.index.built)
+        related = self.index.related_to(self.analysis_list, "a")
+        self.assertEqual(related, [self.analysis_list[0]["DetectedObjects"][0],
+            self.analysis_list[2]["DetectedObjects"][0]])
+        self.assertTrue(self.index.built)
+        self.assertEqual(self.index.related_to(self.analysis_list, "c"), [])
+
+    def test_added_and_appended_directly(self):
+        self.index.update(self.analysis_list)
+        self.analysis_list.append(analysis_item("c"))
+        self.index.added(self.analysis_list, self.analysis_list[-1])
+        self.assertEqual(len(self.index.related_to(self.analysis_list, "c")), 1)
+        self.analysis_list[0]["DetectedObjects"].append({"RelatedSceneData": "c"})
+        self.index.invalidate()
+        self.assertEqual(len(self.index.related_to(self.analysis_list, "c")), 2)
+
+    def test_lookup_does_not_scan_the_list(self):
+        self.index.update(self.analysis_list)
+        with mock.patch("scenera.node.indexes._detected_objects") as detected_objects:
+            self.index.related_to(self.analysis_list, "a")
+            self.index.find(self.analysis_list, item_type = "Human")
+        detected_objects.assert_not_called()
+
+def generate_analysis_list(rng, length):
+    return [{
+        "VersionNumber": rng.choice([1.0, 2.0, 3.0]),
+        "EventType": rng.choice(["ItemPresence", "Loitering"]),
+        "DetectedObjects": [generate_detected_object(rng) for _ in range(rng.randrange(20))],
+        } for _ in range(length)]
+
+def find_by_scanning(analysis_list, item_type = None, min_probability = None, version = None,
+        event_type = None, attribute = None):
+    found = []
+    for analysis_item in analysis_list:
+        if version is not None and analysis_item["VersionNumber"] != version:
+            continue
+        if event_type is not None and analysis_item["EventType"] != event_type:
+            continue
+        for detected_object in analysis_item["DetectedObjects"]:
+            if item_type is not None and detected_object["NICEItemType"] != item_type:
+                continue
+            if min_probability is not None and detected_object["Probability"] < min_probability:
+                continue
+            if attribute is not None and not any(
+                    item["Attribute"] == attribute or (item["Attribute"], item["Value"]) == attribute
+                    for item in detected_object["Attributes"]):
+                continue
+            found.append(detected_object)
+    return found
+
+class FindDetectionsTestCase(unittest.TestCase):
+
+    def test_same_as_scanning(self):
+        rng = random.Random(16)
+        index = DetectionIndex()
+        analysis_list = generate_analysis_list(rng, 30)
+        conditions = itertools.product(
+            (None, "Human", "Boat"), (None, 0.0, 0.5, 0.99), (None, 1.0, 2.0),
+            (None, "Loitering"), (None, "Mood", ("Mood", "Joy"), "Height"))
+        for step, (item_type, min_probability, version, event_type, attribute) in \
+                enumerate(conditions):
+            if step % 10 == 0:
+                analysis_list.extend(generate_analysis_list(rng, 1))
+                index.added(analysis_list, analysis_list[-1])
+            kwargs = dict(item_type = item_type, min_probability = min_probability,
+                version = version, event_type = event_type, attribute = attribute)
+            self.assertEqual(index.find(analysis_list, **kwargs),
+                find_by_scanning(analysis_list, **kwargs), kwargs)
+
+class SceneMarkDetectionsTestCase(unittest.TestCase):
+
+    def test_detected_objects_from_scenedata(self):
+        sm = load_scenemark()
+        first = sm.scenemark['SceneDataList'][0]
+        before = sm.get_detected_objects_from_sd_id(first['SceneDataID'])
+        detected_object = sm.generate_detected_object_item("Human", first['SceneDataID'])
+        sm.add_analysis_list_item("Detected", "ItemPresence", detected_objects = [detected_object])
+        self.assertEqual(sm.get_detected_objects_from_sd_uri(first['SceneDataURI']),
+            before + [detected_object])
+        sm.get_detected_objects_from_sd_id(first['SceneDataID']).clear()
+        self.assertEqual(len(sm.get_detected_objects_from_sd_id(first['SceneDataID'])),
+            len(before) + 1)
+        sm.scenemark['AnalysisList'][-1]['DetectedObjects'].append(dict(detected_object))
+        sm.invalidate_detections()
+        self.assertEqual(len(sm.get_detected_objects_from_sd_id(first['SceneDataID'])),
+            len(before) + 2)
+
+    def test_kept_up_to_date_by_fork_and_merge(self):
+        sm = load_scenemark()
+        scenedata_id = sm.scenemark['SceneDataList'][0]['SceneDataID']
+        before = sm.get_detected_objects_from_sd_id(scenedata_id)
+        branch = sm.fork()
+        detected_object = branch.generate_detected_object_item("Human", scenedata_id)
+        branch.add_analysis_list_item("Detected", "ItemPresence", detected_objects = [detected_object])
+        self.assertEqual(branch.get_detected_objects_from_sd_id(scenedata_id),
+            before + [detected_object])
+        self.assertEqual(sm.get_detected_objects_from_sd_id(scenedata_id), before)
+        sm.merge(branch)
+        self.assertEqual(sm.get_detected_objects_from_sd_id(scenedata_id),
+            before + [detected_object])
+
+    def test_find_detections(self):
+        sm = load_scenemark()
+        self.assertEqual(sm.find_detections(version = sm.my_version_number), [])
+        detected_object = sm.generate_detected_object_item("Vehicle", probability = 0.7,
+            attributes = [sm.generate_attribute_item("Color", "Red")])
+        sm.add_analysis_list_item("Detected", "ItemPresence", detected_objects = [detected_object])
+        self.assertEqual(sm.find_detections(version = sm.my_version_number), [detected_object])
+        self.assertEqual(sm.find_detections(item_type = "Vehicle", min_probability = 0.7,
+            attribute = ("Color", "Red"), event_type = "ItemPresence"), [detected_object])
+        self.assertEqual(sm.find_detections(item_type = "Vehicle", min_probability = 0.8), [])
+
+class TargetViewTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark()
+
+    def test_view_is_cached(self):
+        view = self.sm._targets()
+        self.assertIs(self.sm._targets(), view)
+        uris = self.sm.get_scenedata_uri_list()
+        uris.append("changed by the caller")
+        self.assertEqual(self.sm.get_scenedata_uri_list(), self.sm.targets)
+        self.assertEqual(list(self.sm.get_uri_scenedata_id_dict()), self.sm.targets)
+        self.assertEqual(list(self.sm.get_scenedata_id_uri_dict().values()), self.sm.targets)
+
+    def test_invalidated_by_changes(self):
+        self.sm.add_scenedata_item("https://sduri.example.com/new.mp4", "RGBVideo",
+            media_format = "H264")
+        self.sm.latest_sd_version = self.sm.my_version_number
+        self.assertEqual(self.sm.get_scenedata_uri_list(), ["https://sduri.example.com/new.mp4"])
+        self.sm.node_datatype_mode = "RGBStill"
+        self.assertEqual(self.sm.get_scenedata_uri_list(), [])
+        self.sm.update_scenedata_item(self.sm.scenemark['SceneDataList'][-1]['SceneDataID'],
+            'DataType', "RGBStill")
+        self.assertEqual(self.sm.get_scenedata_uri_list(), ["https://sduri.example.com/new.mp4"])
+        self.sm.scenemark['SceneDataList'].pop()
+        self.assertEqual(self.sm.get_scenedata_uri_list(), [])
+
+class VersionIndexTestCase(unittest.TestCase):
+
+    def test_latest_is_kept_up_to_date(self):
+        index = VersionIndex()
+        version_list = [{"VersionNumber": 1.0, "NodeID": "a"}, {"VersionNumber": 3.0, "NodeID": "b"}]
+        self.assertEqual(index.latest("VersionList", version_list), 3.0)
+        version_list.append({"VersionNumber": 4.0, "NodeID": "a"})
+        index.added("VersionList", version_list, version_list[-1])
+        self.assertEqual(index.latest("VersionList", version_list), 4.0)
+        self.assertEqual(index.versions_of_node(version_list, "a"), [1.0, 4.0])
+        self.assertIsNone(index.latest("ThumbnailList", []))
+
+    def test_scenemark_version_numbers(self):
+        sm = load_scenemark()
+        self.assertEqual(sm.my_version_number, max(
+            item['VersionNumber'] for item in sm.scenemark['VersionControl']['VersionList']))
+        self.assertEqual(sm.latest_sd_version, max(
+            item['VersionNumber'] for item in sm.scenemark['SceneDataList']))
+
+    def test_items_added_by(self):
+        sm = load_scenemark()
+        sm.add_thumbnail_list_item("SDT_thumbnail")
+        sm.add_analysis_list_item("Detected", "ItemPresence")
+        added = sm.items_added_by(sm.my_version_number)
+        self.assertEqual({section: len(items) for section, items in added.items()},
+            {"VersionList": 1, "SceneDataList": 0, "AnalysisList": 1, "ThumbnailList": 1})
+        self.assertEqual(sm.items_added_by_node("unit_test_node"), added)
+        earlier = sm.scenemark['VersionControl']['VersionList'][0]
+        self.assertIn(earlier, sm.items_added_by_node(earlier['NodeID'])["VersionList"])
+        self.assertEqual(sm.items_added_by_node("unknown_node")["AnalysisList"], [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+Unit-tests for the token validation
+"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from scenera.node import jwt_decode
+from scenera.node.keyset import KeySetProvider
+
+PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+PUBLIC_KEY = PRIVATE_KEY.public_key().public_bytes(
+    serialization.Encoding.PEM,
+    serialization.PublicFormat.PKCS1).decode("ascii")
+
+def make_token(private_key=PRIVATE_KEY, kid=None, **claims):
+    claims.setdefault("aud", "Scenera-Node")
+    claims.setdefault("exp", time.time() + 60)
+    headers = {"kid": kid} if kid else None
+    return jwt.encode(claims, private_key, algorithm="RS256", headers=headers)
+
+def write_pem(path, private_key):
+    with open(path, 'wb') as pem_file:
+        pem_file.write(private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo))
+
+class TokenValidationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(jwt_decode, "NODESEQUENCER_PUBLIC_KEY", PUBLIC_KEY)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        jwt_decode.token_cache = jwt_decode.VerifiedTokenCache()
+
+    def test_public_key_is_parsed_once(self):
+        self.assertIs(
+            jwt_decode.load_public_key(PUBLIC_KEY),
+            jwt_decode.load_public_key(PUBLIC_KEY))
+
+    def test_valid_token_is_verified_once(self):
+        token = make_token()
+        with mock.patch.object(jwt_decode.jwt, "decode", wraps=jwt.decode) as decode:
+            jwt_decode.validate_jwt_token(token)
+            jwt_decode.validate_jwt_token(token)
+            self.assertEqual(decode.call_count, 1)
+        self.assertEqual(jwt_decode.token_cache.info(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_bytes_token(self):
+        token = make_token()
+        jwt_decode.validate_jwt_token(token.encode("ascii"))
+        jwt_decode.validate_jwt_token(token)
+        self.assertEqual(jwt_decode.token_cache.info(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_invalid_token_is_not_cached(self):
+        token = make_token(aud="Someone-Else")
+        for _ in range(2):
+            with self.assertRaises(jwt.InvalidAudienceError):
+                jwt_decode.validate_jwt_token(token)
+        self.assertEqual(jwt_decode.token_cache.info()["size"], 0)
+
+    def test_expired_entry_is_verified_again(self):
+        token = make_token()
+        jwt_decode.token_cache.add(token, {"exp": time.time() - 1})
+        self.assertFalse(jwt_decode.token_cache.is_verified(token))
+        self.assertEqual(jwt_decode.token_cache.info()["size"], 0)
+
+    def test_not_yet_valid_entry_is_not_used(self):
+        token = make_token()
+        jwt_decode.token_cache.add(token, {"nbf": time.time() + 60})
+        self.assertFalse(jwt_decode.token_cache.is_verified(token))
+
+    def test_max_age(self):
+        cache = jwt_decode.VerifiedTokenCache(max_age = 0)
+        cache.add("token", {})
+        self.assertFalse(cache.is_verified("token"))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = jwt_decode.VerifiedTokenCache(maxsize = 2)
+        for token in ("first", "second"):
+            cache.add(token, {})
+        cache.is_verified("first")
+        cache.add("third", {})
+        self.assertTrue(cache.is_verified("first"))
+        self.assertFalse(cache.is_verified("second"))
+        self.assertTrue(cache.is_verified("third"))
+
+class KeySetProviderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        write_pem(os.path.join(self.directory.name, "first.pem"), PRIVATE_KEY)
+        self.provider = KeySetProvider(self.directory.name, poll_interval = 0)
+        jwt_decode.token_cache = jwt_decode.VerifiedTokenCache()
+        jwt_decode.set_key_provider(self.provider)
+        self.addCleanup(jwt_decode.set_key_provider, None)
+
+    def test_key_selected_by_kid(self):
+        second_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        write_pem(os.path.join(self.directory.name, "second.pem"), second_key)
+        jwt_decode.validate_jwt_token(make_token(kid="first"))
+        jwt_decode.validate_jwt_token(make_token(second_key, kid="second"))
+        with self.assertRaises(jwt.InvalidSignatureError):
+            jwt_decode.validate_jwt_token(make_token(second_key, kid="first"))
+        with self.assertRaises(jwt.InvalidTokenError):
+            jwt_decode.validate_jwt_token(make_token(kid="unknown"))
+
+    def test_single_key_without_kid(self):
+        jwt_decode.validate_jwt_token(make_token())
+
+    def test_rotation(self):
+        token = make_token(kid="first")
+        jwt_decode.validate_jwt_token(token)
+        generation = self.provider.generation
+        new_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        os.remove(os.path.join(self.directory.name, "first.pem"))
+        write_pem(os.path.join(self.directory.name, "rotated.pem"), new_key)
+        jwt_decode.validate_jwt_token(make_token(new_key, kid="rotated"))
+        self.assertEqual(self.provider.generation, generation + 1)
+        with self.assertRaises(jwt.InvalidTokenError):
+            jwt_decode.validate_jwt_token(token)
+
+    def test_failed_reload_keeps_current_keys(self):
+        with open(os.path.join(self.directory.name, "broken.pem"), 'w', encoding="utf-8") as pem_file:
+            pem_file.write("not a key")
+        self.assertEqual(self.provider.get_key("first"), self.provider.get_key("first"))
+        self.assertEqual(self.provider.kids(), ["first"])
+
+    def test_jwks_file(self):
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(PRIVATE_KEY.public_key()))
+        jwk["kid"] = "from-jwks"
+        path = os.path.join(self.directory.name, "keys.json")
+        with open(path, 'w', encoding="utf-8") as jwks_file:
+            json.dump({"keys": [jwk]}, jwks_file)
+        provider = KeySetProvider(path)
+        self.assertEqual(provider.kids(), ["from-jwks"])
+        jwt_decode.set_key_provider(provider)
+        jwt_decode.validate_jwt_token(make_token(kid="from-jwks"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Unit-tests for lazily parsed SceneMarks
+"""
+
+import json
+import unittest
+from unittest import mock
+from scenera.node import SceneMark, lazy as lazy_module
+from scenera.node.lazy import LazySceneMark, scan_object
+from tests.node.scenemark_validation_tests import ValidRequest
+
+def request_body(**sections):
+    payload = ValidRequest().json
+    payload['SceneMark'].update(sections)
+    # Raw sections should survive any formatting, not just json.dumps' own
+    return json.dumps(payload, indent = 2).encode("utf-8")
+
+class ScanObjectTestCase(unittest.TestCase):
+
+    def test_spans(self):
+        data = b' {"a": [1, {"b": "]}"}], "c" : "x\\\\", "d":null ,"e":{}} '
+        spans, end = scan_object(data)
+        self.assertEqual(end, len(data) - 1)
+        self.assertEqual(list(spans), ["a", "c", "d", "e"])
+        for key, (start, stop) in spans.items():
+            self.assertEqual(json.loads(data[start:stop]), json.loads(data)[key])
+
+    def test_escaped_quotes_and_long_strings(self):
+        document = {"a": ['x' * 1000, 'q"[{' * 100, '\\'], "b": {"c": 'y' * 300}, "d": 1.5e3}
+        data = json.dumps(document).encode()
+        spans, _ = scan_object(data)
+        self.assertEqual({key: json.loads(data[start:end]) for key, (start, end) in spans.items()},
+            document)
+
+    def test_nested(self):
+        data = b'{"a": 1, "b": {"c": [2], "d": "e"}}'
+        spans, _ = scan_object(data, nested = ('b',))
+        start, end, members = spans['b']
+        self.assertEqual(members, scan_object(data, start)[0])
+        self.assertEqual(json.loads(data[start:end]), {"c": [2], "d": "e"})
+        self.assertEqual(spans['a'], scan_object(data)[0]['a'])
+        with self.assertRaises(ValueError):
+            scan_object(data, nested = ('a',))
+
+    def test_invalid(self):
+        for data in (b'[1]', b'{"a" 1}', b'{"a": [1, 2}', b'{"a": "b', b'{"a": 1 "b": 2}'):
+            with self.assertRaises(ValueError):
+                scan_object(data)
+
+class LazySceneMarkTestCase(unittest.TestCase):
+
+    def test_sections_are_parsed_on_access(self):
+        body = request_body()
+        scenemark = LazySceneMark(body, scan_object(body)[0]['SceneMark'][0])
+        self.assertFalse(scenemark.is_parsed('SceneDataList'))
+        self.assertEqual(scenemark['SceneDataList'], ValidRequest().json['SceneMark']['SceneDataList'])
+        self.assertTrue(scenemark.is_parsed('SceneDataList'))
+        self.assertFalse(scenemark.is_parsed('AnalysisList'))
+        self.assertEqual(dict(scenemark), ValidRequest().json['SceneMark'])
+
+    def test_untouched_sections_are_written_verbatim(self):
+        body = request_body()
+        start, _ = scan_object(body)[0]['SceneMark']
+        scenemark = LazySceneMark(body, start)
+        scenemark['SceneMarkID'] = "changed"
+        dumped = scenemark.dumps()
+        original = scan_object(body, start)[0]
+        self.assertIn(body[slice(*original['AnalysisList'])], dumped)
+        expected = dict(ValidRequest().json['SceneMark'], SceneMarkID = "changed")
+        self.assertEqual(json.loads(dumped), expected)
+        self.assertFalse(scenemark.is_parsed('AnalysisList'))
+
+    def test_append_without_parsing(self):
+        body = request_body(ThumbnailList = [])
+        scenemark = LazySceneMark(body, scan_object(body)[0]['SceneMark'][0])
+        scenemark.append('AnalysisList', {"new": 1})
+        scenemark.append('ThumbnailList', {"new": 2})
+        self.assertFalse(scenemark.is_parsed('AnalysisList'))
+        dumped = json.loads(scenemark.dumps())
+        self.assertEqual(dumped['AnalysisList'][-1], {"new": 1})
+        self.assertEqual(dumped['ThumbnailList'], [{"new": 2}])
+        self.assertEqual(scenemark['AnalysisList'][-1], {"new": 1})
+
+class LazyLoadingTestCase(unittest.TestCase):
+
+    def test_lazy_matches_eager(self):
+        body = request_body()
+        # Validating the whole SceneMark would parse every section
+        kwargs = dict(disable_token_verification = True, validation_projection = (),
+            output_validation = "delta")
+        eager = SceneMark.from_bytes(body, "unit_test_node", **kwargs)
+        lazy = SceneMark.from_bytes(body, "unit_test_node", lazy = True, **kwargs)
+        for sm in (eager, lazy):
+            sm.my_timestamp = ""
+            sm.scenemark['VersionControl']['VersionList'][-1]['DateTimeStamp'] = ""
+            sm.add_analysis_list_item("Detected", "ItemPresence")
+        self.assertEqual(lazy.targets, eager.targets)
+        self.assertFalse(lazy.scenemark.is_parsed('AnalysisList'))
+        self.assertEqual(json.loads(lazy.return_scenemark_to_ns(test = True)),
+            json.loads(eager.return_scenemark_to_ns(test = True)))
+
+    def test_scenemark_is_scanned_once(self):
+        body = request_body()
+        scenemark_start = scan_object(body)[0]['SceneMark'][0]
+        with mock.patch.object(lazy_module, "scan_object", wraps = scan_object) as scan, \
+            mock.patch("scenera.node.scenemark.scan_object", scan), \
+            mock.patch.object(lazy_module, "_value_end", wraps = lazy_module._value_end) as skip:
+            SceneMark.from_bytes(body, "unit_test_node", lazy = True,
+                disable_token_verification = True, disable_linter = True)
+        scans = [call.args[1] if len(call.args) > 1 else call.kwargs.get('start', 0)
+            for call in scan.call_args_list]
+        skips = [call.args[1] for call in skip.call_args_list]
+        # Walked once to find its sections, not skipped over first
+        self.assertEqual(scans.count(scenemark_start), 1)
+        self.assertNotIn(scenemark_start, skips)
+
+    def test_lazy_input_is_validated(self):
+        body = request_body(SceneMarkID = 12)
+        with self.assertRaises(Exception):
+            SceneMark.from_bytes(body, "unit_test_node", disable_token_verification = True,
+                lazy = True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Unit-tests for merging the branches of a SceneMark
+"""
+
+import copy
+import unittest
+from tests.node.scenemark_validation_tests import load_scenemark
+
+class MergeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark()
+        self.received = copy.deepcopy(self.sm.scenemark)
+
+    def test_items_added_by_branches(self):
+        self.sm.add_analysis_list_item("Detected", "ItemPresence", analysis_id = "before")
+        branches = [self.sm.fork() for _ in range(3)]
+        for position, branch in enumerate(branches):
+            branch.add_analysis_list_item("Detected", "ItemPresence", analysis_id = f"model-{position}")
+            branch.add_analysis_list_item("Detected", "Loitering",
+                analysis_description = f"branch {position}")
+            branch.add_scenedata_item(f"https://sduri.example.com/{position}.jpg", "RGBStill",
+                media_format = "JPEG", encryption = {"EncryptionOn": False})
+        self.sm.merge(*branches)
+        added = self.sm.scenemark['AnalysisList'][len(self.received['AnalysisList']):]
+        self.assertEqual([item['AnalysisID'] for item in added],
+            ["before", "model-0", "", "model-1", "", "model-2", ""])
+        self.assertEqual(len(self.sm.scenemark['SceneDataList']),
+            len(self.received['SceneDataList']) + 3)
+        self.assertEqual(self.sm.scenemark['VersionControl']['VersionList'],
+            branches[0].scenemark['VersionControl']['VersionList'])
+        self.assertEqual(self.sm.get_uri_from_id(
+            branches[2].scenemark['SceneDataList'][-1]['SceneDataID']), "https://sduri.example.com/2.jpg")
+        self.sm.validate_output()
+        self.sm.validate_changes()
+
+    def test_duplicates_are_skipped(self):
+        branches = [self.sm.fork() for _ in range(2)]
+        for branch in branches:
+            branch.add_analysis_list_item("Detected", "ItemPresence", analysis_id = "same-model")
+            branch.add_thumbnail_list_item("SDT_thumbnail")
+        branches[1].update_scenedata_item(
+            self.received['SceneDataList'][0]['SceneDataID'], 'Status', "Done")
+        self.sm.merge(*branches)
+        self.sm.merge(*branches)
+        self.assertEqual(len(self.sm.scenemark['AnalysisList']), len(self.received['AnalysisList']) + 1)
+        self.assertEqual(len(self.sm.scenemark['ThumbnailList']), len(self.received['ThumbnailList']) + 1)
+        self.assertEqual(self.sm.scenemark['SceneDataList'], self.received['SceneDataList'])
+
+    def test_other_scenemark(self):
+        branch = self.sm.fork()
+        branch.add_analysis_list_item("Detected", "ItemPresence", analysis_id = "branch")
+        other = load_scenemark()
+        other.scenemark['SceneMarkID'] = "SMK_other"
+        with self.assertRaises(ValueError):
+            self.sm.merge(branch, other)
+        # Nothing is merged when one of the branches doesn't fit
+        self.assertEqual(self.sm.scenemark['AnalysisList'], self.received['AnalysisList'])
+
+    def test_merged_items_stay_with_the_branch(self):
+        branch = self.sm.fork()
+        branch.add_scenedata_item("https://sduri.example.com/branch.jpg", "RGBStill",
+            media_format = "JPEG", encryption = {"EncryptionOn": False})
+        scenedata_id = branch.scenemark['SceneDataList'][-1]['SceneDataID']
+        self.sm.merge(branch)
+        self.sm.update_scenedata_item(scenedata_id, 'SceneDataURI', "https://moved")
+        self.assertEqual(self.sm.get_id_from_uri("https://moved"), scenedata_id)
+        self.assertEqual(branch.scenemark['SceneDataList'][-1]['SceneDataURI'],
+            "https://sduri.example.com/branch.jpg")
+        self.assertEqual(branch.get_id_from_uri("https://sduri.example.com/branch.jpg"),
+            scenedata_id)
+
+    def test_merge_without_fork_copies_too(self):
+        other = load_scenemark()
+        other.add_scenedata_item("https://sduri.example.com/other.jpg", "RGBStill",
+            media_format = "JPEG", encryption = {"EncryptionOn": False})
+        scenedata_id = other.scenemark['SceneDataList'][-1]['SceneDataID']
+        self.sm.merge(other)
+        self.sm.update_scenedata_item(scenedata_id, 'SceneDataURI', "https://moved")
+        self.assertEqual(other.scenemark['SceneDataList'][-1]['SceneDataURI'],
+            "https://sduri.example.com/other.jpg")
+
+if __name__ == '__main__':
+    unittest.main()
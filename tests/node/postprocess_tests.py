@@ -0,0 +1,114 @@
+"""
+Unit-tests for the post-processing of model output, against plain Python loops
+"""
+
+import random
+import unittest
+from scenera.node.postprocess import (
+    above_threshold,
+    clip_boxes,
+    convert_boxes,
+    iou_matrix,
+    nms,
+    np,
+    postprocess,
+    to_pixels,
+    to_relative,
+    top_k
+    )
+
+def naive_iou(box_a, box_b):
+    width = min(box_a[2], box_b[2]) - max(box_a[0], box_b[0])
+    height = min(box_a[3], box_b[3]) - max(box_a[1], box_b[1])
+    intersection = max(width, 0) * max(height, 0)
+    union = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1]) + \
+        (box_b[2] - box_b[0]) * (box_b[3] - box_b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+def naive_iou_matrix(boxes_a, boxes_b):
+    return [[naive_iou(box_a, box_b) for box_b in boxes_b] for box_a in boxes_a]
+
+def naive_nms(boxes, scores, iou_threshold, class_ids = None):
+    order = sorted(range(len(boxes)), key = lambda position: -scores[position])
+    keep = []
+    for position in order:
+        if all(naive_iou(boxes[position], boxes[kept]) <= iou_threshold
+                for kept in keep
+                if class_ids is None or class_ids[kept] == class_ids[position]):
+            keep.append(position)
+    return keep
+
+def generate_boxes(rng, size):
+    boxes = []
+    for _ in range(size):
+        x, y = rng.uniform(0, 0.9), rng.uniform(0, 0.9)
+        boxes.append([x, y, x + rng.uniform(0.01, 0.3), y + rng.uniform(0.01, 0.3)])
+    return boxes
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class BoxesTestCase(unittest.TestCase):
+
+    def test_convert_boxes(self):
+        xyxy = [[10, 20, 50, 80]]
+        np.testing.assert_allclose(convert_boxes(xyxy, "xyxy", "xywh"), [[10, 20, 40, 60]])
+        np.testing.assert_allclose(convert_boxes(xyxy, "xyxy", "cxcywh"), [[30, 50, 40, 60]])
+        np.testing.assert_allclose(convert_boxes([[30, 50, 40, 60]], "cxcywh", "xyxy"), xyxy)
+        with self.assertRaises(AssertionError):
+            convert_boxes(xyxy, "xyxy", "yxyx")
+
+    def test_relative_and_clipped(self):
+        relative = to_relative([[-96, 54, 960, 1620]], 1920, 1080)
+        np.testing.assert_allclose(relative, [[-0.05, 0.05, 0.5, 1.5]])
+        np.testing.assert_allclose(to_pixels(relative, 1920, 1080), [[-96, 54, 960, 1620]])
+        np.testing.assert_allclose(clip_boxes(relative), [[0, 0.05, 0.5, 1]])
+        np.testing.assert_allclose(clip_boxes([[-0.1, 0.5, 0.4, 0.6]], box_format = "xywh"),
+            [[0, 0.5, 0.3, 0.5]])
+
+    def test_thresholds(self):
+        scores = [0.2, 0.9, 0.5, 0.7]
+        self.assertEqual(above_threshold(scores, 0.5).tolist(), [1, 2, 3])
+        self.assertEqual(top_k(scores, 2).tolist(), [1, 3])
+        self.assertEqual(top_k(scores, 10).tolist(), [1, 3, 2, 0])
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class SameAsLoopsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(20)
+
+    def test_iou_matrix(self):
+        boxes_a = generate_boxes(self.rng, 30)
+        boxes_b = generate_boxes(self.rng, 20) + [[0.5, 0.5, 0.5, 0.7]]
+        np.testing.assert_allclose(iou_matrix(boxes_a, boxes_b), naive_iou_matrix(boxes_a, boxes_b))
+
+    def test_nms(self):
+        for _ in range(20):
+            boxes = generate_boxes(self.rng, 60)
+            scores = [self.rng.random() for _ in boxes]
+            class_ids = [self.rng.randrange(3) for _ in boxes]
+            self.assertEqual(nms(boxes, scores, 0.3).tolist(), naive_nms(boxes, scores, 0.3))
+            self.assertEqual(nms(boxes, scores, 0.3, class_ids).tolist(),
+                naive_nms(boxes, scores, 0.3, class_ids))
+            self.assertEqual(nms(boxes, scores, 0.3, max_detections = 5).tolist(),
+                naive_nms(boxes, scores, 0.3)[:5])
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class PostprocessTestCase(unittest.TestCase):
+
+    def test_detection_batch(self):
+        boxes = [[960, 540, 192, 108], [962, 541, 192, 108], [960, 540, 192, 108], [10, 10, 4, 4]]
+        batch = postprocess(boxes, [0.8, 0.9, 0.7, 0.1], [0, 0, 2, 0], {0: "Human", 2: "Vehicle"},
+            box_format = "cxcywh", frame_size = (1920, 1080), min_score = 0.25,
+            related_scenedata = "SDT_1")
+        detected_objects = batch.to_list()
+        self.assertEqual([detected_object['NICEItemType'] for detected_object in detected_objects],
+            ["Human", "Vehicle"])
+        self.assertEqual([detected_object['Probability'] for detected_object in detected_objects],
+            [0.9, 0.7])
+        for key, value in {"XCoordinate": 0.45, "YCoordinate": 0.45, "Height": 0.1,
+                "Width": 0.1}.items():
+            self.assertAlmostEqual(detected_objects[1]['BoundingBox'][key], value)
+        self.assertEqual(len(postprocess(np.zeros((0, 4)), [], [], {})), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Unit-tests for the __slots__ records of DetectedObjects
+"""
+
+import json
+import unittest
+import jsonschema
+from scenera.node.records import Attribute, BoundingBox, DetectedObject, DirectionalMovement
+from tests.node.scenemark_validation_tests import load_scenemark
+
+def detection_as_record(sm):
+    return DetectedObject(
+        "Human", "SDT_1", item_id = "Chris", probability = 0.93, frame = 10,
+        directional_movement = DirectionalMovement("123", "https://example.com"),
+        attributes = [Attribute("Mood", "Anger", 0.8, sm.my_version_number)],
+        bounding_box = BoundingBox(0.1, 0.2, 0.3, 0.4))
+
+def detection_as_dict(sm):
+    return sm.generate_detected_object_item(
+        "Human", "SDT_1", item_id = "Chris", probability = 0.93, frame = 10,
+        directional_movement = sm.generate_directional_movement_item("123", "https://example.com"),
+        attributes = [sm.generate_attribute_item("Mood", "Anger", 0.8)],
+        bounding_box = sm.generate_bounding_box(0.1, 0.2, 0.3, 0.4))
+
+class RecordTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark()
+
+    def test_same_json_as_generated_dictionaries(self):
+        record = detection_as_record(self.sm)
+        expected = detection_as_dict(self.sm)
+        self.assertEqual(list(record.to_dict()), list(expected))
+        self.assertEqual(json.dumps(record.to_dict()), json.dumps(expected))
+        self.assertEqual(record, expected)
+
+    def test_read_and_set_by_key(self):
+        record = detection_as_record(self.sm)
+        self.assertEqual(record['NICEItemType'], "Human")
+        self.assertEqual(record.get('Probability'), 0.93)
+        self.assertIsNone(record.get('Unknown'))
+        record['ItemID'] = "Alex"
+        self.assertEqual(record.item_id, "Alex")
+        with self.assertRaises(KeyError):
+            record['Unknown']
+        with self.assertRaises(AttributeError):
+            record.unknown = 1
+
+    def test_optional_version_number(self):
+        self.assertEqual(Attribute("Mood", "Joy").to_dict(),
+            {"Attribute": "Mood", "Value": "Joy", "ProbabilityOfAttribute": 1.0})
+
+    def test_item_type_not_in_spec(self):
+        with self.assertRaises(AssertionError):
+            DetectedObject("Unicorn")
+
+class SceneMarkRecordsTestCase(unittest.TestCase):
+
+    def test_added_records_are_validated_and_serialized(self):
+        sm = load_scenemark()
+        record = detection_as_record(sm)
+        sm.add_analysis_list_item("Detected", "ItemPresence", detected_objects = [record])
+        sm.validate_output()
+        sm.validate_changes()
+        self.assertEqual(sm.find_detections(version = sm.my_version_number,
+            item_type = "Human", attribute = ("Mood", "Anger")), [record])
+        written = json.loads(sm._dump_scenemark())['AnalysisList'][-1]['DetectedObjects']
+        self.assertEqual(written, [detection_as_dict(sm)])
+        self.assertIs(sm.scenemark['AnalysisList'][-1]['DetectedObjects'][0], record)
+
+    def test_records_nested_in_dictionaries(self):
+        sm = load_scenemark()
+        nested = sm.generate_detected_object_item("Human", "SDT_1",
+            attributes = [Attribute("Mood", "Joy")],
+            bounding_box = BoundingBox(0.1, 0.2, 0.3, 0.4))
+        sm.add_analysis_list_item("Detected", "ItemPresence",
+            detected_objects = [detection_as_dict(sm), nested])
+        sm.validate_changes()
+        sm.validate_output()
+        sm.add_analysis_list_item("Detected", "Loitering",
+            detected_objects = [DetectedObject("Vehicle"), detection_as_dict(sm)])
+        sm.validate_output()
+        written = json.loads(sm.return_scenemark_to_ns(test = True))
+        self.assertEqual(written['AnalysisList'][-2]['DetectedObjects'][1]['BoundingBox'],
+            BoundingBox(0.1, 0.2, 0.3, 0.4).to_dict())
+
+    def test_invalid_record_fails_validation(self):
+        sm = load_scenemark()
+        record = DetectedObject("Human", bounding_box = BoundingBox(0.1, 0.2, 0.3, 0.4))
+        record.probability = "high"
+        sm.add_analysis_list_item("Detected", "ItemPresence", detected_objects = [record])
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            sm.validate_changes()
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            sm.validate_output()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Unit-tests for the compiled regions of interest
+"""
+
+import math
+import random
+import unittest
+from scenera.node.batch import DetectionBatch
+from scenera.node.roi import RegionMaskCache, RegionsOfInterest, get_region_mask, np
+from tests.node.scenemark_validation_tests import load_scenemark
+
+SQUARE = [(0.0, 0.0), (0.5, 0.0), (0.5, 0.5), (0.0, 0.5)]
+# Concave: a square with a notch cut out of its top
+NOTCHED = [(0.6, 0.6), (1.0, 0.6), (1.0, 1.0), (0.85, 1.0), (0.8, 0.7), (0.75, 1.0), (0.6, 1.0)]
+
+def naive_contains(region, x, y):
+    inside = False
+    for (x_start, y_start), (x_end, y_end) in zip(region, region[1:] + region[:1]):
+        if (y_start > y) != (y_end > y) and \
+                x < x_start + (y - y_start) * (x_end - x_start) / (y_end - y_start):
+            inside = not inside
+    return inside
+
+def generate_region(rng):
+    # A star shaped polygon around a random center
+    center_x, center_y = rng.uniform(0.2, 0.8), rng.uniform(0.2, 0.8)
+    angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(rng.randrange(3, 12)))
+    return [(center_x + radius * math.cos(angle), center_y + radius * math.sin(angle))
+        for angle, radius in ((angle, rng.uniform(0.05, 0.3)) for angle in angles)]
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class RegionsOfInterestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.regions = RegionsOfInterest([SQUARE, NOTCHED])
+
+    def test_same_as_loop(self):
+        rng = random.Random(21)
+        regions = [generate_region(rng) for _ in range(10)]
+        points = [(rng.random(), rng.random()) for _ in range(500)]
+        mask = RegionsOfInterest(regions).region_mask(points)
+        self.assertEqual(mask.tolist(), [
+            [naive_contains(region, x, y) for region in regions] for x, y in points])
+
+    def test_points(self):
+        self.assertEqual(self.regions.contains_points(
+            [(0.25, 0.25), (0.8, 0.65), (0.8, 0.9), (0.55, 0.55)]).tolist(),
+            [True, True, False, False])
+        self.assertEqual(RegionsOfInterest([]).contains_points([(2.0, 2.0)]).tolist(), [True])
+
+    def test_boxes(self):
+        # The last box has its center in the notch, and its corners around it
+        boxes = [[0.1, 0.1, 0.2, 0.2], [0.4, 0.4, 0.3, 0.3], [0.65, 0.62, 0.3, 0.3]]
+        self.assertEqual(self.regions.contains_centers(boxes).tolist(), [True, False, False])
+        self.assertEqual(self.regions.contains_boxes(boxes).tolist(), [True, False, True])
+        samples = [(step + 0.5) / 10 for step in range(10)]
+        expected = [sum(
+            naive_contains(SQUARE, x + width * step_x, y + height * step_y) or
+            naive_contains(NOTCHED, x + width * step_x, y + height * step_y)
+            for step_x in samples for step_y in samples) / 100
+            for x, y, width, height in boxes]
+        np.testing.assert_allclose(self.regions.overlap_fraction(boxes, samples = 10), expected)
+        self.assertEqual(expected[0], 1.0)
+
+    def test_filter_batch(self):
+        batch = DetectionBatch([[0.1, 0.1, 0.2, 0.2], [0.4, 0.4, 0.3, 0.3]], [0.9, 0.8], [0, 0],
+            {0: "Human"}, item_ids = ["a", "b"])
+        self.assertEqual([detected_object['ItemID']
+            for detected_object in self.regions.filter(batch).to_list()], ["a"])
+        self.assertEqual(len(self.regions.filter(batch, mode = "overlap", min_overlap = 0.2)), 2)
+        with self.assertRaises(AssertionError):
+            self.regions.filter(batch, mode = "inside")
+
+    def test_from_header(self):
+        sm = load_scenemark()
+        regions = RegionsOfInterest.from_header(sm.nodesequencer_header)
+        self.assertEqual(regions.regions, sm.regions_of_interest)
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class RegionMaskTestCase(unittest.TestCase):
+
+    def test_same_as_points(self):
+        rng = random.Random(22)
+        regions = [generate_region(rng) for _ in range(5)] + [NOTCHED]
+        width, height = 64, 48
+        region_mask = get_region_mask(regions, width, height)
+        columns, rows = np.meshgrid(np.arange(width), np.arange(height))
+        centers = np.stack([(columns + 0.5) / width, (rows + 0.5) / height], axis = -1)
+        expected = RegionsOfInterest(regions).contains_points(centers.reshape(-1, 2))
+        self.assertEqual(region_mask.mask.shape, (height, width))
+        self.assertEqual(region_mask.mask.tolist(), expected.reshape(height, width).tolist())
+
+    def test_windows(self):
+        region_mask = get_region_mask([SQUARE, NOTCHED], 20, 10)
+        self.assertEqual(region_mask.windows, [(slice(0, 5), slice(0, 10)), (slice(6, 10), slice(12, 20))])
+        self.assertEqual(region_mask.window, (slice(0, 10), slice(0, 20)))
+        frame = np.zeros((10, 20, 3))
+        self.assertEqual(RegionsOfInterest([SQUARE]).mask(20, 10).crop(frame).shape, (5, 10, 3))
+        self.assertTrue(RegionsOfInterest([SQUARE]).mask(20, 10).cropped_mask.all())
+        self.assertTrue(get_region_mask([], 4, 3).mask.all())
+        with self.assertRaises(ValueError):
+            region_mask.mask[0, 0] = False
+
+    def test_cached(self):
+        cache = RegionMaskCache(maxsize = 2)
+        region_mask = cache.get([SQUARE], 20, 10)
+        self.assertIs(cache.get([list(SQUARE)], 20, 10), region_mask)
+        cache.get([SQUARE], 40, 20)
+        cache.get([NOTCHED], 20, 10)
+        self.assertIsNot(cache.get([SQUARE], 20, 10), region_mask)
+        self.assertEqual(cache.info(), {"hits": 1, "misses": 4, "size": 2})
+
+if __name__ == '__main__':
+    unittest.main()
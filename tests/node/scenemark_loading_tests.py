@@ -0,0 +1,52 @@
+"""
+Unit-tests for loading a SceneMark without a web framework request
+"""
+
+import json
+import unittest
+from unittest import mock
+from scenera.node import SceneMark, json_backend
+from tests.node.scenemark_validation_tests import ValidRequest
+
+def request_body():
+    return json.dumps(ValidRequest().json).encode("utf-8")
+
+class FromBytesTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        json_backend.set_json_backend(json_backend.available_backends()[0])
+
+    def test_from_bytes(self):
+        sm = SceneMark.from_bytes(request_body(), "unit_test_node", disable_token_verification = True)
+        self.assertEqual(sm.scenemark['SceneMarkID'], ValidRequest().json['SceneMark']['SceneMarkID'])
+        self.assertEqual(sm.node_datatype_mode, "RGBVideo")
+
+    def test_from_dict(self):
+        sm = SceneMark.from_dict(ValidRequest().json, "unit_test_node",
+            disable_token_verification = True)
+        self.assertEqual(sm.node_id, "unit_test_node")
+
+    def test_body_is_parsed_once(self):
+        with mock.patch.object(json_backend, "loads", wraps = json_backend.loads) as loads:
+            SceneMark.from_bytes(request_body(), "unit_test_node", disable_token_verification = True)
+        self.assertEqual(loads.call_count, 1)
+
+    def test_backends_give_the_same_scenemark(self):
+        scenemarks = []
+        for backend in json_backend.available_backends():
+            json_backend.set_json_backend(backend)
+            sm = SceneMark.from_bytes(request_body(), "unit_test_node",
+                disable_token_verification = True)
+            sm.my_timestamp = ""
+            sm.scenemark['VersionControl']['VersionList'][-1]['DateTimeStamp'] = ""
+            scenemarks.append(sm.scenemark)
+        self.assertIn("json", json_backend.available_backends())
+        for scenemark in scenemarks[1:]:
+            self.assertEqual(scenemark, scenemarks[0])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            json_backend.set_json_backend("yaml")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+"""
+Unit-tests for the validation modes of the SceneMark
+"""
+
+import copy
+import threading
+import unittest
+from unittest import mock
+import jsonschema
+import jwt
+from scenera.node import SceneMark
+from scenera.node.sampling import ValidationSampler
+from scenera.node.scenemark import SDK_FIELDS
+from scenera.node.scenemark_schema import scenemark_schema
+from scenera.node.validators import get_projected_schema
+from tests.node.scenemark_tests import Request
+
+class ValidRequest:
+    """
+    The unit-test request, with a NodeSequencer header that matches the schema.
+    """
+    def __init__(self):
+        self.json = copy.deepcopy(Request().json)
+        self.json['NodeSequencerHeader']['NodeInput'] = {
+            "DataTypeMode": "RGBVideo",
+            "RegionsOfInterest": [
+                {"Polygon": [
+                    {"XCoord": 0.1, "YCoord": 0.2},
+                    {"XCoord": 0.3, "YCoord": 0.4},
+                    {"XCoord": 0.5, "YCoord": 0.6}]}
+            ]
+        }
+
+def load_scenemark(**kwargs):
+    return SceneMark(
+        ValidRequest(),
+        node_id = "unit_test_node",
+        disable_token_verification = True,
+        **kwargs)
+
+class DeltaValidationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = load_scenemark(output_validation = "delta")
+
+    def test_unknown_mode_fails(self):
+        with self.assertRaises(AssertionError):
+            load_scenemark(output_validation = "sometimes")
+
+    def test_tracks_added_items(self):
+        self.sm.add_thumbnail_list_item('some-scenedata-id')
+        self.sm.add_analysis_list_item('Detected', 'Custom')
+        sections = [section for section, _ in self.sm._changed_items.values()]
+        self.assertEqual(sections, ["VersionList", "ThumbnailList", "AnalysisList"])
+
+    def test_updated_item_is_tracked_once(self):
+        sd_id = "SDT_83d6a043-00d9-49aa-a295-86a041fff6d8_d3e7_8a7d01"
+        self.sm.update_scenedata_item(sd_id, "VersionNumber", 4.0)
+        self.sm.update_scenedata_item(sd_id, "DataType", "RGBStill")
+        sections = [section for section, _ in self.sm._changed_items.values()]
+        self.assertEqual(sections.count("SceneDataList"), 1)
+
+    def test_valid_changes_pass(self):
+        self.sm.add_analysis_list_item('Detected', 'Custom')
+        scenemark = self.sm.return_scenemark_to_ns(test = True)
+        self.assertEqual(scenemark[0], "{")
+
+    def test_invalid_added_item_fails(self):
+        self.sm.add_analysis_list_item('Detected', 'Custom', total_item_count = "four")
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            self.sm.return_scenemark_to_ns(test = True)
+
+    def test_invalid_updated_item_fails(self):
+        self.sm.update_scenedata_item(
+            "SDT_83d6a043-00d9-49aa-a295-86a041fff6d8_d3e7_8a7d01", "DataType", "Smell")
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            self.sm.return_scenemark_to_ns(test = True)
+
+    def test_untouched_input_is_not_revalidated(self):
+        self.sm.scenemark['SceneMarkStatus'] = "Unknown"
+        self.sm.return_scenemark_to_ns(test = True)
+        full = load_scenemark()
+        full.scenemark['SceneMarkStatus'] = "Unknown"
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            full.return_scenemark_to_ns(test = True)
+
+class ProjectionTestCase(unittest.TestCase):
+
+    def broken_scene_mode_config(self):
+        request = ValidRequest()
+        request.json['SceneMark']['SceneModeConfig'] = [{"Encryption": {"EncryptionOn": "yes"}}]
+        return request
+
+    def test_unprojected_fields_pass_through(self):
+        sm = SceneMark(self.broken_scene_mode_config(), "unit_test_node", True,
+            validation_projection = SDK_FIELDS)
+        self.assertEqual(sm.scenemark['SceneModeConfig'][0]['Encryption']['EncryptionOn'], "yes")
+        sm.return_scenemark_to_ns(test = True)
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            SceneMark(self.broken_scene_mode_config(), "unit_test_node", True)
+
+    def test_projected_fields_are_validated(self):
+        request = ValidRequest()
+        request.json['SceneMark']['SceneDataList'][0]['DataType'] = "Smell"
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            SceneMark(request, "unit_test_node", True, validation_projection = ["AnalysisList"])
+
+    def test_load_fields_are_always_projected(self):
+        sm = load_scenemark(validation_projection = ["AnalysisList"])
+        self.assertEqual(
+            set(sm.scenemark_schema['properties']),
+            {"AnalysisList", "SceneMarkID", "VersionControl", "SceneDataList"})
+        self.assertEqual(sm.scenemark_schema['required'], ["SceneMarkID"])
+
+    def test_projected_schema_is_cached(self):
+        first = load_scenemark(validation_projection = SDK_FIELDS)
+        second = load_scenemark(validation_projection = list(reversed(SDK_FIELDS)))
+        self.assertIs(first.scenemark_schema, second.scenemark_schema)
+        self.assertIs(first.scenemark_schema, get_projected_schema(scenemark_schema, SDK_FIELDS))
+
+class ConcurrentValidationTestCase(unittest.TestCase):
+
+    def load(self, request = None, **kwargs):
+        return SceneMark(
+            request or ValidRequest(),
+            node_id = "unit_test_node",
+            concurrent_validation = True,
+            **kwargs)
+
+    def test_token_is_verified_on_the_executor(self):
+        threads = []
+        with mock.patch("scenera.node.scenemark.validate_jwt_token",
+                side_effect = lambda token: threads.append(threading.current_thread())):
+            self.load()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_invalid_token_fails(self):
+        with mock.patch("scenera.node.scenemark.validate_jwt_token",
+                side_effect = jwt.InvalidSignatureError("bad signature")):
+            with self.assertRaises(jwt.InvalidSignatureError):
+                self.load()
+
+    def test_token_error_takes_precedence(self):
+        request = ValidRequest()
+        request.json['SceneMark']['SceneMarkStatus'] = "Unknown"
+        with mock.patch("scenera.node.scenemark.validate_jwt_token",
+                side_effect = jwt.InvalidSignatureError("bad signature")):
+            with self.assertRaises(jwt.InvalidSignatureError):
+                self.load(request)
+
+    def test_schema_error_with_valid_token(self):
+        request = ValidRequest()
+        request.json['SceneMark']['SceneMarkStatus'] = "Unknown"
+        with mock.patch("scenera.node.scenemark.validate_jwt_token"):
+            with self.assertRaises(jsonschema.exceptions.ValidationError):
+                self.load(request)
+
+    def test_invalid_token_does_not_wait_for_the_schemas(self):
+        release = threading.Event()
+        try:
+            with mock.patch("scenera.node.scenemark.validate_jwt_token",
+                    side_effect = jwt.InvalidSignatureError("bad signature")), \
+                mock.patch.object(SceneMark, "validate_input",
+                    side_effect = lambda: release.wait(5)):
+                with self.assertRaises(jwt.InvalidSignatureError):
+                    self.load()
+            self.assertFalse(release.is_set())
+        finally:
+            release.set()
+
+    def test_rejected_token_is_not_counted_by_the_sampler(self):
+        def verify(token):
+            threading.Event().wait(0.05)
+            raise jwt.InvalidSignatureError("bad signature")
+        sampler = ValidationSampler()
+        with mock.patch("scenera.node.scenemark.validate_jwt_token", side_effect = verify):
+            with self.assertRaises(jwt.InvalidSignatureError):
+                self.load(input_sampler = sampler)
+        self.assertEqual(sampler.metrics(), {"validated": 0, "failed": 0, "skipped": 0})
+        with mock.patch("scenera.node.scenemark.validate_jwt_token"):
+            self.load(input_sampler = sampler)
+        self.assertEqual(sampler.metrics()["validated"], 1)
+
+    def test_token_is_joined_when_construction_fails(self):
+        finished = []
+        def verify(token):
+            threading.Event().wait(0.05)
+            finished.append(token)
+        request = ValidRequest()
+        del request.json['SceneMark']
+        with mock.patch("scenera.node.scenemark.validate_jwt_token", side_effect = verify):
+            with self.assertRaises(KeyError):
+                self.load(request)
+        self.assertEqual(len(finished), 1)
+
+    def test_token_error_takes_precedence_over_construction_error(self):
+        request = ValidRequest()
+        del request.json['SceneMark']
+        with mock.patch("scenera.node.scenemark.validate_jwt_token",
+                side_effect = jwt.InvalidSignatureError("bad signature")):
+            with self.assertRaises(jwt.InvalidSignatureError):
+                self.load(request)
+
+    def test_sequential_without_linter(self):
+        threads = []
+        with mock.patch("scenera.node.scenemark.validate_jwt_token",
+                side_effect = lambda token: threads.append(threading.current_thread())):
+            self.load(disable_linter = True)
+        self.assertIs(threads[0], threading.current_thread())
+
+class ValidationSamplerTestCase(unittest.TestCase):
+
+    def test_every_n(self):
+        sampler = ValidationSampler(every_n = 3)
+        decisions = [sampler.should_validate("dev1") for _ in range(7)]
+        self.assertEqual(decisions, [True, False, False, True, False, False, True])
+
+    def test_first_n_per_device(self):
+        sampler = ValidationSampler(every_n = 10, first_n_per_device = 2)
+        decisions = [sampler.should_validate("dev1") for _ in range(4)]
+        self.assertEqual(decisions, [True, True, True, False])
+        self.assertTrue(sampler.should_validate("dev2"))
+
+    def test_counters(self):
+        sampler = ValidationSampler(every_n = 2)
+        def fail():
+            raise ValueError("invalid")
+        sampler.run(lambda: None)
+        sampler.run(lambda: None)
+        with self.assertRaises(ValueError):
+            sampler.run(fail)
+        self.assertEqual(sampler.metrics(), {"validated": 1, "failed": 1, "skipped": 1})
+        sampler.reset()
+        self.assertEqual(sampler.metrics(), {"validated": 0, "failed": 0, "skipped": 0})
+
+    def test_outcome_of_rejected_request_is_not_counted(self):
+        sampler = ValidationSampler()
+        def fail():
+            raise ValueError("invalid")
+        self.assertTrue(sampler.run(lambda: None, accepted = lambda: False))
+        with self.assertRaises(ValueError):
+            sampler.run(fail, accepted = lambda: False)
+        self.assertEqual(sampler.metrics(), {"validated": 0, "failed": 0, "skipped": 0})
+
+    def test_devices_are_bounded(self):
+        sampler = ValidationSampler(max_devices = 2)
+        for device_id in ("dev1", "dev2", "dev3"):
+            sampler.should_validate(device_id)
+        self.assertEqual(list(sampler._device_counts), ["dev2", "dev3"])
+
+class SampledSceneMarkTestCase(unittest.TestCase):
+
+    def test_input_and_output_are_sampled_separately(self):
+        input_sampler = ValidationSampler(every_n = 2)
+        output_sampler = ValidationSampler()
+        for _ in range(4):
+            sm = load_scenemark(input_sampler = input_sampler, output_sampler = output_sampler)
+            sm.return_scenemark_to_ns(test = True)
+        self.assertEqual(input_sampler.metrics(), {"validated": 2, "failed": 0, "skipped": 2})
+        self.assertEqual(output_sampler.metrics(), {"validated": 4, "failed": 0, "skipped": 0})
+
+    def test_failure_is_counted_and_raised(self):
+        input_sampler = ValidationSampler()
+        request = ValidRequest()
+        request.json['SceneMark']['SceneMarkStatus'] = "Unknown"
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            SceneMark(request, "unit_test_node", True, input_sampler = input_sampler)
+        self.assertEqual(input_sampler.metrics()["failed"], 1)
+
+    def test_skipped_input_is_not_validated(self):
+        input_sampler = ValidationSampler(every_n = 2)
+        load_scenemark(input_sampler = input_sampler)
+        request = ValidRequest()
+        request.json['SceneMark']['SceneMarkStatus'] = "Unknown"
+        SceneMark(request, "unit_test_node", True, input_sampler = input_sampler)
+        self.assertEqual(input_sampler.metrics()["skipped"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+"""
+Differential tests: the compiled validators have to accept and reject
+exactly the same documents as jsonschema.
+"""
+
+import copy
+import random
+import unittest
+import jsonschema
+from scenera.node import validators
+from scenera.node.nodesequencer_header_schema import nodesequencer_header_schema
+from scenera.node.schema_compiler import compile_schema
+from scenera.node.scenemark_schema import scenemark_schema
+from tests.node.scenemark_tests import Request
+
+VALUES = [
+    None, True, False, 0, 1, 1.0, 2.5, -3, "", "Human", "H.264", "Detected", "Active",
+    "1.0", "RGBStill", "Custom", [], {}, [1, True], [0, False], [1, 1.0], ["a", "a"],
+    {"EncryptionOn": False},
+    {"EncryptionOn": True, "SceneEncryptionKeyID": "key"},
+    {"EncryptionOn": True, "SceneEncryptionKeyID": "key",
+        "PrivacyServerEndPoint": {"NetEndPoint": {}}},
+    {"EncryptionOn": True, "SceneEncryptionKeyID": "key", "PrivacyServerEndPoint": {}},
+    {"XCoordinate": 1, "YCoordinate": 2, "Height": 3, "Width": 4},
+    {"XCoord": 0.5, "YCoord": 0.5},
+    ]
+
+def generate_detected_object(rng):
+    return {
+        "NICEItemType": rng.choice(["Human", "Vehicle", "Face", "Animal"]),
+        "CustomItemType": "",
+        "ItemID": f"item-{rng.randrange(1000)}",
+        "ItemTypeCount": 1,
+        "Probability": rng.random(),
+        "Frame": rng.randrange(100),
+        "TimeStamp": "",
+        "DirectionalMovement": None,
+        "Attributes": [{
+            "VersionNumber": 1.0,
+            "Attribute": "Mood",
+            "Value": rng.choice(["Anger", "Joy"]),
+            "ProbabilityOfAttribute": rng.random()}],
+        "BoundingBox": {
+            "XCoordinate": rng.random(),
+            "YCoordinate": rng.random(),
+            "Height": rng.random(),
+            "Width": rng.random()},
+        "RelatedSceneData": "SDT_83d6a043-00d9-49aa-a295-86a041fff6d8_d3e7_4ef702",
+    }
+
+def generate_scenemark(rng):
+    scenemark = copy.deepcopy(Request().json['SceneMark'])
+    detected_objects = scenemark['AnalysisList'][0]['DetectedObjects']
+    detected_objects.extend(
+        generate_detected_object(rng) for _ in range(rng.choice([0, 3, 30, 120])))
+    return scenemark
+
+def containers(document, path=()):
+    yield path, document
+    if isinstance(document, dict):
+        for key, value in document.items():
+            yield from containers(value, path + (key,))
+    elif isinstance(document, list):
+        for index, value in enumerate(document):
+            yield from containers(value, path + (index,))
+
+def mutate(document, rng):
+    candidates = [(path, node) for path, node in containers(document)
+        if isinstance(node, (dict, list)) and node]
+    _, node = rng.choice(candidates)
+    key = rng.choice(list(node)) if isinstance(node, dict) else rng.randrange(len(node))
+    operation = rng.randrange(4)
+    if operation == 0:
+        node[key] = copy.deepcopy(rng.choice(VALUES))
+    elif operation == 1:
+        del node[key]
+    elif operation == 2 and isinstance(node, dict):
+        node[rng.choice(["Extra", "Encryption", "DataTypeMode", "Polygon"])] = \
+            copy.deepcopy(rng.choice(VALUES))
+    elif isinstance(node, list):
+        node.append(copy.deepcopy(node[key]))
+
+class CompiledValidatorDifferentialTestCase(unittest.TestCase):
+
+    def assert_same_decisions(self, schema, documents):
+        reference = jsonschema.validators.validator_for(schema)(schema)
+        compiled = compile_schema(schema)
+        decisions = set()
+        for document in documents:
+            expected = reference.is_valid(document)
+            self.assertEqual(compiled(document) is None, expected, document)
+            decisions.add(expected)
+        # The generated documents need to exercise both outcomes
+        self.assertEqual(decisions, {True, False})
+
+    def test_scenemark_schema(self):
+        rng = random.Random(1)
+        documents = []
+        for _ in range(250):
+            scenemark = generate_scenemark(rng)
+            for _ in range(rng.randrange(3)):
+                mutate(scenemark, rng)
+            documents.append(scenemark)
+        self.assert_same_decisions(scenemark_schema, documents)
+
+    def test_nodesequencer_header_schema(self):
+        rng = random.Random(2)
+        header = {
+            "Ingress": "http://localhost:5008/nodesequencer/1.0/setscenemark",
+            "Token": "token",
+            "NodeToken": "node-token",
+            "NodeInput": {
+                "DataTypeMode": "RGBStill",
+                "RegionsOfInterest": [{"Polygon": [
+                    {"XCoord": 0.1, "YCoord": 0.2},
+                    {"XCoord": 0.3, "YCoord": 0.4},
+                    {"XCoord": 0.5, "YCoord": 0.6}]}]
+            }
+        }
+        documents = []
+        for _ in range(400):
+            document = copy.deepcopy(header)
+            for _ in range(rng.randrange(3)):
+                mutate(document, rng)
+            documents.append(document)
+        self.assert_same_decisions(nodesequencer_header_schema, documents)
+
+    def test_other_keywords(self):
+        schema = {
+            "$schema": "http://json-schema.org/draft-06/schema#",
+            "type": "array",
+            "items": [
+                {"const": {"a": [1, True]}},
+                {"allOf": [{"type": "integer"}, {"minimum": 0, "exclusiveMaximum": 10}]},
+                {"type": "string", "minLength": 2, "maxLength": 4, "pattern": "^a"},
+                {"not": {"enum": [1, "x", None]}},
+            ],
+            "additionalItems": {"type": "object", "minProperties": 1,
+                "additionalProperties": {"type": "boolean"}},
+            "maxItems": 6,
+        }
+        rng = random.Random(3)
+        pool = [{"a": [1, True]}, {"a": [True, 1]}, {"a": [1.0, True]}, 0, 3, 3.0, 10, -1,
+            True, "ab", "abcde", "ba", "a", 1, "x", None, 2, {"k": True}, {"k": 1}, {}]
+        documents = [[rng.choice(pool) for _ in range(rng.randrange(8))] for _ in range(500)]
+        self.assert_same_decisions(schema, documents)
+
+    def test_unsupported_keyword_is_refused(self):
+        with self.assertRaises(NotImplementedError):
+            compile_schema({"type": "array", "contains": {"type": "string"}})
+
+    def test_keyword_of_a_later_draft_is_refused(self):
+        schema = {
+            "$schema": "http://json-schema.org/draft-07/schema#",
+            "if": {"type": "string"},
+            "then": {"minLength": 2},
+        }
+        with self.assertRaises(NotImplementedError):
+            compile_schema(schema)
+
+    def test_keyword_unknown_to_the_draft_is_ignored(self):
+        schema = {
+            "$schema": "http://json-schema.org/draft-06/schema#",
+            "type": ["string", "null"],
+            "if": {"type": "string"},
+            "then": {"minLength": 2},
+        }
+        self.assert_same_decisions(schema, ["a", "ab", 1, None])
+
+    def test_unknown_engine_is_refused(self):
+        with self.assertRaises(ValueError):
+            validators.request_json_validator(
+                generate_scenemark(random.Random(5)), scenemark_schema, "SceneMark",
+                engine="compield")
+        with self.assertRaises(ValueError):
+            validators.set_validation_engine("compield")
+
+    def test_request_json_validator_engine(self):
+        scenemark = generate_scenemark(random.Random(4))
+        self.assertTrue(validators.request_json_validator(
+            scenemark, scenemark_schema, "SceneMark", engine="compiled"))
+        scenemark['AnalysisList'].append(copy.deepcopy(scenemark['AnalysisList'][0]))
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            validators.request_json_validator(
+                scenemark, scenemark_schema, "SceneMark", engine="compiled")
+
+if __name__ == '__main__':
+    unittest.main()
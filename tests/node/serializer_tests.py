@@ -0,0 +1,55 @@
+"""
+Unit-tests for the pluggable JSON serializers
+"""
+
+import json
+import unittest
+from scenera.node import json_backend
+from scenera.node.batch import np
+from scenera.node.records import BoundingBox, DetectedObject
+from tests.node.scenemark_validation_tests import load_scenemark
+
+class SerializerTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        json_backend.set_serializer(json_backend.available_serializers()[0])
+
+    def test_standard_library_bytes(self):
+        json_backend.set_serializer("json")
+        value = {"SceneMarkID": "SMK_é", "List": [1, 2.5, None, True], 3: "int key"}
+        self.assertEqual(json_backend.dumps(value), json.dumps(value).encode("utf-8"))
+        with self.assertRaises(TypeError):
+            json_backend.dumps({"Value": object()})
+
+    def test_serializers_give_the_same_scenemark(self):
+        sm = load_scenemark()
+        sm.add_analysis_list_item("Detected", "ItemPresence", detected_objects = [
+            DetectedObject("Human", "None", bounding_box = BoundingBox(0.1, 0.2, 0.3, 0.4))])
+        json_backend.set_serializer("json")
+        expected = sm._dump_scenemark()
+        for serializer in json_backend.available_serializers():
+            json_backend.set_serializer(serializer)
+            self.assertEqual(json.loads(sm._dump_scenemark()), json.loads(expected))
+            self.assertEqual(json.loads(sm._stream_scenemark()), json.loads(expected))
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_numpy(self):
+        value = {
+            "Probability": np.float32(0.5),
+            "Frame": np.int64(3),
+            "Box": np.array([1.5, 2.0]),
+            "Rows": np.arange(4, dtype = np.uint8).reshape(2, 2),
+            "Flags": np.array([True, False])[::-1],
+            }
+        expected = {"Probability": 0.5, "Frame": 3, "Box": [1.5, 2.0],
+            "Rows": [[0, 1], [2, 3]], "Flags": [False, True]}
+        for serializer in json_backend.available_serializers():
+            json_backend.set_serializer(serializer)
+            self.assertEqual(json.loads(json_backend.dumps(value)), expected)
+
+    def test_unknown_serializer(self):
+        with self.assertRaises(ValueError):
+            json_backend.set_serializer("ujson")
+
+if __name__ == '__main__':
+    unittest.main()
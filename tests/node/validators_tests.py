@@ -0,0 +1,70 @@
+"""
+Unit-tests for the schema validators
+"""
+
+import copy
+import threading
+import unittest
+import jsonschema
+from scenera.node import validators
+from scenera.node.nodesequencer_header_schema import nodesequencer_header_schema
+from scenera.node.scenemark_schema import scenemark_schema
+from tests.node.scenemark_tests import Request
+
+def valid_scenemark():
+    return copy.deepcopy(Request().json['SceneMark'])
+
+class ValidatorRegistryTestCase(unittest.TestCase):
+
+    def test_validator_is_built_once(self):
+        first = validators.get_validator(scenemark_schema)
+        second = validators.get_validator(scenemark_schema)
+        self.assertIs(first, second)
+
+    def test_validator_is_built_once_across_threads(self):
+        schema = copy.deepcopy(nodesequencer_header_schema)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(validators.get_validator(schema)))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(validator) for validator in results}), 1)
+
+    def test_warm_validators(self):
+        validators.warm_validators()
+        self.assertIn(("jsonschema", id(scenemark_schema)), validators._validator_registry)
+        self.assertIn(("jsonschema", id(nodesequencer_header_schema)), validators._validator_registry)
+
+    def test_registry_is_bounded(self):
+        schemas = [copy.deepcopy(nodesequencer_header_schema)
+                   for _ in range(validators.REGISTRY_SIZE + 1)]
+        for schema in schemas:
+            validators.get_validator(schema)
+        self.assertLessEqual(len(validators._validator_registry), validators.REGISTRY_SIZE)
+        self.assertNotIn(("jsonschema", id(schemas[0])), validators._validator_registry)
+        self.assertIn(("jsonschema", id(schemas[-1])), validators._validator_registry)
+
+    def test_correct_scenemark_passes(self):
+        self.assertTrue(
+            validators.request_json_validator(valid_scenemark(), scenemark_schema, "SceneMark"))
+
+    def test_incorrect_scenemark_raises_error(self):
+        scenemark = valid_scenemark()
+        scenemark['SceneMarkStatus'] = "Unknown"
+        with self.assertRaises(jsonschema.exceptions.ValidationError):
+            validators.request_json_validator(scenemark, scenemark_schema, "SceneMark")
+
+    def test_same_message_as_jsonschema_validate(self):
+        scenemark = valid_scenemark()
+        del scenemark['Version']
+        with self.assertRaises(jsonschema.exceptions.ValidationError) as reference:
+            jsonschema.validate(scenemark, scenemark_schema)
+        with self.assertRaises(jsonschema.exceptions.ValidationError) as cached:
+            validators.request_json_validator(scenemark, scenemark_schema, "SceneMark")
+        self.assertEqual(reference.exception.message, cached.exception.message)
+
+if __name__ == '__main__':
+    unittest.main()